@@ -7,12 +7,25 @@
 import click
 import os
 import time 
+import fnmatch
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from InquirerPy import prompt
 
 # -- internal imports -- #
 from core.input_parser import Parser
 from core.model import Model
+from core.matrix_model import MatrixModel
+from core.myopic import MyopicModel
+from core.benders import BendersModel
+from core.pruning import prune_inactive
+from core.parse_cache import ParseCache, BuildCache
+from core.profiler import Profiler
+from core.output_arrays import Dtypes, to_array_layout
+from core.solver import Solvers
+from core.benchmark import Sizes, Phases, run_benchmark, compare, write_results, read_results
+from core.clustering import Methods, Period_Lengths, read_profiles, select_periods, write_selection
 from core.plotter import Plotter, PlotType
 from core.data_access import DAO
 import sqlite3
@@ -22,6 +35,7 @@ DATA_DIR_PATH = Path(".").joinpath('Data')
 TECHMAP_DIR_PATH = Path(".").joinpath('Data', 'Techmap')
 TS_DIR_PATH = Path(".").joinpath('Data', 'TimeSeries')
 RUNS_DIR_PATH = Path(".").joinpath('Runs')
+CACHE_DIR_PATH = Path(".").joinpath('Data', '.cache')
 
 FNAME_MODEL = 'db.sqlite'
 # -- Helpers -- #
@@ -33,6 +47,10 @@ def get_existing_models():
       files = [tm for tm in files if not tm.startswith('~')]
       return [tm.split('.')[0] for tm in files if tm.endswith('.xlsx')]
 
+def get_scenarios(model_name):
+   """Return the scenarios of a model, cached by the content of its techmap"""
+   return ParseCache(CACHE_DIR_PATH.joinpath('parse')).scenarios(model_name, TECHMAP_DIR_PATH)
+
 def get_runs():
    """Return a list of existing runs"""
    return [entry.name for entry in RUNS_DIR_PATH.iterdir() if entry.is_dir()]
@@ -48,8 +66,9 @@ def get_list_inquirer_choices(choices, name=None, message=None, type='list'):
 
 def prompt_commodities(dao):
       cos = [str(c) for c in dao.get_set("commodity")]
-      # remove Dummy
-      cos.remove('Dummy')
+      # remove Dummy, it is pruned if no subprocess uses it
+      if 'Dummy' in cos:
+         cos.remove('Dummy')
 
       return prompt(get_list_inquirer_choices(cos, name='commodities', type='checkbox', message='Select commodities: Select with spacebar and confirm with enter'))['commodities']
 
@@ -58,6 +77,143 @@ def prompt_years(dao):
     return prompt(get_list_inquirer_choices(yy, name='years', type='checkbox', message='Select years: Select with spacebar and confirm with enter'))['years']
    
 
+def get_run_db_path(run):
+   """Return the database of a run given by its name in Runs, its directory or its database file"""
+   path = Path(run)
+   if path.is_file():
+      return path
+   if path.is_dir():
+      return path.joinpath(FNAME_MODEL)
+   return RUNS_DIR_PATH.joinpath(run, FNAME_MODEL)
+
+def run_scenario(model_name, scenario, builder='matrix', solver='gurobi', threads=None, warm_start=None, aggregation=None, foresight=None, benders=False, compact=False, prune=True, profile=False, cache=True, build_cache=False, array_output=None, verbose=True):
+   """Parse, build, solve and save one scenario into Runs/<model>-<scenario>. Returns the phase timings."""
+   echo = print if verbose else (lambda *args, **kwargs: None)
+   model_class = BendersModel if benders else MatrixModel if builder == 'matrix' else Model
+   timings = {}
+   profiler = Profiler() if profile else None
+   phase = profiler.phase if profile else (lambda name: nullcontext())
+
+   # Create a directory for the model if it does not exist
+   db_dir_path = RUNS_DIR_PATH.joinpath(model_name+'-'+scenario)
+   RUNS_DIR_PATH.mkdir(exist_ok=True)
+   db_dir_path.mkdir(exist_ok=True)
+
+   # Create and Run the model
+   conn = sqlite3.connect(":memory:")
+   parser = Parser(model_name, techmap_dir_path=TECHMAP_DIR_PATH, ts_dir_path=TS_DIR_PATH, db_conn = conn, scenario = scenario, aggregation = aggregation)
+
+   # Parse
+   echo("\n#-- Parsing started --#")
+   st = time.time()
+   with phase('parse'):
+      parse_cache = ParseCache(CACHE_DIR_PATH.joinpath('parse'))
+      cached = parse_cache.parse(parser) if cache else parser.parse()
+      if prune:
+         pruned = prune_inactive(conn)
+   timings['parse'] = time.time()-st
+   echo(f"Parsing finished in {timings['parse']:.2f} seconds" + (" (from the parse cache)" if cached else ""))
+   if prune and any(pruned.values()):
+      echo(f"Pruned {pruned['conversion_subprocess']} inactive subprocesses and {pruned['commodity']} unused commodities (see table pruned)")
+
+   if foresight is not None:
+      # Myopic mode: every window is built, solved and saved in turn
+      echo(f"\n#-- Solving myopic windows started ({foresight} year foresight, {solver}) --#")
+      st = time.time()
+      with phase('myopic'):
+         myopic = MyopicModel(conn, solver=solver, threads=threads, foresight=foresight, compact=compact)
+         myopic.solve_and_save(callback=lambda window, stats: echo(f"Window {window[0]}-{window[-1]} solved in {stats['solve_time']:.2f} seconds (status {stats['status']})"))
+      stats = myopic.stats
+      timings['build'] = stats['build_time']
+      timings['solve'] = time.time()-st-stats['build_time']
+      timings['status'] = stats['status']
+      if profile:
+         profiler.solver = stats
+      echo(f"Solving {len(stats['windows'])} windows finished in {time.time()-st:.2f} seconds (build {stats['build_time']:.2f} s, solver time {stats['solve_time']:.2f} s)")
+      echo("\n#-- Saving model started --#")
+      st = time.time()
+   else:
+      # Build
+      echo(f"\n#-- Building model started ({builder} builder, {solver}) --#")
+      st = time.time()
+      options = {'compact': True} if compact else {} # the expression builder has no compact formulation
+      # the built model is cached with the parsed inputs, only for the plain matrix builder
+      build_cache = BuildCache(CACHE_DIR_PATH.joinpath('build')) if build_cache and cache and model_class is MatrixModel else None
+      with phase('build'):
+         if build_cache is not None:
+            build_key = BuildCache.key(parse_cache.fingerprint, prune=prune, compact=compact)
+            model_instance = build_cache.load(build_key, conn, solver=solver, threads=threads)
+            loaded = model_instance is not None
+            if not loaded:
+               model_instance = model_class(conn=conn, solver=solver, threads=threads, keep_build=True, **options)
+               build_cache.store(build_key, model_instance, model_name=model_name, scenario=scenario, aggregation=aggregation, prune=prune, compact=compact)
+         else:
+            loaded = False
+            model_instance = model_class(conn=conn, solver=solver, threads=threads, **options)
+      timings['build'] = time.time()-st
+      echo(f"Building model finished in {timings['build']:.2f} seconds" + (" (from the build cache)" if loaded else ""))
+      removed = {family: n for family, n in getattr(model_instance, 'removed_rows', {}).items() if n}
+      if removed:
+         echo(f"Redundant rows removed: {', '.join(f'{family} {n}' for family, n in removed.items())}")
+
+      # Warm start
+      if warm_start is not None:
+         with phase('warm_start'):
+            seeded = model_instance.warm_start(get_run_db_path(warm_start))
+         echo(f"Warm start from {warm_start}: {seeded} variables seeded")
+
+      # Solve
+      echo(f"\n#-- Solving model started ({solver}) --#")
+      st = time.time()
+      with phase('solve'):
+         if benders:
+            model_instance.solve(callback=lambda it, lb, ub: echo(f"Iteration {it}: lower bound {lb:.6g}, upper bound {ub:.6g}"))
+         else:
+            model_instance.solve()
+      timings['solve'] = time.time()-st
+      stats = model_instance.backend.stats
+      timings['status'] = stats['status']
+      if profile:
+         profiler.solver = {**stats, **model_instance.backend.solver_stats()}
+      echo(f"Solving model finished in {timings['solve']:.2f} seconds (solver time {stats['solve_time']:.2f} s, {stats['iterations']} iterations, status {stats['status']})")
+
+      # Save
+      echo("\n#-- Saving model started --#")
+      st = time.time()
+
+   db_path = db_dir_path.joinpath(FNAME_MODEL)
+   with phase('save'):
+      if foresight is None:
+         model_instance.save_output()
+      if array_output is not None:
+         to_array_layout(conn, array_output)
+
+      if db_path.exists():
+         # Delete the file using unlink()
+         db_path.unlink()
+      
+      # write the in-memory db to disk
+      disk_db_conn = sqlite3.connect(db_path)
+      conn.backup(disk_db_conn)
+      disk_db_conn.close()
+   
+   timings['save'] = time.time()-st
+   echo(f"Saving model finished in {timings['save']:.2f} seconds")
+
+   if profile:
+      options = {'builder': builder, 'solver': solver, 'aggregation': aggregation, 'foresight': foresight, 'benders': benders, 'compact': compact, 'prune': prune, 'array_output': array_output}
+      json_path = profiler.write(db_path, info={'model': model_name, 'scenario': scenario, 'options': options})
+      echo(f"Profile written to {json_path} and the table run_stats")
+   return timings
+
+def _sweep_worker(model_name, scenario, builder, solver, threads, aggregation, foresight, compact, prune, cache, array_output):
+   """Process pool entry point of the sweep command, failures are reported instead of raised"""
+   try:
+      return run_scenario(model_name, scenario, builder=builder, solver=solver, threads=threads, aggregation=aggregation, foresight=foresight, compact=compact, prune=prune, cache=cache, array_output=array_output, verbose=False)
+   except Exception as e:
+      return {'status': f"failed: {e}"}
+   
+
 # -- Main CLI Application -- #
 @click.group()
 def app():
@@ -66,7 +222,19 @@ def app():
 @app.command(name='run')
 @click.option('--model_name', '-m', help='Name of the model to run', default=None)
 @click.option('--scenario', '-s', help='Name of the scenario to run', default=None)
-def run(model_name, scenario):
+@click.option('--builder', '-b', help='Model builder: vectorized (matrix) or the reference builder (expression)', type=click.Choice(['matrix', 'expression']), default='matrix')
+@click.option('--solver', help='LP solver backend, the expression builder only supports gurobi', type=click.Choice(list(Solvers)), default='gurobi')
+@click.option('--warm-start-from', 'warm_start', help='Previous run (name in Runs or path) whose solution is used as start values', default=None)
+@click.option('--aggregate', 'aggregation', help="Merge consecutive time steps: fixed blocks ('3h') or a number of adaptive segments ('adaptive:500')", default=None)
+@click.option('--myopic', 'foresight', help='Solve the years one window at a time (myopic mode), the value is the number of years in each window', type=int, default=None)
+@click.option('--benders', help='Decompose into a capacity master problem and one operational subproblem per year, solved in parallel processes', is_flag=True, default=False)
+@click.option('--compact', help='Substitute the energy variables by their expressions in the power variables, which gives a smaller LP', is_flag=True, default=False)
+@click.option('--no-prune', 'no_prune', help='Keep the subprocesses that can never be active and the commodities no subprocess uses', is_flag=True, default=False)
+@click.option('--no-cache', 'no_cache', help='Parse the techmap and time series even if the parse cache has the scenario', is_flag=True, default=False)
+@click.option('--build-cache', 'build_cache', help='Keep the built LP in the cache and load it instead of building when the inputs are unchanged (matrix builder)', is_flag=True, default=False)
+@click.option('--array-output', 'array_output', help='Store the time series outputs with one row per subprocess (or commodity) and year holding the values of all time steps, output_cs_y_t and output_co_y_t become views', type=click.Choice(list(Dtypes)), default=None)
+@click.option('--profile', help='Write the time, memory and queries of each phase, the size of each variable and constraint family and the solver statistics to profile.json and the table run_stats', is_flag=True, default=False)
+def run(model_name, scenario, builder, solver, warm_start, aggregation, foresight, benders, compact, no_prune, no_cache, build_cache, array_output, profile):
    """Run the Model"""
 
    # print(f'Running model {model_name} with scenario {scenario}')
@@ -80,62 +248,171 @@ def run(model_name, scenario):
       model_name = prompt(get_list_inquirer_choices(get_existing_models(), name='model_name', message='Please choose a model to run'))['model_name']
    
 
-   if scenario is not None and scenario not in Parser.pre_check_scenarios(model_name, techmap_dir_path=TECHMAP_DIR_PATH):
+   if scenario is not None and scenario not in get_scenarios(model_name):
       click.secho(f"Invalid Scenario argument. Scenario {scenario} does not exist.", fg="red")
       scenario = None
    
    if scenario is None:
-      scenario_choices = Parser.pre_check_scenarios(model_name, techmap_dir_path=TECHMAP_DIR_PATH)
+      scenario_choices = get_scenarios(model_name)
       scenario = prompt(get_list_inquirer_choices(scenario_choices, name='scenario', message='Please choose a scenario to run'))['scenario']
 
 
-   # Create a directory for the model if it does not exist
-   db_dir_path = RUNS_DIR_PATH.joinpath(model_name+'-'+scenario)
-   if not RUNS_DIR_PATH.exists():
-     os.mkdir(RUNS_DIR_PATH)
-   
-   if not os.path.exists(db_dir_path):
-      os.mkdir(db_dir_path)
+   model_class = MatrixModel if builder == 'matrix' else Model
+   if solver not in model_class.solvers:
+      click.secho(f"The {builder} builder does not support the solver {solver}.", fg="red")
+      return
 
-   # Create and Run the model
-   conn = sqlite3.connect(":memory:")
-   parser = Parser(model_name, techmap_dir_path=TECHMAP_DIR_PATH, ts_dir_path=TS_DIR_PATH, db_conn = conn, scenario = scenario)
+   if warm_start is not None and not get_run_db_path(warm_start).exists():
+      click.secho(f"Invalid warm start argument. Run {warm_start} does not exist.", fg="red")
+      return
 
-   # Parse
-   print("\n#-- Parsing started --#")
-   st = time.time()
-   parser.parse()
-   print(f"Parsing finished in {time.time()-st:.2f} seconds")
+   if warm_start is not None and solver != 'gurobi':
+      click.secho("Warm starts require Gurobi, HiGHS does not use start values for an LP.", fg="red")
+      return
 
-   # Build
-   print("\n#-- Building model started --#")
-   st = time.time()
-   model_instance = Model(conn=conn)
-   print(f"Building model finished in {time.time()-st:.2f} seconds")
+   if foresight is not None and (builder != 'matrix' or warm_start is not None):
+      click.secho("The myopic mode requires the matrix builder and can not be warm started.", fg="red")
+      return
 
-   # Solve
-   print("\n#-- Solving model started --#")
-   st = time.time()
-   model_instance.solve()
-   print(f"Solving model finished in {time.time()-st:.2f} seconds")
+   if benders and (builder != 'matrix' or warm_start is not None or foresight is not None):
+      click.secho("The Benders decomposition requires the matrix builder and can not be combined with a warm start or the myopic mode.", fg="red")
+      return
 
-   # Save
-   print("\n#-- Saving model started --#")
-   st = time.time()
-   model_instance.save_output()
+   if compact and (builder != 'matrix' or benders):
+      click.secho("The compact formulation requires the matrix builder and can not be combined with the Benders decomposition.", fg="red")
+      return
 
-   
-   db_path = db_dir_path.joinpath(FNAME_MODEL)
-   if db_path.exists():
-      # Delete the file using unlink()
-      db_path.unlink()
-   
-   # write the in-memory db to disk
-   disk_db_conn = sqlite3.connect(db_path)
-   conn.backup(disk_db_conn)
-   
-   print(f"Saving model finished in {time.time()-st:.2f} seconds")
+   run_scenario(model_name, scenario, builder=builder, solver=solver, warm_start=warm_start, aggregation=aggregation, foresight=foresight, benders=benders, compact=compact, prune=not no_prune, profile=profile, cache=not no_cache, build_cache=build_cache, array_output=array_output)
      
+@app.command(name='sweep')
+@click.option('--model_name', '-m', help='Name of the model to run', required=True)
+@click.option('--scenario', '-s', 'scenarios', help='Scenario name or glob pattern, can be repeated. Defaults to all scenarios of the model', multiple=True)
+@click.option('--builder', '-b', help='Model builder: vectorized (matrix) or the reference builder (expression)', type=click.Choice(['matrix', 'expression']), default='matrix')
+@click.option('--solver', help='LP solver backend, the expression builder only supports gurobi', type=click.Choice(list(Solvers)), default='gurobi')
+@click.option('--workers', '-j', help='Number of scenarios solved in parallel. Defaults to one per scenario, at most one per core', type=int, default=None)
+@click.option('--aggregate', 'aggregation', help="Merge consecutive time steps: fixed blocks ('3h') or a number of adaptive segments ('adaptive:500')", default=None)
+@click.option('--myopic', 'foresight', help='Solve the years one window at a time (myopic mode), the value is the number of years in each window', type=int, default=None)
+@click.option('--compact', help='Substitute the energy variables by their expressions in the power variables, which gives a smaller LP', is_flag=True, default=False)
+@click.option('--no-prune', 'no_prune', help='Keep the subprocesses that can never be active and the commodities no subprocess uses', is_flag=True, default=False)
+@click.option('--no-cache', 'no_cache', help='Parse the techmap and time series even if the parse cache has the scenario', is_flag=True, default=False)
+@click.option('--array-output', 'array_output', help='Store the time series outputs with one row per subprocess (or commodity) and year holding the values of all time steps, output_cs_y_t and output_co_y_t become views', type=click.Choice(list(Dtypes)), default=None)
+def sweep(model_name, scenarios, builder, solver, workers, aggregation, foresight, compact, no_prune, no_cache, array_output):
+   """Run several scenarios of a model in parallel"""
+   if model_name not in get_existing_models():
+      click.secho(f"Invalid Model argument. Model {model_name} does not exist.", fg="red")
+      return
+   model_class = MatrixModel if builder == 'matrix' else Model
+   if solver not in model_class.solvers:
+      click.secho(f"The {builder} builder does not support the solver {solver}.", fg="red")
+      return
+   if foresight is not None and builder != 'matrix':
+      click.secho("The myopic mode requires the matrix builder.", fg="red")
+      return
+   if compact and builder != 'matrix':
+      click.secho("The compact formulation requires the matrix builder.", fg="red")
+      return
+
+   all_scenarios = get_scenarios(model_name)
+   patterns = scenarios or ('*',)
+   selected = [sc for sc in all_scenarios if any(fnmatch.fnmatchcase(sc, p) for p in patterns)]
+   if not selected:
+      click.secho(f"No scenario matches {', '.join(patterns)}. Existing scenarios: {', '.join(all_scenarios)}", fg="red")
+      return
+
+   # split the cores between the workers so that the solvers do not oversubscribe them
+   cores = os.cpu_count() or 1
+   workers = max(1, min(workers or cores, len(selected)))
+   threads = max(1, cores // workers)
+   print(f"Running {len(selected)} scenarios of {model_name} with {workers} workers and {threads} solver threads each")
+
+   RUNS_DIR_PATH.mkdir(exist_ok=True)
+   results = {}
+   st = time.time()
+   with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = {pool.submit(_sweep_worker, model_name, sc, builder, solver, threads, aggregation, foresight, compact, not no_prune, not no_cache, array_output): sc for sc in selected}
+      for future in as_completed(futures):
+         sc = futures[future]
+         results[sc] = future.result()
+         print(f"Scenario {sc} finished: {results[sc]['status']}")
+
+   # Summary
+   phases = ['parse', 'build', 'solve', 'save']
+   width = max(len('scenario'), *(len(sc) for sc in selected))
+   print(f"\n{'scenario':<{width}} " + " ".join(f"{p:>9}" for p in phases) + f" {'total':>9}  status")
+   for sc in selected:
+      timings = results[sc]
+      cells = [f"{timings[p]:9.2f}" if p in timings else f"{'-':>9}" for p in phases]
+      total = sum(timings.get(p, 0) for p in phases)
+      print(f"{sc:<{width}} " + " ".join(cells) + f" {total:9.2f}  {timings['status']}")
+   print(f"Sweep finished in {time.time()-st:.2f} seconds")
+
+@app.command(name='benchmark')
+@click.option('--size', '-z', 'sizes', help='Size of the synthetic techmap, can be repeated. Defaults to small', type=click.Choice(list(Sizes)), multiple=True)
+@click.option('--commodities', help='Number of commodities, overrides the size', type=int, default=None)
+@click.option('--subprocesses', help='Number of conversion subprocesses, overrides the size', type=int, default=None)
+@click.option('--years', help='Number of years, overrides the size', type=int, default=None)
+@click.option('--time-steps', 'time_steps', help='Number of hourly time steps, overrides the size', type=int, default=None)
+@click.option('--builder', '-b', help='Model builder: vectorized (matrix) or the reference builder (expression)', type=click.Choice(['matrix', 'expression']), default='matrix')
+@click.option('--solver', help='LP solver backend, HiGHS needs no license', type=click.Choice(list(Solvers)), default='highs')
+@click.option('--build-only', 'build_only', help='Only parse and build, without solving and saving', is_flag=True, default=False)
+@click.option('--repeat', '-r', help='Runs per size, the fastest is reported', type=int, default=1)
+@click.option('--output', '-o', help='Results file (JSON)', default='benchmark.json')
+@click.option('--baseline', help='Results file of an earlier benchmark to compare with', default=None)
+@click.option('--tolerance', help='Relative slowdown or memory increase reported as regression', type=float, default=0.25)
+def benchmark(sizes, commodities, subprocesses, years, time_steps, builder, solver, build_only, repeat, output, baseline, tolerance):
+   """Run the pipeline on synthetic techmaps and compare with a baseline"""
+   model_class = MatrixModel if builder == 'matrix' else Model
+   if solver not in model_class.solvers:
+      click.secho(f"The {builder} builder does not support the solver {solver}.", fg="red")
+      return
+   if baseline is not None and not Path(baseline).exists():
+      click.secho(f"Invalid baseline argument. File {baseline} does not exist.", fg="red")
+      return
+   overrides = {key: value for key, value in [('commodities', commodities), ('subprocesses', subprocesses), ('years', years), ('time_steps', time_steps)] if value is not None}
+   selected = {name: {**Sizes[name], **overrides} for name in (sizes or ('small',))}
+
+   phases = Phases[:2] if build_only else Phases
+   print(f"{'size':<8} " + " ".join(f"{p:>9}" for p in phases) + f" {'peak MB':>9} {'rows':>9} {'nonzeros':>10}")
+   def report(name, result):
+      cells = " ".join(f"{result['phases'][p]['time']:9.2f}" for p in phases)
+      peak = max(values['peak_rss_mb'] for values in result['phases'].values())
+      print(f"{name:<8} {cells} {peak:9.0f} {result['rows']:9d} {result['nonzeros']:10d}")
+   results = run_benchmark(selected, builder=builder, solver=solver, build_only=build_only, repeat=repeat, callback=report)
+   write_results(output, results)
+   print(f"Results written to {output}")
+
+   if baseline is not None:
+      regressions = compare(results, read_results(baseline), tolerance=tolerance)
+      for message in regressions:
+         click.secho(message, fg="red")
+      if regressions:
+         raise SystemExit(1)
+      click.secho(f"No regression against {baseline}", fg="green")
+
+@app.command(name='cluster')
+@click.option('--model_name', '-m', help='Name of the model whose profiles are clustered', required=True)
+@click.option('--name', '-n', 'tss_name', help='Name of the time step selection (TSS) to write', required=True)
+@click.option('--periods', '-k', help='Number of representative periods', type=int, default=8)
+@click.option('--period', help='Length of a representative period', type=click.Choice(list(Period_Lengths)), default='day')
+@click.option('--method', help='Clustering method', type=click.Choice(list(Methods)), default='kmeans')
+@click.option('--max-error', help='Increase the number of periods until the annual mean of every profile is within this relative error', type=float, default=None)
+def cluster(model_name, tss_name, periods, period, method, max_error):
+   """Select representative periods of the time series of a model"""
+   if model_name not in get_existing_models():
+      click.secho(f"Invalid Model argument. Model {model_name} does not exist.", fg="red")
+      return
+
+   profiles = read_profiles(TECHMAP_DIR_PATH.joinpath(f"{model_name}.xlsx"), TS_DIR_PATH)
+   selection = select_periods(profiles, periods, period=period, method=method, max_error=max_error)
+   tss_path, weights_path = write_selection(TS_DIR_PATH, tss_name, selection)
+
+   print(f"Selected {len(selection.hours) // Period_Lengths[period]} representative {period}s ({len(selection.hours)} time steps) with {method}")
+   print("Relative error of the annual mean per profile:")
+   for name, error in selection.errors.items():
+      print(f"  {name}: {error:.2%}")
+   print(f"Written {tss_path} and {weights_path}")
+   click.secho(f"Add {tss_name} with dt 1 to the TSS sheet of the techmap to use it in a scenario.", fg="yellow")
+
 @app.command(name='plot')
 def plot():
    """Visualize the results of a simulation"""
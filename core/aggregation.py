@@ -0,0 +1,103 @@
+"""
+Temporal Aggregation
+
+Merges consecutive time steps of a time step selection into segments of
+variable length. A segment becomes one time step of the model, its duration
+dt is the sum of the merged durations and its profile values are the means
+over the merged hours. Segments never extend over a gap of the selection
+(e.g. between two representative weeks).
+
+Aggregation modes:
+    "<n>h"          fixed blocks of n hours, e.g. "3h"
+    "adaptive:<n>"  n segments, merging the consecutive hours whose profiles are most similar
+"""
+
+import heapq
+import re
+import numpy as np
+
+
+def _runs(tss_values: np.ndarray, dt: int) -> list:
+    """Start positions of the runs of consecutive time steps (hours dt apart)"""
+    breaks = np.nonzero(np.diff(tss_values) != dt)[0] + 1
+    return [0, *breaks.tolist(), len(tss_values)]
+
+
+def fixed_segments(tss_values: np.ndarray, dt: int, block_hours: int) -> np.ndarray:
+    """Start positions of blocks of block_hours, restarting at every gap"""
+    if block_hours % dt != 0:
+        raise ValueError(f"The block length {block_hours}h is not a multiple of the time step of {dt}h")
+    bounds = _runs(tss_values, dt)
+    return np.concatenate([np.arange(start, end, block_hours // dt) for start, end in zip(bounds[:-1], bounds[1:])])
+
+
+def adaptive_segments(tss_values: np.ndarray, dt: int, features: np.ndarray, n_segments: int) -> np.ndarray:
+    """
+    Start positions of n_segments segments. Starting from single time steps, the
+    two neighbouring segments whose merge adds the least squared deviation from
+    the segment means (Ward's criterion) are merged until n_segments are left.
+    features has one row per time step.
+    """
+    n = len(tss_values)
+    features = np.asarray(features, dtype=float).reshape(n, -1)
+    gap = np.zeros(n, dtype=bool)
+    gap[_runs(tss_values, dt)[1:-1]] = True # a segment must not start before a gap and end after it
+    n_segments = max(n_segments, int(gap.sum()) + 1)
+
+    sizes = np.ones(n)
+    sums = features.copy()
+    next_start = np.arange(1, n + 1) # start of the following segment, n at the end
+    prev_start = np.arange(-1, n - 1)
+    alive = np.ones(n, dtype=bool)
+    version = np.zeros(n, dtype=int) # bumped whenever a segment grows, so that older heap entries are skipped
+
+    def push(a, b):
+        diff = sums[a] / sizes[a] - sums[b] / sizes[b]
+        cost = sizes[a] * sizes[b] / (sizes[a] + sizes[b]) * (diff @ diff)
+        heapq.heappush(heap, (cost, a, b, version[a], version[b]))
+
+    heap = []
+    for a in range(n - 1):
+        if not gap[a + 1]:
+            push(a, a + 1)
+    n_alive = n
+    while n_alive > n_segments and heap:
+        _, a, b, version_a, version_b = heapq.heappop(heap)
+        if not (alive[a] and alive[b] and version[a] == version_a and version[b] == version_b):
+            continue
+        # merge b into a
+        sizes[a] += sizes[b]
+        sums[a] += sums[b]
+        alive[b] = False
+        version[a] += 1
+        next_start[a] = next_start[b]
+        if next_start[a] < n:
+            prev_start[next_start[a]] = a
+        n_alive -= 1
+        if prev_start[a] >= 0 and not gap[a]:
+            push(prev_start[a], a)
+        if next_start[a] < n and not gap[next_start[a]]:
+            push(a, next_start[a])
+    return np.nonzero(alive)[0]
+
+
+def segment_starts(mode: str, tss_values: np.ndarray, dt: int, features: np.ndarray = None) -> np.ndarray:
+    """Start positions of the segments for an aggregation mode (see the module docstring)"""
+    tss_values = np.asarray(tss_values)
+    if match := re.fullmatch(r"(\d+)h", mode):
+        return fixed_segments(tss_values, dt, int(match.group(1)))
+    if match := re.fullmatch(r"adaptive:(\d+)", mode):
+        if features is None:
+            raise ValueError("Adaptive aggregation needs the profiles of the time steps")
+        return adaptive_segments(tss_values, dt, features, int(match.group(1)))
+    raise ValueError(f"Unknown aggregation {mode}, use '<n>h' for fixed blocks or 'adaptive:<n>' for n segments")
+
+
+def profile_features(profiles: dict, tss_values: np.ndarray) -> np.ndarray:
+    """Profiles at the selected hours scaled to [0, 1], one row per time step and one column per profile"""
+    columns = []
+    for values in profiles.values():
+        values = np.asarray(values, dtype=float)[np.asarray(tss_values) - 1]
+        span = values.max() - values.min()
+        columns.append((values - values.min()) / span if span > 0 else np.zeros_like(values))
+    return np.column_stack(columns) if columns else np.zeros((len(tss_values), 1))
@@ -0,0 +1,222 @@
+"""
+Benchmark Suite
+
+Generates synthetic techmaps of a given size and runs the pipeline (parse,
+build, solve, save) on them, recording the time and peak memory of each phase.
+The size is set independently by the number of commodities, subprocesses,
+years and time steps. Results are written as JSON and can be compared against
+a stored baseline to find regressions.
+
+The synthetic system has one energy carrier per commodity. Every carrier has a
+demand and an expensive import, so any size is feasible; the other
+subprocesses are renewables with an availability profile, converters between
+carriers and storages, in turn.
+"""
+
+import json
+import platform
+import sqlite3
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from core.input_parser import Parser
+from core.matrix_model import MatrixModel
+from core.model import Model
+from core.profiler import Profiler
+from core.pruning import prune_inactive
+
+# commodities, subprocesses, years, time_steps; small runs in seconds with HiGHS
+Sizes = {
+    "small": {"commodities": 3, "subprocesses": 12, "years": 2, "time_steps": 24},
+    "medium": {"commodities": 4, "subprocesses": 24, "years": 3, "time_steps": 168},
+    "large": {"commodities": 8, "subprocesses": 80, "years": 5, "time_steps": 1008},
+}
+Phases = ("parse", "build", "solve", "save")
+
+_Units = pd.DataFrame({
+    "quantity": ["power", "energy", "co2_emissions", "cost_energy", "cost_power", "co2_spec", "money"],
+    "input": ["GW", "TWh", "Mio t", "EUR/MWh", "EUR/kW", "kg/kWh", "Mio EUR"],
+    "scale_factor": [1, 1000, 1, 0.001, 1, 0.001, 1],
+    "output": ["GW", "GWh", "Mio t", "Mio EUR/GWh", "Mio EUR/GW", "Mio t/GWh", "Mio EUR"],
+})
+_CS_Columns = [
+    "conversion_process_name", "commodity_in", "commodity_out", "scenario", "is_storage", "efficiency_charge", "c_rate",
+    "spec_co2", "efficiency", "technical_availability", "cap_res_max", "cap_res_min", "cap_min", "cap_max",
+    "technical_lifetime", "opex_cost_energy", "opex_cost_power", "capex_cost_power", "max_eout", "min_eout",
+    "out_frac_min", "out_frac_max", "in_frac_min", "in_frac_max", "output_profile", "availability_profile",
+]
+_N_Profiles = 4 # distinct availability and demand profiles
+
+
+def _profiles(rng: np.random.Generator) -> dict:
+    """Full-year availability (solar and wind like) and demand profiles by name"""
+    h = np.arange(8760)
+    day, season = 2 * np.pi * (h % 24) / 24, 2 * np.pi * h / 8760
+    profiles = {}
+    for i in range(_N_Profiles):
+        solar = np.clip(np.sin(day - np.pi / 2 + rng.normal(0, 0.2)), 0, None) * (0.7 - 0.3 * np.cos(season))
+        wind = np.clip(0.4 + 0.2 * np.cos(season) + np.cumsum(rng.normal(0, 0.02, 8760)) % 0.6 - 0.3, 0, 1)
+        profiles[f"bench_avail_{i}"] = solar if i % 2 == 0 else wind
+        profiles[f"bench_demand_{i}"] = 1 + 0.3 * np.sin(day + rng.uniform(0, np.pi)) + 0.2 * np.cos(season)
+    return profiles
+
+
+def _subprocesses(carriers: list, n: int, rng: np.random.Generator) -> list:
+    """Rows of the ConversionSubProcess sheet"""
+    rows = []
+    for i, co in enumerate(carriers):
+        rows.append(dict(conversion_process_name=f"Demand_{co}", commodity_in=co, commodity_out="Dummy", min_eout=rng.uniform(20, 100), output_profile=f"bench_demand_{i % _N_Profiles}"))
+        rows.append(dict(conversion_process_name=f"Import_{co}", commodity_in="Dummy", commodity_out=co, spec_co2=rng.uniform(0, 0.4), opex_cost_energy=rng.uniform(60, 120)))
+    kinds = ("renewable", "converter", "storage") if len(carriers) > 1 else ("renewable", "storage")
+    for i in range(max(n - len(rows), 0)):
+        kind = kinds[i % len(kinds)]
+        name = f"{kind.capitalize()}_{i}"
+        common = dict(conversion_process_name=name, technical_lifetime=int(rng.integers(15, 40)), capex_cost_power=rng.uniform(300, 1500), opex_cost_power=rng.uniform(5, 30))
+        if kind == "renewable":
+            co = carriers[int(rng.integers(len(carriers)))]
+            rows.append(dict(common, commodity_in="Dummy", commodity_out=co, availability_profile=f"bench_avail_{i % _N_Profiles}", cap_max=rng.uniform(20, 100)))
+        elif kind == "converter":
+            cin, cout = rng.choice(carriers, 2, replace=False)
+            rows.append(dict(common, commodity_in=cin, commodity_out=cout, efficiency=rng.uniform(0.3, 0.95), technical_availability=0.95, cap_res_max=rng.uniform(0, 5)))
+        else:
+            co = carriers[int(rng.integers(len(carriers)))]
+            rows.append(dict(common, commodity_in=co, commodity_out=co, is_storage=1, efficiency_charge=0.95, efficiency=0.95, c_rate=rng.uniform(0.1, 1)))
+    return [dict(row, scenario="Base") for row in rows[:max(n, 2 * len(carriers))]]
+
+
+def write_techmap(techmap_dir_path: Path, ts_dir_path: Path, name: str, commodities: int, subprocesses: int, years: int, time_steps: int, seed: int = 0) -> Path:
+    """
+    Writes a synthetic techmap with the sheets the parser expects, a scenario
+    Base and its time series. There are at least two subprocesses (demand and
+    import) per commodity. Returns the path of the techmap.
+    """
+    if not 1 <= time_steps <= 8760:
+        raise ValueError(f"The number of time steps must be between 1 and 8760, got {time_steps}")
+    rng = np.random.default_rng(seed)
+    techmap_dir_path, ts_dir_path = Path(techmap_dir_path), Path(ts_dir_path)
+    techmap_dir_path.mkdir(parents=True, exist_ok=True)
+    ts_dir_path.mkdir(parents=True, exist_ok=True)
+
+    carriers = [f"Carrier_{i}" for i in range(commodities)]
+    colors = [f"#{int(x):06x}" for x in rng.integers(0, 0xFFFFFF, commodities)]
+    rows = _subprocesses(carriers, subprocesses, rng)
+    sheets = {
+        "Units": _Units,
+        "Scenario": pd.DataFrame({
+            "scenario_name": ["Base"], "discount_rate": [0.05], "annual_co2_limit": [np.nan], "co2_price": [50],
+            "from_year": [2020], "until_year": [2020 + 5 * (years - 1)], "year_step": [5], "TSS": [f"{name}_tss"],
+        }),
+        "Commodity": pd.DataFrame({"commodity_name": ["Dummy"] + carriers, "description": np.nan, "color": [np.nan] + colors, "order": [np.nan] + list(range(1, commodities + 1))}),
+        "ConversionProcess": pd.DataFrame({
+            "conversion_process_name": [row["conversion_process_name"] for row in rows], "description": np.nan,
+            "color": [f"#{int(x):06x}" for x in rng.integers(0, 0xFFFFFF, len(rows))], "order": range(1, len(rows) + 1),
+        }),
+        # the two rows below the header hold the description and unit of each column
+        "ConversionSubProcess": pd.DataFrame([{c: "description" for c in _CS_Columns}, {c: "unit" for c in _CS_Columns}] + rows, columns=_CS_Columns),
+        "TSS": pd.DataFrame({"TSS_name": [f"{name}_tss"], "Description": [f"first {time_steps} hours"], "dt": [1]}),
+    }
+    techmap_path = techmap_dir_path.joinpath(f"{name}.xlsx")
+    with pd.ExcelWriter(techmap_path) as writer:
+        for sheet, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheet, index=False)
+
+    for ts_name, values in _profiles(rng).items():
+        ts_dir_path.joinpath(f"{ts_name}.txt").write_text(" ".join(f"{x:.6f}" for x in values))
+    ts_dir_path.joinpath(f"{name}_tss.txt").write_text("\n".join(str(x) for x in range(1, time_steps + 1)))
+    return techmap_path
+
+
+def run_pipeline(techmap_dir_path: Path, ts_dir_path: Path, name: str, db_path: Path, builder: str = "matrix", solver: str = "highs", build_only: bool = False) -> dict:
+    """Parses, builds, solves and saves the scenario Base of a techmap into db_path, returns the phases and the LP size"""
+    profiler = Profiler(detailed=False)
+    conn = sqlite3.connect(":memory:")
+    with profiler.phase("parse"):
+        Parser(name, techmap_dir_path=Path(techmap_dir_path), ts_dir_path=Path(ts_dir_path), db_conn=conn, scenario="Base").parse()
+        prune_inactive(conn)
+    with profiler.phase("build"):
+        model = (MatrixModel if builder == "matrix" else Model)(conn=conn, solver=solver)
+    result = model.backend.lp_size()
+    if not build_only:
+        with profiler.phase("solve"):
+            model.solve()
+        with profiler.phase("save"):
+            model.save_output()
+            disk_conn = sqlite3.connect(db_path)
+            conn.backup(disk_conn)
+            disk_conn.close()
+        stats = model.backend.solver_stats()
+        result.update(status=stats["status"], objective=stats["objective"], iterations=model.backend.stats["iterations"])
+    conn.close()
+    phases = {phase: {"time": values["time"], "peak_rss_mb": values["peak_rss_mb"]} for phase, values in profiler.phases.items()}
+    return {"phases": phases, **result}
+
+
+def run_benchmark(sizes: dict, builder: str = "matrix", solver: str = "highs", build_only: bool = False, repeat: int = 1, callback=None) -> dict:
+    """
+    Runs the pipeline on a synthetic techmap of every size (name -> dict of
+    commodities, subprocesses, years, time_steps). The time of a phase is the
+    minimum and its memory the maximum over the repetitions.
+    callback(size, result) is called after each size.
+    """
+    results = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(), "machine": platform.machine(),
+        "builder": builder, "solver": solver, "build_only": build_only, "repeat": repeat, "sizes": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        for size_name, size in sizes.items():
+            name = f"Bench_{size_name}"
+            write_techmap(tmp_dir / "Techmap", tmp_dir / "TimeSeries", name, **size)
+            runs = [run_pipeline(tmp_dir / "Techmap", tmp_dir / "TimeSeries", name, tmp_dir / f"{name}.sqlite", builder, solver, build_only) for _ in range(repeat)]
+            result = {**runs[0], "size": size}
+            result["phases"] = {
+                phase: {"time": min(run["phases"][phase]["time"] for run in runs), "peak_rss_mb": max(run["phases"][phase]["peak_rss_mb"] for run in runs)}
+                for phase in runs[0]["phases"]
+            }
+            results["sizes"][size_name] = result
+            if callback is not None:
+                callback(size_name, result)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.25, min_seconds: float = 0.05) -> list:
+    """
+    Differences to the baseline: phases that are more than tolerance slower (and
+    at least min_seconds, to ignore noise on small sizes), use more than
+    tolerance more memory, and sizes whose LP or objective changed. Sizes that
+    are not in the baseline or have other dimensions there are not compared.
+    Returns a list of messages, empty if there is no regression.
+    """
+    messages = []
+    for size_name, result in results["sizes"].items():
+        base = baseline.get("sizes", {}).get(size_name)
+        if base is None or base["size"] != result["size"]:
+            continue
+        for phase, values in result["phases"].items():
+            base_values = base["phases"].get(phase)
+            if base_values is None:
+                continue
+            time_new, time_base = values["time"], base_values["time"]
+            if time_new > time_base * (1 + tolerance) and time_new - time_base >= min_seconds:
+                messages.append(f"{size_name} {phase}: {time_new:.2f} s instead of {time_base:.2f} s (+{time_new / time_base - 1:.0%})")
+            if values["peak_rss_mb"] > base_values["peak_rss_mb"] * (1 + tolerance):
+                messages.append(f"{size_name} {phase}: peak memory {values['peak_rss_mb']:.0f} MB instead of {base_values['peak_rss_mb']:.0f} MB")
+        for key in ("rows", "columns", "nonzeros"):
+            if result[key] != base[key]:
+                messages.append(f"{size_name}: {result[key]} {key} instead of {base[key]}")
+        if result.get("objective") is not None and base.get("objective") is not None:
+            if abs(result["objective"] - base["objective"]) > 1e-6 * max(1.0, abs(base["objective"])):
+                messages.append(f"{size_name}: objective {result['objective']:.6g} instead of {base['objective']:.6g}")
+    return messages
+
+
+def write_results(path: Path, results: dict) -> None:
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def read_results(path: Path) -> dict:
+    with open(path) as file:
+        return json.load(file)
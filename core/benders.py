@@ -0,0 +1,406 @@
+"""
+Benders Decomposition
+
+The years of the LP are coupled only through the capacities and the costs.
+The master problem holds Cap_new, Cap_res and Cap_active of all years, their
+investment and power related costs and one variable Theta per year that
+estimates the operational costs of the year. Every year is an operational
+subproblem that dispatches the subprocesses within the active capacities
+chosen by the master. The subproblems are built once in worker processes, each
+worker owns a fixed set of years, and solved again for every new set of
+capacities. Their costs and the duals of the capacities are sent back as
+optimality cuts to the master, until the costs estimated by the master (lower
+bound) and the costs of the last capacities (upper bound) are within the
+tolerance.
+
+A subproblem can use capacity beyond the one of the master at a penalty above
+the cost of building it, so that it is feasible for all capacities; the cuts
+drive the master away from such capacities. Subprocesses without capacity
+costs (imports, demands, ...) are left to the subproblems, the master only
+keeps the capacity they needed.
+"""
+
+import multiprocessing as mp
+import os
+import sqlite3
+import time
+import numpy as np
+from sqlite3 import Connection
+from core.matrix_model import MatrixModel
+
+# tables written by save_output for a single year
+_Output_Tables = ("output_y", "output_cs_y", "output_cs_y_t", "output_co_y_t")
+
+
+class Subproblem(MatrixModel):
+    """Operational LP of one year for given active capacities"""
+    # families of the master problem, the costs of the subproblem are set directly as objective
+    _Master_Families = {
+        "totex", "capex", "opex", "salvage_value", "total_salvage_value",
+        "max_cap_res", "min_cap_res", "cap_active", "min_cap_active",
+    }
+
+    def __init__(self, conn: Connection, year, free: np.ndarray, penalty: np.ndarray, solver: str = "gurobi", threads: int = None) -> None:
+        """
+        free marks the subprocesses without capacity costs, their capacity is not
+        limited by the master. penalty is the cost of a unit of capacity beyond
+        the master per subprocess.
+        """
+        self.year = year
+        self.costed = np.nonzero(~np.asarray(free))[0]
+        self.penalty = penalty
+        self.fixed = {} # values of the master variables used by save_output
+        super().__init__(conn, solver, threads, years=[year])
+        if self.backend.name == "gurobi":
+            self.model.Params.OutputFlag = 0
+
+    def _add_var(self) -> None:
+        super()._add_var()
+        self._new_var("CapacitySlack", ["CS"])
+
+    def _add_family(self, name: str, n_rows: int, terms: list, sense: str, rhs=0.0):
+        if name in self._Master_Families:
+            return None
+        return super()._add_family(name, n_rows, terms, sense, rhs)
+
+    def _add_constr(self) -> None:
+        super()._add_constr()
+        cols = self._cols # alias for readability
+        rows = np.arange(len(self.costed))
+        # right-hand side set to the capacities of the master before every solve
+        self._add_family("master_capacity", len(rows), [
+            (rows, cols["Cap_active"][self.costed, 0], 1),
+            (rows, cols["CapacitySlack"][self.costed], -1),
+        ], "<")
+
+        all_years = self.dao.get_set("year")
+        pos = all_years.index(self.year)
+        year_gap = all_years[pos + 1] - self.year if pos + 1 < len(all_years) else 1
+        factor = year_gap * self.dao.get_discount_factor(self.year)
+        self._cost_cols = np.concatenate([cols["Eouttot"][:, 0], cols["Total_annual_co2_emission"]])
+        self._cost_coefs = np.concatenate([
+            self._get_array("opex_cost_energy")[:, 0] * factor,
+            self._get_array("co2_price") * factor,
+        ])
+        self.backend.set_objective(cols["TOTEX"].ravel(), 0.0)
+        self.backend.set_objective(self._cost_cols, self._cost_coefs)
+        self.backend.set_objective(cols["CapacitySlack"], np.asarray(self.penalty, dtype=float))
+
+    def solve_for(self, cap_active: np.ndarray) -> tuple:
+        """
+        Solves for the given capacities of the costed subprocesses. Returns the
+        operational costs, the penalty of the slack capacity, the duals of the
+        capacities and the capacity needed by every subprocess.
+        """
+        self.backend.set_rhs(self.constrs["master_capacity"], np.arange(len(self.costed)), "<", cap_active)
+        self.solve()
+        if not self.backend.is_optimal():
+            raise RuntimeError(f"The subproblem of {self.year} could not be solved (status {self.backend.stats['status']})")
+        x = self.backend.get_values()
+        cost = float(x[self._cost_cols] @ self._cost_coefs)
+        slack = float(x[self._cols["CapacitySlack"]] @ self.penalty)
+        return cost, slack, self.backend.get_duals(self.constrs["master_capacity"]), self._required_capacity()
+
+    def _required_capacity(self) -> np.ndarray:
+        """Smallest active capacity of every subprocess that allows the dispatch of the last solve"""
+        pout = self._get_values("Pout")[:, 0]
+        pin = self._get_values("Pin")[:, 0]
+        storage_cs = set(self.dao.get_set("storage_cs"))
+        storage = np.array([cs in storage_cs for cs in self.sets["CS"]], dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            required = np.stack([
+                pout.max(axis=1),
+                (pout / self._get_array("availability_profile")).max(axis=1),
+                pout.max(axis=1) / self._get_array("technical_availability"),
+                np.where(storage, pin.max(axis=1), 0),
+                np.where(storage, self._get_values("E_storage_level_max")[:, 0] * self._get_array("c_rate"), 0),
+            ])
+        # a zero availability allows no output, divisions by it come from solver tolerances
+        return np.clip(np.nan_to_num(required, nan=0, posinf=0), 0, None).max(axis=0)
+
+    def _get_values(self, name: str) -> np.ndarray:
+        if name in self.fixed:
+            return self.fixed[name]
+        return super()._get_values(name)
+
+    def export_output(self, fixed: dict) -> dict:
+        """Output rows of the year, the master variables are taken from fixed. The rows are removed again."""
+        self.fixed = fixed
+        self.save_output(years=[self.year])
+        rows = {}
+        for table in _Output_Tables:
+            columns = [c[1] for c in self.conn.execute(f"PRAGMA table_info({table})") if c[1] != "id"]
+            rows[table] = (columns, self.conn.execute(f"SELECT {', '.join(columns)} FROM {table}").fetchall())
+            self.conn.execute(f"DELETE FROM {table}")
+        self.conn.commit()
+        return rows
+
+
+def _serve(db: bytes, years: list, free: np.ndarray, penalty: np.ndarray, solver: str, threads: int, pipe) -> None:
+    """Worker process: builds the subproblems of its years and answers the requests of the master"""
+    try:
+        conn = sqlite3.connect(":memory:")
+        conn.deserialize(db)
+        subproblems = {y: Subproblem(conn, y, free, penalty, solver, threads) for y in years}
+        pipe.send(None)
+    except Exception as e:
+        pipe.send(e)
+        return
+    while (request := pipe.recv()) is not None:
+        command, args = request
+        try:
+            if command == "solve":
+                pipe.send({y: subproblems[y].solve_for(cap) for y, cap in args.items()})
+            elif command == "export":
+                year, fixed = args
+                pipe.send(subproblems[year].export_output(fixed))
+        except Exception as e:
+            pipe.send(e)
+    conn.close()
+
+
+class _WorkerPool():
+    """Worker processes that own the subproblems of a fixed set of years each"""
+
+    def __init__(self, conn: Connection, years: list, free: np.ndarray, penalty: np.ndarray, solver: str, threads: int, workers: int) -> None:
+        context = mp.get_context("spawn") # solver environments must not be inherited by fork
+        db = conn.serialize()
+        self.owner = {}
+        self.pipes = []
+        self.processes = []
+        for i in range(workers):
+            own = years[i::workers]
+            parent, child = context.Pipe()
+            process = context.Process(target=_serve, args=(db, own, free, penalty, solver, threads, child), daemon=True)
+            process.start()
+            self.pipes.append(parent)
+            self.processes.append(process)
+            self.owner.update(dict.fromkeys(own, parent))
+        try:
+            for pipe in self.pipes:
+                self._receive(pipe)
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def _receive(pipe):
+        reply = pipe.recv()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def solve(self, cap_active: dict) -> dict:
+        """Solves the subproblems of all years in parallel, cap_active maps each year to its capacities"""
+        for pipe in self.pipes:
+            pipe.send(("solve", {y: cap for y, cap in cap_active.items() if self.owner[y] is pipe}))
+        results = {}
+        for pipe in self.pipes:
+            results.update(self._receive(pipe))
+        return results
+
+    def export(self, year, fixed: dict) -> dict:
+        pipe = self.owner[year]
+        pipe.send(("export", (year, fixed)))
+        return self._receive(pipe)
+
+    def close(self) -> None:
+        for pipe, process in zip(self.pipes, self.processes):
+            if process.is_alive():
+                pipe.send(None)
+        for process in self.processes:
+            process.join()
+
+
+class BendersModel(MatrixModel):
+    """Master problem over the capacities, solve runs the decomposition and save_output writes all years"""
+
+    def __init__(self, conn: Connection, solver: str = "gurobi", threads: int = None, workers: int = None, tol: float = 1e-4, max_iter: int = 500, stabilization: float = 0.5) -> None:
+        """
+        workers is the number of subproblem processes (one per core by default),
+        tol the relative gap between the bounds at which the decomposition stops
+        and stabilization the weight of the master solution against the best
+        solution in the points at which the cuts are taken.
+        """
+        self.tol = tol
+        self.max_iter = max_iter
+        self.stabilization = stabilization
+        self._workers = workers
+        self._pool = None
+        super().__init__(conn, solver, threads)
+        # the master is solved again after every round of cuts, the simplex restarts from the previous basis
+        self.backend.simplex = True
+        if self.backend.name == "gurobi":
+            self.model.Params.OutputFlag = 0
+
+    def _add_var(self) -> None:
+        get_set = self.dao.get_set
+        self.sets = {
+            "CS": get_set("conversion_subprocess"),
+            "Y": get_set("year"),
+        }
+        self._year_pos = None
+        self.positions = {k: {x: i for i, x in enumerate(v)} for k, v in self.sets.items()}
+        self.vars = {}
+        self.constrs = {}
+        self._cols = {}
+        self._n_cols = 0
+        self._collect = None
+
+        self._new_var("Cap_new", ["CS", "Y"])
+        self._new_var("Cap_active", ["CS", "Y"])
+        self._new_var("Cap_res", ["CS", "Y"])
+        self._new_var("Theta", ["Y"])
+
+    def _add_constr(self) -> None:
+        cols = self._cols # alias for readability
+        get_array = self._get_array
+        years = np.array(self.sets["Y"])
+        last_year = years[-1]
+        discount = np.array([self.dao.get_discount_factor(y) for y in self.sets["Y"]])
+        year_gap = np.append(np.diff(years), 1)
+        lifetime = get_array("technical_lifetime")
+
+        self._add_capacity_constr()
+
+        # the same costs as capex, salvage_value and opex of the full model, without the operational costs
+        salvage = self.dao.get_salvage_mask(self.sets["Y"])
+        salvage_factor = get_array("capex_cost_power") * (1 - (last_year - years + 1)[None, :] / lifetime[:, None]) * self.dao.get_discount_factor(last_year)
+        self._salvage_factor = np.where(salvage, salvage_factor, 0)
+        self._capex_coefs = discount * get_array("capex_cost_power") - self._salvage_factor
+        self._opex_coefs = get_array("opex_cost_power") * year_gap * discount
+        self.backend.set_objective(cols["Cap_new"].ravel(), self._capex_coefs.ravel())
+        self.backend.set_objective(cols["Cap_active"].ravel(), self._opex_coefs.ravel())
+        self.backend.set_objective(cols["Theta"], 1.0)
+        # capacity beyond the master in a subproblem costs more than building it for all years
+        self.penalty = 1.1 * (get_array("capex_cost_power").max(axis=1) + (get_array("opex_cost_power") * year_gap).sum(axis=1)) + 1
+
+        # capacities without costs are set by the subproblems, the master keeps at least the capacity they needed
+        self.free = (get_array("capex_cost_power") == 0).all(axis=1) & (get_array("opex_cost_power") == 0).all(axis=1)
+        self.costed = np.nonzero(~self.free)[0]
+        rows, n = self._enumerate(np.broadcast_to(self.free[:, None], (len(self.free), len(years))))
+        self._add_family("required_capacity", n, [(rows, cols["Cap_active"], 1)], ">")
+
+    def _years(self) -> list:
+        return self.sets["Y"]
+
+    def _master_costs(self, x: np.ndarray = None) -> tuple:
+        """CAPEX and power related OPEX of a master solution, by default of the last one"""
+        x = self.backend.get_values() if x is None else x
+        capex = float(x[self._cols["Cap_new"]].ravel() @ self._capex_coefs.ravel())
+        opex = float(x[self._cols["Cap_active"]].ravel() @ self._opex_coefs.ravel())
+        return capex, opex
+
+    def _solve_master(self) -> None:
+        self.backend.solve()
+        if not self.backend.is_optimal():
+            raise RuntimeError(f"The master problem could not be solved (status {self.backend.stats['status']})")
+
+    def _solve_subproblems(self, x: np.ndarray) -> tuple:
+        """Solves the subproblems for the capacities of the master solution x, returns their results and their costs per year"""
+        cap_active = x[self._cols["Cap_active"][self.costed]]
+        results = self._pool.solve({y: cap_active[:, i] for i, y in enumerate(self.sets["Y"])})
+        return results, np.array([results[y][0] + results[y][1] for y in self.sets["Y"]])
+
+    def solve(self, callback=None) -> None:
+        """
+        Alternates between the master and the subproblems until the relative gap
+        is below tol. callback is called after every iteration with its number,
+        the lower and the upper bound.
+        """
+        st = time.time()
+        years = self.sets["Y"]
+        cols = self._cols
+        n_y = len(years)
+        cap_cols = cols["Cap_active"][self.costed]
+        cores = os.cpu_count() or 1
+        workers = max(1, min(self._workers or cores, n_y))
+        threads = max(1, (self.backend.threads or cores) // workers)
+        self._pool = _WorkerPool(self.conn, years, self.free, self.penalty, self.backend.name, threads, workers)
+
+        self.stats = {"status": "iteration limit", "iterations": 0, "lower_bound": None, "upper_bound": np.inf, "gap": np.inf}
+        best = None # master solution with the lowest upper bound so far
+        improved = True
+        try:
+            for it in range(1, self.max_iter + 1):
+                self._solve_master()
+                x = self.backend.get_values()
+                lower_bound = float(sum(self._master_costs(x)) + x[cols["Theta"]].sum())
+
+                # in-out stabilization: the cuts are taken between the master solution and the best solution,
+                # which damps the jumps of the master between the extremes of its cuts
+                point = x if best is None or not improved else self.stabilization * x + (1 - self.stabilization) * best
+                results, costs = self._solve_subproblems(point)
+                upper_bound = float(sum(self._master_costs(point)) + costs.sum())
+                improved = upper_bound < self.stats["upper_bound"]
+                if improved:
+                    best, self._results = point, results
+                    self.stats["upper_bound"] = upper_bound
+                gap = (self.stats["upper_bound"] - lower_bound) / max(abs(self.stats["upper_bound"]), 1e-9)
+                self.stats.update(iterations=it, lower_bound=lower_bound, gap=gap)
+                if callback is not None:
+                    callback(it, lower_bound, self.stats["upper_bound"])
+                if gap <= self.tol:
+                    self.stats["status"] = "optimal"
+                    break
+                # Theta_y >= cost_y + duals_y (Cap_active_y - Cap_active_y of the point)
+                duals = np.column_stack([results[y][2] for y in years])
+                self._add_family(f"cut_{it}", n_y, [
+                    (np.arange(n_y), cols["Theta"], 1),
+                    (np.arange(n_y)[None, :], cap_cols, -duals),
+                ], ">", costs - (duals * point[cap_cols]).sum(axis=0))
+
+            if not improved:
+                # the subproblems have to hold the dispatch of the best solution for save_output
+                self._results, _ = self._solve_subproblems(best)
+            # capacity beyond the master is not part of the saved capacities, such a dispatch is no solution of the LP
+            slack_cost = sum(self._results[y][1] for y in years)
+            self.stats["slack_cost"] = slack_cost
+            if slack_cost > self.tol * max(abs(self.stats["upper_bound"]), 1e-9):
+                raise RuntimeError(
+                    f"The Benders decomposition stopped ({self.stats['status']}, gap {self.stats['gap']:.2e}) at capacities "
+                    f"the subproblems had to exceed at the penalty costs {slack_cost:.6g}. "
+                    + ("Increase max_iter." if self.stats["status"] == "iteration limit" else "The capacity limits of the scenario do not allow a feasible dispatch.")
+                )
+            # the costed capacities are fixed to the best solution, the free ones take up the capacity needed
+            required = np.column_stack([self._results[y][3] for y in years])[self.free]
+            self.backend.set_rhs(self.constrs["required_capacity"], np.arange(required.size), ">", required.ravel())
+            rows, n = self._enumerate(np.ones(cap_cols.shape, dtype=bool))
+            self._add_family("final_capacity", n, [(rows, cap_cols, 1)], "=", best[cap_cols].ravel())
+            self._solve_master()
+        except BaseException:
+            self._pool.close()
+            self._pool = None
+            raise
+        self.stats["solve_time"] = time.time() - st
+        self.backend.stats.update(self.stats)
+
+    def save_output(self) -> None:
+        """Writes the results of all years, the subproblems write the operational part of their year"""
+        x = self.backend.get_values()
+        cols = self._cols
+        cap_new = x[cols["Cap_new"]]
+        salvage = self._salvage_factor * cap_new
+        try:
+            for i, y in enumerate(self.sets["Y"]):
+                fixed = {
+                    "Cap_new": cap_new[:, [i]],
+                    "Cap_active": x[cols["Cap_active"]][:, [i]],
+                    "Cap_res": x[cols["Cap_res"]][:, [i]],
+                    "DiscountedSalvageValue": salvage[:, [i]],
+                }
+                for table, (columns, rows) in self._pool.export(y, fixed).items():
+                    self.cursor.executemany(
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))});", rows
+                    )
+        finally:
+            self._pool.close()
+            self._pool = None
+
+        capex, opex = self._master_costs()
+        opex += sum(result[0] for result in self._results.values())
+        self.cursor.execute(
+            "INSERT INTO output_global (OPEX, CAPEX, TOTEX) VALUES (?, ?, ?);",
+            (opex, capex, opex + capex)
+        )
+        self.conn.commit()
@@ -0,0 +1,110 @@
+"""
+Representative Period Selection
+
+Clusters the full-year profiles referenced by a techmap (availability and
+output profiles) into k representative days or weeks. The selection is saved
+next to the time series as a TSS file with the hours of the chosen periods and
+a weights file with the number of hours of the year each selected hour stands
+for, which the parser turns into per time step weights.
+"""
+
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from pathlib import Path
+from scipy.cluster.vq import kmeans2
+from core.timeseries import TimeSeriesLoader
+
+Period_Lengths = {"day": 24, "week": 168}
+Methods = ("kmeans", "kmedoids")
+
+# hours: selected hours of the year (starting at 1), weights: hours of the year represented by each selected hour,
+# errors: relative error of the annual mean of each profile
+Selection = namedtuple("Selection", ["hours", "weights", "errors"])
+
+
+def read_profiles(techmap_path: Path, ts_dir_path: Path, ts_loader: TimeSeriesLoader = None) -> dict:
+    """Full-year time series used as availability or output profile in the techmap, by name"""
+    ts_loader = ts_loader or TimeSeriesLoader(cache_dir=Path(ts_dir_path).joinpath(".cache"))
+    df = pd.read_excel(techmap_path, "ConversionSubProcess", skiprows=[1, 2])
+    names = set()
+    for p_name in ("availability_profile", "output_profile"):
+        if p_name in df.columns:
+            names.update(str(x).strip() for x in df[p_name].dropna())
+    return {name: ts_loader.load(Path(ts_dir_path).joinpath(f"{name}.txt")) for name in sorted(names)}
+
+
+def _normalize(values: np.ndarray) -> np.ndarray:
+    """Scales a profile to [0, 1] so that demands and availabilities weigh the same"""
+    span = values.max() - values.min()
+    return (values - values.min()) / span if span > 0 else np.zeros_like(values)
+
+
+def _kmeans(features: np.ndarray, k: int, seed: int) -> np.ndarray:
+    """Clusters with k-means, every cluster is represented by its member closest to the centroid"""
+    centroids, labels = kmeans2(features, k, minit="++", seed=seed)
+    medoids = []
+    for c in np.unique(labels):
+        members = np.nonzero(labels == c)[0]
+        medoids.append(members[np.argmin(((features[members] - centroids[c])**2).sum(axis=1))])
+    return np.array(medoids)
+
+
+def _kmedoids(features: np.ndarray, k: int, seed: int, max_iter: int = 100) -> np.ndarray:
+    """Clusters with k-medoids (alternating assignment and medoid update), started from k-means"""
+    distances = np.sqrt(((features[:, None, :] - features[None, :, :])**2).sum(axis=2))
+    medoids = _kmeans(features, k, seed)
+    for _ in range(max_iter):
+        labels = np.argmin(distances[:, medoids], axis=1)
+        new_medoids = np.array([
+            members[np.argmin(distances[np.ix_(members, members)].sum(axis=1))]
+            for members in (np.nonzero(labels == c)[0] for c in range(len(medoids)))
+        ])
+        if np.array_equal(np.sort(new_medoids), np.sort(medoids)):
+            break
+        medoids = new_medoids
+    return medoids
+
+
+def select_periods(profiles: dict, k: int, period: str = "day", method: str = "kmeans", max_error: float = None, seed: int = 0) -> Selection:
+    """
+    Picks k representative periods of the profiles. With max_error, k is increased
+    until the annual mean of every profile is reproduced within that relative error.
+    """
+    if period not in Period_Lengths:
+        raise ValueError(f"Unknown period {period}, available periods: {list(Period_Lengths)}")
+    if method not in Methods:
+        raise ValueError(f"Unknown clustering method {method}, available methods: {list(Methods)}")
+    length = Period_Lengths[period]
+    n_periods = min(len(p) for p in profiles.values()) // length
+    # one row per period, the normalized profiles side by side
+    periods = {name: np.asarray(p[:n_periods * length], dtype=float).reshape(n_periods, length) for name, p in profiles.items()}
+    features = np.hstack([_normalize(p) for p in periods.values()])
+
+    cluster = _kmeans if method == "kmeans" else _kmedoids
+    for k in range(min(k, n_periods), n_periods + 1):
+        medoids = np.sort(cluster(features, k, seed)) if k < n_periods else np.arange(n_periods)
+        labels = np.argmin(((features[:, None, :] - features[None, medoids, :])**2).sum(axis=2), axis=1)
+        sizes = np.bincount(labels, minlength=len(medoids))
+        # every hour of a representative period stands for the same hour of all periods in its cluster
+        period_weights = sizes * 8760 / (n_periods * length)
+        errors = {}
+        for name, p in periods.items():
+            mean = p.mean()
+            estimate = (period_weights[:, None] * p[medoids]).sum() / 8760
+            errors[name] = abs(estimate - mean) / abs(mean) if mean != 0 else abs(estimate)
+        if max_error is None or max(errors.values()) <= max_error:
+            break
+
+    hours = (medoids[:, None] * length + np.arange(1, length + 1)[None, :]).ravel()
+    weights = np.repeat(period_weights, length)
+    return Selection(hours, weights, errors)
+
+
+def write_selection(ts_dir_path: Path, tss_name: str, selection: Selection) -> tuple:
+    """Writes <tss_name>.txt and <tss_name>_weights.txt, returns both paths"""
+    tss_path = Path(ts_dir_path).joinpath(f"{tss_name}.txt")
+    weights_path = Path(ts_dir_path).joinpath(f"{tss_name}_weights.txt")
+    np.savetxt(tss_path, selection.hours, fmt="%d")
+    np.savetxt(weights_path, selection.weights, fmt="%.10g")
+    return tss_path, weights_path
@@ -1,9 +1,14 @@
 from sqlite3 import Connection
 from pandas import DataFrame
+import numpy as np
+import scipy.sparse as sp
 from itertools import chain
 from typing import NamedTuple
 from functools import lru_cache
-from core.params import Param_Index_Dict, Output_Index_Dict, Param_Default_Dict
+from core.params import Param_Index_Dict, Output_Index_Dict, Set_Names
+from core.param_store import ParamStore
+from core.profiler import track_cursor
+from core.output_arrays import Array_Tables, decode, is_array_layout, register_functions
 
 class CS(NamedTuple):
     cp: str
@@ -17,44 +22,61 @@ class CS(NamedTuple):
 class DAO():
     def __init__(self, conn : Connection) -> None:
         self.conn = conn
-        self.cursor = conn.cursor()
+        self.cursor = track_cursor(conn.cursor())
         self.output_index_dict = Output_Index_Dict
+        self.params = ParamStore(self)
+        register_functions(conn) # for the views of the array layout, see core.output_arrays
     
-    def get_as_dataframe(self, name: str, **filterby) -> DataFrame:
-        param_or_out = 'output' if name in self.output_index_dict else 'param'
+    @staticmethod
+    def _headers(indexes: list) -> list:
+        """Column names of a parameter or output with the given indexes, a CS is split into cp, cin and cout"""
+        names = {"CS": ["cp", "cin", "cout"], "CO": ["Commodity"], "Y": ["Year"], "T": ["Time"]}
+        return [header for index in indexes for header in names.get(index, [index])] + ["value"]
+
+    def _indexes(self, name: str) -> list:
         if name in self.output_index_dict:
-            indexes = self.output_index_dict.get(name)
-        elif name in Param_Index_Dict:
-            indexes = Param_Index_Dict.get(name)
-        else:
-            raise ValueError(f"{name} is not neither input parameter nor output variable")
+            return self.output_index_dict[name]
+        if name in Param_Index_Dict:
+            return Param_Index_Dict[name]
+        raise ValueError(f"{name} is not neither input parameter nor output variable")
 
-        # make headers
-        headers = []
-        for index in indexes:
-            if index == 'CS':
-                headers.extend(['cp','cin','cout'])
-            elif index == 'CO':
-                headers.append('Commodity')
-            elif index == 'Y':
-                headers.append('Year')
-            elif index == 'T':
-                headers.append('Time')
-            else:
-                headers.append(index)
-        headers.append('value')
+    def get_as_dataframe(self, name: str, **filterby) -> DataFrame:
+        """Rows of a parameter or output, filterby keeps the rows with the given column values, e.g. cout="Electricity", Year=2030"""
+        return DataFrame(self.get_columns(name, **filterby))
 
-        rows = self.iter_row(name)
-        if 'CS' in indexes:
-            ind = indexes.index('CS')
-            rows = [(*row[0:ind],row[ind].cp,row[ind].cin,row[ind].cout, *row[ind+1:]) for row in rows]
-        df = DataFrame(rows, columns=headers)
+    def _check_filter(self, indexes: list, filterby: dict) -> list:
+        headers = self._headers(indexes)
+        for k in filterby:
+            if k not in headers:
+                raise Exception(f"Key {k} not found in DataFrame! Existing keys: {headers}")
+        return headers
+
+    def _where(self, name: str, indexes: list, filterby: dict) -> tuple:
+        """
+        WHERE clause of an output query with the filters of filterby on the
+        columns of _headers, and its bound parameters. The filters are resolved
+        to set ids with subqueries, so that the unique (id, ...) indexes of the
+        output tables are used.
+        """
+        self._check_filter(indexes, filterby)
+        conditions, params = [f"{name.lower()} IS NOT NULL"], []
         for k, v in filterby.items():
-            try:
-                df = df[df[k] == v]
-            except KeyError:
-                raise Exception(f"Key {k} not found in DataFrame! Existing keys: {df.columns}")
-        return df
+            match k:
+                case "cp":
+                    conditions.append("cs_id IN (SELECT id FROM conversion_subprocess WHERE cp_id IN (SELECT id FROM conversion_process WHERE name = ?))")
+                case "cin" | "cout":
+                    conditions.append(f"cs_id IN (SELECT id FROM conversion_subprocess WHERE {k}_id IN (SELECT id FROM commodity WHERE name = ?))")
+                case "Commodity":
+                    conditions.append("co_id IN (SELECT id FROM commodity WHERE name = ?)")
+                case "Year":
+                    conditions.append("y_id IN (SELECT id FROM year WHERE value = ?)")
+                case "Time":
+                    conditions.append("t_id IN (SELECT id FROM time_step WHERE value = ?)")
+                case "value":
+                    conditions.append(f"{name.lower()} = ?")
+            # NumPy scalars (e.g. a year of a DataFrame) cannot be bound
+            params.append(v.item() if isinstance(v, np.generic) else v)
+        return "WHERE " + " AND ".join(conditions), params
 
     def get_units(self):
         unit_rows = self.cursor.execute(f"""SELECT quantity, output FROM unit""").fetchall()
@@ -65,93 +87,195 @@ class DAO():
         cp_rows = self.cursor.execute(f"""SELECT name, plot_color, plot_order FROM conversion_process""").fetchall()
         return {name:{"color":color, "order": order} for (name, color, order) in chain(co_rows,cp_rows)}
     
-    def iter_row(self, name:str):
-        param_or_out = 'output' if name in self.output_index_dict else 'param'
-        if name in self.output_index_dict:
-            indexes = self.output_index_dict.get(name)
-        elif name in Param_Index_Dict:
-            indexes = Param_Index_Dict.get(name)
-        else:
-            raise ValueError(f"{name} is not neither input parameter nor output variable")
-        cursor = self.cursor
+    def _row_query(self, name: str, indexes: list, where: str) -> tuple:
+        """Query of the rows of an output (value first, then the index elements) and the function turning a result into an iter_row row"""
         name = name.lower()
         match indexes:
             case []:
-                 return [self.cursor.execute(f"SELECT {name} FROM {param_or_out}_global").fetchone()[0]]
+                return f"SELECT {name} FROM output_global {where};", lambda x: x[0]
             case ["CS"]:
                 query = f"""
                 SELECT {name}, cp.name, cin.name, cout.name 
-                FROM {param_or_out}_cs
+                FROM output_cs
                 JOIN conversion_subprocess AS cs ON cs_id = cs.id
                 JOIN conversion_process AS cp ON cs.cp_id = cp.id
                 JOIN commodity AS cin ON cs.cin_id = cin.id
                 JOIN commodity AS cout ON cs.cout_id = cout.id
-                WHERE {name} IS NOT NULL;
+                {where};
                 """
-                return [(CS(*x[1:4]),x[0]) for x in cursor.execute(query).fetchall()]
+                return query, lambda x: (CS(*x[1:4]),x[0])
             case ["Y"]:
                 query = f"""
                 SELECT {name}, y.value
-                FROM {param_or_out}_y
+                FROM output_y
                 JOIN year AS y ON y_id = y.id
-                WHERE {name} IS NOT NULL;
+                {where};
                 """
-                return [(x[1],x[0]) for x in cursor.execute(query).fetchall()]
+                return query, lambda x: (x[1],x[0])
             case ["CS","Y"]:
                 query = f"""
                 SELECT {name}, cp.name, cin.name, cout.name, y.value
-                FROM {param_or_out}_cs_y
+                FROM output_cs_y
                 JOIN conversion_subprocess AS cs ON cs_id = cs.id
                 JOIN conversion_process AS cp ON cs.cp_id = cp.id
                 JOIN commodity AS cin ON cs.cin_id = cin.id
                 JOIN commodity AS cout ON cs.cout_id = cout.id
                 JOIN year AS y ON y_id = y.id
-                WHERE {name} IS NOT NULL;
-                """
-                return [(CS(*x[1:4]),x[4],x[0]) for x in cursor.execute(query).fetchall()]
-            case ["CS","T"]:
-                query = f"""
-                SELECT {name}, cp.name, cin.name, cout.name, ts.value
-                FROM {param_or_out}_cs_t AS pct
-                JOIN conversion_subprocess AS cs ON cs_id = cs.id
-                JOIN conversion_process AS cp ON cs.cp_id = cp.id
-                JOIN commodity AS cin ON cs.cin_id = cin.id
-                JOIN commodity AS cout ON cs.cout_id = cout.id
-                JOIN time_step AS ts ON t_id = ts.id
-                WHERE {name} IS NOT NULL;
+                {where};
                 """
-                return [(CS(*x[1:4]),x[4],x[0]) for x in cursor.execute(query).fetchall()]
+                return query, lambda x: (CS(*x[1:4]),x[4],x[0])
             case ['CS','Y','T']:
                 query = f"""
                     SELECT {name}, cp.name, cin.name, cout.name, y.value, t.value
-                    FROM {param_or_out}_cs_y_t
+                    FROM output_cs_y_t
                     JOIN conversion_subprocess AS cs ON cs_id = cs.id
                     JOIN conversion_process AS cp ON cs.cp_id = cp.id
                     JOIN commodity AS cin ON cs.cin_id = cin.id
                     JOIN commodity AS cout ON cs.cout_id = cout.id
                     JOIN year AS y ON y_id = y.id
                     JOIN time_step AS t ON t_id = t.id
-                    WHERE {name} IS NOT NULL;
+                    {where};
                 """
-                return [(CS(*x[1:4]),x[4],x[5],x[0]) for x in cursor.execute(query).fetchall()]
+                return query, lambda x: (CS(*x[1:4]),x[4],x[5],x[0])
             case ['CO','Y','T']:
                 query = f"""
                     SELECT {name}, c.name, y.value, t.value
-                    FROM {param_or_out}_co_y_t
+                    FROM output_co_y_t
                     JOIN commodity AS c ON co_id = c.id
                     JOIN year AS y ON y_id = y.id
                     JOIN time_step AS t ON t_id = t.id
-                    WHERE {name} IS NOT NULL;
+                    {where};
                 """
-                return [(x[1],x[2],x[3],x[0]) for x in cursor.execute(query).fetchall()]
-            
+                return query, lambda x: (x[1],x[2],x[3],x[0])
+
+    def iter_row(self, name:str, **filterby):
+        """All rows of a parameter or output, (*index elements, value), or [value] without index. filterby as in get_as_dataframe"""
+        if name in Param_Index_Dict and name not in self.output_index_dict and not filterby:
+            return self.params.iter_row(name)
+        rows = list(chain.from_iterable(self.iter_chunks(name, **filterby)))
+        return rows if self._indexes(name) else rows[:1]
+
+    def iter_chunks(self, name: str, size: int = 100_000, **filterby):
+        """
+        Generator over the rows of iter_row in lists of at most size rows, an
+        output is fetched from the database chunk by chunk.
+        """
+        indexes = self._indexes(name)
+        if name not in self.output_index_dict:
+            rows = self.params.iter_row(name)
+            if filterby:
+                headers = self._check_filter(indexes, filterby)
+                flat = lambda row: dict(zip(headers, chain.from_iterable(x if isinstance(x, CS) else (x,) for x in row)))
+                rows = [row for row in rows if all(flat(row)[k] == v for k, v in filterby.items())]
+            for start in range(0, len(rows), size):
+                yield rows[start:start + size]
+            return
+        where, params = self._where(name, indexes, filterby)
+        query, to_row = self._row_query(name, indexes, where)
+        # a cursor of its own, so that other queries can run while the chunks are consumed
+        cursor = track_cursor(self.conn.cursor())
+        cursor.execute(query, params)
+        while chunk := cursor.fetchmany(size):
+            yield [to_row(x) for x in chunk]
+
+    def _lookup(self, index: str) -> tuple:
+        """Arrays from database id to the columns of the index elements, e.g. cp, cin and cout of a CS"""
+        ids, elements = self.get_set_ids(Set_Names[index]), self.get_set(Set_Names[index])
+        columns = list(zip(*elements)) if index == "CS" else [elements]
+        lookup = []
+        for column in columns:
+            by_id = np.empty(max(ids, default=0) + 1, dtype=object if index in ("CS", "CO") else np.int64)
+            by_id[ids] = column
+            lookup.append(by_id)
+        return lookup
+
+    def get_columns(self, name: str, arrow: bool = False, size: int = 100_000, **filterby):
+        """
+        Rows of a parameter or output as columns, a NumPy structured array with
+        the fields of _headers (or a pyarrow Table with arrow). Outputs are read
+        as numeric ids in chunks and mapped to the set elements with arrays,
+        without creating a Python object per row. filterby as in get_as_dataframe,
+        for outputs it is part of the query.
+        """
+        indexes = self._indexes(name)
+        headers = self._check_filter(indexes, filterby)
+        if name not in self.output_index_dict:
+            values, mask = self.params.get_array(name), self.params.get_mask(name)
+            if not indexes:
+                values, mask = values.reshape(1), mask.reshape(1) | True # a missing global parameter is one row with nan
+            positions = np.nonzero(mask)
+            columns = []
+            for index, pos in zip(indexes, positions):
+                elements = self.get_set(Set_Names[index])
+                by_position = list(zip(*elements)) if index == "CS" else [elements]
+                columns += [np.asarray(column, dtype=object if index == "CS" else np.int64)[pos] for column in by_position]
+            columns.append(values[positions]) # INT parameters stay int64 as in the ParamStore
+            keep = np.ones(len(columns[-1]), dtype=bool)
+            for k, v in filterby.items():
+                keep &= columns[headers.index(k)] == v
+            columns = [column[keep] for column in columns]
+        elif self._is_array_layout(table := "output_" + ("_".join(index.lower() for index in indexes) if indexes else "global")):
+            columns = self._array_columns(name, indexes, table, filterby, size)
+        else:
+            id_columns = [f"{index.lower()}_id" for index in indexes]
+            where, params = self._where(name, indexes, filterby)
+            cursor = track_cursor(self.conn.cursor())
+            cursor.execute(f"SELECT {', '.join(id_columns + [name.lower()])} FROM {table} {where};", params)
+            chunks = []
+            while chunk := cursor.fetchmany(size):
+                chunks.append(np.array(chunk, dtype=float).reshape(len(chunk), len(id_columns) + 1))
+            data = np.concatenate(chunks) if chunks else np.empty((0, len(id_columns) + 1))
+            if not indexes:
+                data = data[:1]
+            columns = []
+            for k, index in enumerate(indexes):
+                ids = data[:, k].astype(np.int64)
+                columns += [by_id[ids] for by_id in self._lookup(index)]
+            columns.append(data[:, -1])
+
+        if arrow:
+            import pyarrow as pa
+            return pa.table(dict(zip(headers, columns)))
+        array = np.empty(len(columns[-1]), dtype=[(header, column.dtype) for header, column in zip(headers, columns)])
+        for header, column in zip(headers, columns):
+            array[header] = column
+        return array
+
+    @lru_cache(maxsize=None)
+    def _is_array_layout(self, table: str) -> bool:
+        return table in Array_Tables and is_array_layout(self.conn, table)
+
+    def _array_columns(self, name: str, indexes: list, table: str, filterby: dict, size: int) -> list:
+        """Columns of get_columns for an output in the array layout, the BLOBs are decoded with NumPy"""
+        array_table, id_column = Array_Tables[table]
+        # the time steps are positions in the BLOBs, they and the values are filtered after decoding
+        row_filter = {k: v for k, v in filterby.items() if k not in ("Time", "value")}
+        where, params = self._where(name, indexes, row_filter)
+        cursor = track_cursor(self.conn.cursor())
+        cursor.execute(f"SELECT {id_column}, y_id, {name.lower()} FROM {array_table} {where};", params)
+        ids, blobs = [], []
+        while chunk := cursor.fetchmany(size):
+            ids += [x[:2] for x in chunk]
+            blobs += [x[2] for x in chunk]
+        times = np.array(self.get_set("time"), dtype=np.int64)
+        values = decode(blobs, len(times))
+        rows, steps = np.nonzero(~np.isnan(values))
+        ids = np.array(ids, dtype=np.int64).reshape(-1, 2)[rows]
+        columns = [by_id[ids[:, 0]] for by_id in self._lookup(indexes[0])] + [self._lookup("Y")[0][ids[:, 1]], times[steps], values[rows, steps].astype(float)]
+        keep = np.ones(len(rows), dtype=bool)
+        headers = self._headers(indexes)
+        for k in ("Time", "value"):
+            if k in filterby:
+                keep &= columns[headers.index(k)] == filterby[k]
+        return [column[keep] for column in columns]
+
     def get_row(self, name, *indices):
         cursor = self.cursor # defined for readability
         param_or_out = 'output' if name in self.output_index_dict else 'param'
         if name in self.output_index_dict:
             indexes = self.output_index_dict.get(name)
         elif name in Param_Index_Dict:
-            indexes = Param_Index_Dict.get(name)
+            return self.params.get_value(name, *indices)
         else:
             raise ValueError(f"{name} is not neither input parameter nor output variable")
         name = name.lower()
@@ -214,26 +338,28 @@ class DAO():
                 WHERE {name} IS NOT NULL AND cp.name ='{cs.cp}' AND cin.name ='{cs.cin}' AND cout.name ='{cs.cout}' AND ts.value ={t};
                 """
                 x = cursor.execute(query).fetchone()
-        if param_or_out == 'param':
-            return (x[0] if x else Param_Default_Dict[name])
-        else: # out
-            return (x[0] if x else 0)
+        return (x[0] if x else 0)
+
+    def get_array(self, name: str):
+        """Dense NumPy array of an input parameter, indexed by the positions in get_set"""
+        return self.params.get_array(name)
     
     @lru_cache(maxsize=None)
-    def get_set(self, set_name):
+    def _get_set_rows(self, set_name):
         cursor = self.cursor # defined for readability
         match set_name:
             case "time":
-                return [x[0] for x in cursor.execute("SELECT value FROM time_step ORDER BY value;").fetchall()]
+                return cursor.execute("SELECT id, value FROM time_step ORDER BY value;").fetchall()
             case "year":
-                return [x[0] for x in cursor.execute("SELECT value FROM year ORDER BY value;").fetchall()]
+                return cursor.execute("SELECT id, value FROM year ORDER BY value;").fetchall()
             case "conversion_process":
-                return [x[0] for x in cursor.execute("SELECT name FROM conversion_process;").fetchall()]
+                return cursor.execute("SELECT id, name FROM conversion_process;").fetchall()
             case "commodity":
-                return [x[0] for x in cursor.execute("SELECT name FROM commodity;").fetchall()]
+                return cursor.execute("SELECT id, name FROM commodity;").fetchall()
             case "conversion_subprocess":
                 query = """
-                SELECT cp.name AS conversion_process_name, 
+                SELECT cs.id, 
+                cp.name AS conversion_process_name, 
                 cin.name AS input_commodity_name, 
                 cout.name AS output_commodity_name 
                 FROM conversion_subprocess AS cs
@@ -241,10 +367,11 @@ class DAO():
                 JOIN commodity AS cin ON cs.cin_id = cin.id
                 JOIN commodity AS cout ON cs.cout_id = cout.id;
                 """
-                return [CS(*x) for x in self.cursor.execute(query).fetchall()]
+                return [(x[0], CS(*x[1:])) for x in cursor.execute(query).fetchall()]
             case "storage_cs":
                 query = """
-                SELECT cp.name AS conversion_process_name, 
+                SELECT cs.id, 
+                cp.name AS conversion_process_name, 
                 cin.name AS input_commodity_name, 
                 cout.name AS output_commodity_name 
                 FROM conversion_subprocess AS cs
@@ -254,7 +381,84 @@ class DAO():
                 JOIN param_cs AS pc ON cs.id = pc.cs_id
                 WHERE pc.is_storage = true;
                 """
-                return [CS(*x) for x in self.cursor.execute(query).fetchall()]
+                return [(x[0], CS(*x[1:])) for x in cursor.execute(query).fetchall()]
+            case "nondummy_commodity":
+                return cursor.execute("SELECT id, name FROM commodity WHERE name != 'Dummy';").fetchall()
+            case "net_commodity":
+                # commodities with Enetgen and Enetcons, Dummy only if a fraction parameter refers to it
+                query = """
+                SELECT co.id, co.name FROM commodity AS co
+                WHERE co.name != 'Dummy' OR EXISTS (
+                    SELECT 1 FROM param_cs_y AS p
+                    JOIN conversion_subprocess AS cs ON p.cs_id = cs.id
+                    WHERE (cs.cout_id = co.id AND (p.out_frac_min IS NOT NULL OR p.out_frac_max IS NOT NULL))
+                    OR (cs.cin_id = co.id AND (p.in_frac_min IS NOT NULL OR p.in_frac_max IS NOT NULL))
+                );
+                """
+                return cursor.execute(query).fetchall()
+            case "input_cs":
+                # subprocesses with Pin: not the Dummy input, unless they are storages
+                # or Enetcons of Dummy is needed for an input fraction
+                query = """
+                SELECT cs.id, 
+                cp.name AS conversion_process_name, 
+                cin.name AS input_commodity_name, 
+                cout.name AS output_commodity_name 
+                FROM conversion_subprocess AS cs
+                JOIN conversion_process AS cp ON cs.cp_id = cp.id
+                JOIN commodity AS cin ON cs.cin_id = cin.id
+                JOIN commodity AS cout ON cs.cout_id = cout.id
+                LEFT JOIN param_cs AS pc ON cs.id = pc.cs_id
+                WHERE cin.name != 'Dummy' OR pc.is_storage = true OR EXISTS (
+                    SELECT 1 FROM param_cs_y AS p
+                    JOIN conversion_subprocess AS other ON p.cs_id = other.id
+                    WHERE other.cin_id = cs.cin_id AND (p.in_frac_min IS NOT NULL OR p.in_frac_max IS NOT NULL)
+                );
+                """
+                return [(x[0], CS(*x[1:])) for x in cursor.execute(query).fetchall()]
+
+    @lru_cache(maxsize=None)
+    def get_set(self, set_name):
+        return [x for (_, x) in self._get_set_rows(set_name)]
+
+    @lru_cache(maxsize=None)
+    def get_set_ids(self, set_name):
+        """Database ids of the elements of a set, in the same order as get_set"""
+        return [i for (i, _) in self._get_set_rows(set_name)]
+
+    @lru_cache(maxsize=None)
+    def get_commodity_cs(self, direction: str) -> dict:
+        """
+        Incidence lists commodity -> conversion subprocesses.
+        direction "in" gives the subprocesses consuming the commodity (cs.cin == co),
+        "out" the subprocesses producing it (cs.cout == co).
+        """
+        incidence = {co: [] for co in self.get_set("commodity")}
+        for cs in self.get_set("conversion_subprocess"):
+            incidence[cs.cin if direction == "in" else cs.cout].append(cs)
+        return incidence
+
+    @lru_cache(maxsize=None)
+    def get_incidence_matrix(self, direction: str) -> sp.csr_matrix:
+        """
+        Sparse CS x CO incidence matrix in the order of get_set, with a one where
+        the subprocess consumes ("in") or produces ("out") the commodity.
+        """
+        co_pos = {co: i for i, co in enumerate(self.get_set("commodity"))}
+        css = self.get_set("conversion_subprocess")
+        cols = [co_pos[cs.cin if direction == "in" else cs.cout] for cs in css]
+        return sp.csr_matrix(
+            (np.ones(len(css)), (np.arange(len(css)), cols)),
+            shape=(len(css), len(co_pos))
+        )
+
+    def get_salvage_mask(self, years: list) -> np.ndarray:
+        """
+        CS x Y mask of the new capacities of the given years that are still
+        active after the last of them and therefore have a salvage value.
+        """
+        years = np.asarray(years)
+        return (years[-1] - years)[None, :] < self.get_array("technical_lifetime")[:, None]
 
     def get_discount_factor(self, y: int) -> float:
          y_0 = self.get_set("year")[0]
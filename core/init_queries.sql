@@ -42,6 +42,11 @@ CREATE TABLE IF NOT EXISTS conversion_subprocess (
     CONSTRAINT cs_unique UNIQUE (cp_id,cin_id,cout_id)
 );
 
+-- the output queries filtered by the input or output commodity look up the subprocesses with these
+-- (cp_id by cs_unique; commodity and process names and the ids of the output tables by their UNIQUE constraints)
+CREATE INDEX IF NOT EXISTS cs_cin ON conversion_subprocess (cin_id);
+CREATE INDEX IF NOT EXISTS cs_cout ON conversion_subprocess (cout_id);
+
 -- Create the 'unit' table
 CREATE TABLE IF NOT EXISTS unit (
     id INTEGER PRIMARY KEY,
@@ -56,8 +61,6 @@ CREATE TABLE IF NOT EXISTS unit (
 -- Create the 'param' table
 CREATE TABLE IF NOT EXISTS param_global (
     id INTEGER PRIMARY KEY,
-    dt FLOAT,
-    w FLOAT,
     discount_rate FLOAT,
     tss_name text,
     -- Add a column that holds a constant value
@@ -65,6 +68,16 @@ CREATE TABLE IF NOT EXISTS param_global (
     CONSTRAINT only_one_row UNIQUE (constant_column)
 );
 
+-- Create the 'param_t' table
+CREATE TABLE IF NOT EXISTS param_t (
+    id INTEGER PRIMARY KEY,
+    t_id INTEGER,
+    dt FLOAT,
+    w FLOAT,
+    FOREIGN KEY (t_id) REFERENCES time_step(id),
+    CONSTRAINT t_unique UNIQUE (t_id)
+);
+
 -- Create the 'param_cs' table
 CREATE TABLE IF NOT EXISTS param_cs (
     id INTEGER PRIMARY KEY,
@@ -197,3 +210,23 @@ CREATE TABLE IF NOT EXISTS output_co_y_t (
     CONSTRAINT co_y_t_unique UNIQUE (co_id, y_id, t_id)
 );
 
+
+-- Create the 'pruned' table, subprocesses and commodities removed before the build (see core.pruning)
+CREATE TABLE IF NOT EXISTS pruned (
+    id INTEGER PRIMARY KEY,
+    set_name TEXT,
+    name TEXT,
+    cin TEXT,
+    cout TEXT,
+    reason TEXT
+);
+
+
+-- Create the 'run_stats' table, the profile of the run written by cesm run --profile (see core.profiler)
+CREATE TABLE IF NOT EXISTS run_stats (
+    id INTEGER PRIMARY KEY,
+    section TEXT,
+    name TEXT,
+    metric TEXT,
+    value FLOAT
+);
@@ -9,8 +9,10 @@ from pathlib import Path
 import pandas as pd
 import numpy as np
 import scipy.interpolate
-from collections import namedtuple
 from core.params import Param_Index_Dict
+from core.timeseries import TimeSeriesLoader
+from core.aggregation import segment_starts, profile_features
+from core.clustering import read_profiles
 import pkg_resources
 
 
@@ -21,9 +23,11 @@ class Parser:
         Generates .dat input file
     """
 
-    def __init__(self, name, techmap_dir_path, ts_dir_path, db_conn, scenario):
+    def __init__(self, name, techmap_dir_path, ts_dir_path, db_conn, scenario, ts_loader=None, aggregation=None):
         self.techmap_path = techmap_dir_path.joinpath(f"{name}.xlsx")
         self.ts_dir_path = ts_dir_path
+        self.ts_loader = ts_loader or TimeSeriesLoader(cache_dir=ts_dir_path.joinpath(".cache"))
+        self.aggregation = aggregation # None or a mode of core.aggregation, e.g. "3h" or "adaptive:500"
         
         self.scenario = scenario
 
@@ -129,13 +133,35 @@ class Parser:
         
         tss_file_path = self.ts_dir_path.joinpath(f"{tss_name}.txt")
 
-        with open(tss_file_path) as tss_file:
-            tss_array = tss_file.read().split("\n")
-        tss_values = [int(x) for x in tss_array if x != ""]
-        for ts in tss_values:
-            self.cursor.execute("INSERT INTO time_step (value) VALUES (?);",(ts,))
-        w = (8760/len(tss_values))/dt
-        self.cursor.execute("UPDATE param_global SET dt = ?, w = ? WHERE constant_column = 1;", (dt,w))
+        tss_values = self.ts_loader.load(tss_file_path).astype(int)
+
+        # hours of the year represented by each selected hour, uniform unless the selection comes with weights (see core.clustering)
+        weights_file_path = self.ts_dir_path.joinpath(f"{tss_name}_weights.txt")
+        if weights_file_path.exists():
+            hours = self.ts_loader.load(weights_file_path)
+            if len(hours) != len(tss_values):
+                raise ValueError(f"{weights_file_path.name} has {len(hours)} weights for {len(tss_values)} time steps")
+        else:
+            hours = np.full(len(tss_values), 8760/len(tss_values))
+
+        # time steps of the model: the selected hours, or segments of consecutive ones with an aggregation
+        if self.aggregation is None:
+            starts = np.arange(len(tss_values))
+        else:
+            features = None
+            if self.aggregation.startswith("adaptive"):
+                features = profile_features(read_profiles(tmap, self.ts_dir_path, self.ts_loader), tss_values)
+            starts = segment_starts(self.aggregation, tss_values, dt, features)
+        self._tss_values, self._step_starts = tss_values, starts
+        self._step_hours = np.add.reduceat(hours, starts)
+        step_dt = dt * np.diff(np.append(starts, len(tss_values)))
+
+        self.cursor.executemany("INSERT INTO time_step (value) VALUES (?);", ((ts,) for ts in tss_values[starts].tolist()))
+        t_ids = dict(self.cursor.execute("SELECT value, id FROM time_step").fetchall())
+        self.cursor.executemany(
+            "INSERT INTO param_t (t_id, dt, w) VALUES (?, ?, ?);",
+            zip((t_ids[ts] for ts in tss_values[starts].tolist()), step_dt.tolist(), (self._step_hours/step_dt).tolist())
+        )
         self.conn.commit()
 
     def read_co(self, tmap) -> None:
@@ -154,68 +180,73 @@ class Parser:
         
     def read_cs(self, tmap):
         df = pd.read_excel(tmap,"ConversionSubProcess",  skiprows=[1, 2])
+        df = df[~df["conversion_process_name"].isna()]
         # TO DO - verify the scenario of the conversion process
         param_names= df.columns[df.columns.to_list().index("scenario")+1:].to_list()
-        for _, row in df.iterrows():
-            if not pd.isna(row["conversion_process_name"]):
-                cin_id = self.cursor.execute("SELECT id FROM commodity WHERE name =?",(row["commodity_in"],)).fetchall()[0][0]
-                cout_id = self.cursor.execute("SELECT id FROM commodity WHERE name =?",(row["commodity_out"],)).fetchall()[0][0]
-                cp_id = self.cursor.execute("SELECT id FROM conversion_process WHERE name =?",(row["conversion_process_name"],)).fetchall()[0][0]
-                self.cursor.execute("INSERT INTO conversion_subprocess (cp_id, cin_id, cout_id) VALUES (?,?,?);",(cp_id,cin_id,cout_id))
-                self.conn.commit()
-                cs_id = self.cursor.lastrowid
-                # self.datasets["CS"].append(cs)
-                for p_name in param_names:
-                    p = row[p_name]
-                    if not pd.isna(p):
-                        if "T" not in self.param_index_dict[p_name]: # not time dependent
-                            if "Y" in self.param_index_dict[p_name]:
-                                years = self.cursor.execute("SELECT id,value FROM year").fetchall()
-                                #see if interval
-                                if '[' in str(p): # inveterval given
-                                    f_int = self.get_interpolation_f(p)
-                                    for y_id,y in years:
-                                        val = f_int(y)
-                                        if not np.isnan(val):                                        
-                                            val = float(f_int(y))
-                                            try:
-                                                self.cursor.execute(f"INSERT INTO param_cs_y (cs_id, y_id, {p_name}) VALUES (?,?,?);",(cs_id,y_id,self._scale(p_name,val)))
-                                            except:
-                                                self.cursor.execute(f"UPDATE param_cs_y SET {p_name} = ? WHERE cs_id = ? AND y_id = ?;",(self._scale(p_name,val),cs_id,y_id))
-                                else: # no interval given - constant
-                                    for y_id,y in years:
-                                        try:
-                                            self.cursor.execute(f"INSERT INTO param_cs_y (cs_id, y_id, {p_name}) VALUES (?,?,?);",(cs_id,y_id,self._scale(p_name,p)))
-                                        except:
-                                            self.cursor.execute(f"UPDATE param_cs_y SET {p_name} = ? WHERE cs_id = ? AND y_id = ?;",(self._scale(p_name,p),cs_id,y_id))
-                            else: # not dependent on the year
-                                try:
-                                    self.cursor.execute(f"INSERT INTO param_cs (cs_id, {p_name}) VALUES (?,?);",(cs_id,self._scale(p_name,p)))
-                                except:
-                                    self.cursor.execute(f"UPDATE param_cs SET {p_name} = ? WHERE cs_id = ?;",(self._scale(p_name,p),cs_id))
-                        else: # time dependent
-                            ts_file_path = self.ts_dir_path.joinpath(f"{p}.txt")
-                            tss = self.cursor.execute("SELECT id,value FROM time_step").fetchall()
-                            Row = namedtuple("Row", ["id", "value"])
-                            tss = [Row(*row) for row in tss]
-                            with open(ts_file_path) as ts_file:
-                                ts = ts_file.read().split(" ")
-                                ts = [float(x) for x in ts if x != ""]
-                                ts.insert(0,0) # add to match index
-                                ts = np.array(ts)
-                                ts = ts[[x.value for x in tss]]
-                                     
-                            #Potentential normalization
-                            if p_name in ["output_profile"]:
-                                ts = ts/sum(ts)
-                            # insert to database
-                            for i,time_step in enumerate(tss):
-                                try:
-                                    self.cursor.execute(f"INSERT INTO param_cs_t (cs_id, t_id, {p_name}) VALUES (?,?,?);",(cs_id,time_step.id,self._scale(p_name,ts[i])))
-                                except:
-                                    self.cursor.execute(f"UPDATE param_cs_t {p_name} = ? WHERE cs_id=? AND t_id=?;",(self._scale(p_name,ts[i]),cs_id,time_step.id,))
+
+        # resolve ids in memory
+        co_ids = dict(self.cursor.execute("SELECT name, id FROM commodity").fetchall())
+        cp_ids = dict(self.cursor.execute("SELECT name, id FROM conversion_process").fetchall())
+        years = self.cursor.execute("SELECT id, value FROM year").fetchall()
+        tss = self.cursor.execute("SELECT id, value FROM time_step ORDER BY id").fetchall()
+        y_ids, y_values = np.array([x[0] for x in years]), np.array([x[1] for x in years])
+        t_ids = np.array([x[0] for x in tss])
+
+        cs_keys = [
+            (cp_ids[row["conversion_process_name"]], co_ids[row["commodity_in"]], co_ids[row["commodity_out"]])
+            for _, row in df.iterrows()
+        ]
+        self.cursor.executemany("INSERT INTO conversion_subprocess (cp_id, cin_id, cout_id) VALUES (?,?,?);", cs_keys)
+        cs_id_of = {tuple(x[1:]): x[0] for x in self.cursor.execute("SELECT id, cp_id, cin_id, cout_id FROM conversion_subprocess").fetchall()}
+        cs_ids = [cs_id_of[key] for key in cs_keys]
+
+        # long format parameter tables: table -> parameter -> list of (ids..., value) arrays
+        long_tables = {"param_cs": {}, "param_cs_y": {}, "param_cs_t": {}}
+        for cs_id, (_, row) in zip(cs_ids, df.iterrows()):
+            for p_name in param_names:
+                p = row[p_name]
+                if pd.isna(p):
+                    continue
+                if "T" in self.param_index_dict[p_name]: # time dependent
+                    ts = self._read_step_ts(p)
+                    #Potentential normalization: share of the annual energy in each time step
+                    if p_name in ["output_profile"]:
+                        ts = ts*self._step_hours/sum(ts*self._step_hours)
+                    entry = ("param_cs_t", np.full(len(t_ids), cs_id), t_ids, self._scale(p_name, ts))
+                elif "Y" in self.param_index_dict[p_name]:
+                    if '[' in str(p): # inveterval given
+                        f_int = self.get_interpolation_f(p)
+                        vals = np.array([float(f_int(y)) for y in y_values])
+                    else: # no interval given - constant
+                        vals = np.full(len(y_ids), float(p))
+                    given = ~np.isnan(vals)
+                    entry = ("param_cs_y", np.full(given.sum(), cs_id), y_ids[given], self._scale(p_name, vals[given]))
+                else: # not dependent on the year
+                    entry = ("param_cs", np.array([cs_id]), self._scale(p_name, np.array([p])))
+                table, *columns = entry
+                long_tables[table].setdefault(p_name, []).append(columns)
+
+        id_columns = {"param_cs": ["cs_id"], "param_cs_y": ["cs_id", "y_id"], "param_cs_t": ["cs_id", "t_id"]}
+        for table, params in long_tables.items():
+            conflict = ", ".join(id_columns[table])
+            for p_name, chunks in params.items():
+                columns = [np.concatenate(x).tolist() for x in zip(*chunks)]
+                self.cursor.executemany(f"""
+                    INSERT INTO {table} ({conflict}, {p_name}) VALUES ({", ".join("?" * len(columns))})
+                    ON CONFLICT ({conflict}) DO UPDATE SET {p_name} = excluded.{p_name};
+                """, zip(*columns))
         self.conn.commit()
 
+    def _read_ts(self, ts_name) -> np.ndarray:
+        """Values of a time series file, the first value belongs to time step 1"""
+        return self.ts_loader.load(self.ts_dir_path.joinpath(f"{ts_name}.txt"))
+
+    def _read_step_ts(self, ts_name) -> np.ndarray:
+        """Values of a time series at the time steps of the model, averaged over the hours of aggregated steps"""
+        values = self._read_ts(ts_name)[self._tss_values - 1] # time steps start at 1
+        lengths = np.diff(np.append(self._step_starts, len(values)))
+        return np.add.reduceat(values, self._step_starts) / lengths
+
     def get_interpolation_f(self, param):
         """
         Get the interpolation function for the pairs inputed in the techmap
@@ -0,0 +1,627 @@
+"""
+Vectorized Energy System Planning Model
+
+Builds the same LP as core.model.Model, but creates every variable family as
+one block shaped like its index sets (an MVar for Gurobi) and adds every
+constraint family as one sparse matrix through the solver backend.
+"""
+
+import json
+import numpy as np
+import scipy.sparse as sp
+from pathlib import Path
+from core.model import Model
+from core.params import Param_Index_Dict
+from core.solver import Solvers
+from core.profiler import record_family
+
+# constraint families built from each parameter, the costs enter the objective through capex and opex
+_Param_Families = {
+    "dt": ["eouttime", "eintime", "storage_energy_balance"],
+    "w": ["eouttime", "eintime"],
+    "discount_rate": ["capex", "opex", "salvage_value"],
+    "annual_co2_limit": ["co2_emission_limit"],
+    "co2_price": ["opex"],
+    "opex_cost_energy": ["opex"],
+    "opex_cost_power": ["opex"],
+    "capex_cost_power": ["capex", "salvage_value"],
+    "efficiency": ["efficiency_eq", "storage_energy_balance"],
+    "technical_lifetime": ["salvage_value", "total_salvage_value", "cap_active"],
+    "cap_min": ["min_cap_active"],
+    "cap_max": ["max_cap_active"],
+    "cap_res_min": ["min_cap_res"],
+    "cap_res_max": ["max_cap_res"],
+    "availability_profile": ["re_availability"],
+    "technical_availability": ["technical_availability"],
+    "output_profile": ["load_shape"],
+    "max_eout": ["max_energy_out"],
+    "min_eout": ["min_energy_out"],
+    "out_frac_min": ["min_cosupply"],
+    "out_frac_max": ["max_cosupply"],
+    "in_frac_min": ["min_couse"],
+    "in_frac_max": ["max_couse"],
+    "spec_co2": ["co2_emission_eq"],
+    "c_rate": ["c_rate_relation"],
+    "efficiency_charge": ["storage_energy_balance"],
+}
+# in the compact formulation dt and w enter every family that uses one of the substituted variables
+_Compact_Param_Families = {
+    "dt": ["energy_power_out", "energy_power_in", "min_cosupply", "max_cosupply", "min_couse", "max_couse",
+           "load_shape", "storage_energy_balance"],
+    "w": ["energy_power_out", "energy_power_in", "min_cosupply", "max_cosupply", "min_couse", "max_couse",
+          "load_shape"],
+}
+# with reduce the upper bounds of Pout are merged into max_power_out
+_Reduced_Param_Families = {
+    "availability_profile": ["max_power_out"],
+    "technical_availability": ["max_power_out"],
+}
+# variables that are linear expressions of Pin and Pout in the compact formulation, and the families defining them
+# Eouttot and Eintot stay columns, substituting their sums over t would make load_shape dense
+_Substituted = ["Eouttime", "Eintime", "Enetgen", "Enetcons"]
+_Defining_Families = {"eouttime", "eintime", "net_to_gen", "net_to_con"}
+# substituted variables get column numbers from here on, _add_family replaces them by their expressions
+_Virtual_Offset = 1 << 40
+
+
+class MatrixModel(Model):
+    solvers = tuple(Solvers)
+
+    def __init__(self, conn, solver: str = "gurobi", threads: int = None, years: list = None, cap_new_before: dict = None, compact: bool = False, reduce: bool = True, keep_build: bool = False) -> None:
+        """
+        years restricts the model to a window of consecutive years of the
+        scenario. cap_new_before maps earlier years to their (fixed) Cap_new per
+        subprocess, which stays active in the window within its lifetime.
+        compact substitutes the energy variables (Eouttime, Eintime, Enetgen,
+        Enetcons) by their expressions in Pin and Pout, they are computed from
+        the solution when saving.
+        reduce merges the three upper bounds of Pout into one row with the
+        tightest factor and leaves out rows that can not be binding, e.g.
+        fraction limits of one or lower bounds of zero. The number of rows left
+        out per family is kept in removed_rows.
+        keep_build keeps the calls to the solver backend, so that the built
+        model can be written with save_build and loaded again with load.
+        """
+        self.window = years
+        self.cap_new_before = cap_new_before or {}
+        self.compact = compact
+        self.reduce = reduce
+        self.removed_rows = {}
+        self._build_log = [] if keep_build else None
+        super().__init__(conn, solver, threads)
+
+    def _years(self) -> list:
+        return self.sets["Y"]
+
+    def _init_sets(self) -> None:
+        get_set = self.dao.get_set
+        self.sets = {
+            "CS": get_set("conversion_subprocess"),
+            "CO": get_set("commodity"),
+            "Y": list(self.window) if self.window is not None else get_set("year"),
+            "T": get_set("time"),
+        }
+        # positions of the model years among the scenario years, None when all years are modelled
+        all_years = get_set("year")
+        self._year_pos = None if self.sets["Y"] == all_years else np.array([all_years.index(y) for y in self.sets["Y"]])
+        self.positions = {k: {x: i for i, x in enumerate(v)} for k, v in self.sets.items()}
+
+    def _add_var(self) -> None:
+        self._init_sets()
+        self.vars = {}
+        self.constrs = {}
+        self._cols = {}
+        self._n_cols = 0
+        self._n_virtual = 0
+        self._substitution = None
+        self._collect = None
+
+        self._new_var("TOTEX", [])
+        self._new_var("CAPEX", [])
+        self._new_var("OPEX", [])
+        self._new_var("TotalSalvageValue", [], name="SalvageValue")
+        # variables that can only be nonzero for some of their indexes are created for those only
+        salvage = self.dao.get_salvage_mask(self.sets["Y"])
+        storage = self._member("CS", "storage_cs")
+        has_input = self._member("CS", "input_cs")
+        has_net = self._member("CO", "net_commodity")
+
+        self._new_var("DiscountedSalvageValue", ["CS", "Y"], mask=salvage)
+        self._new_var("Total_annual_co2_emission", ["Y"])
+        self._new_var("Cap_new", ["CS", "Y"])
+        self._new_var("Cap_active", ["CS", "Y"])
+        self._new_var("Cap_res", ["CS", "Y"])
+        self._new_var("Pin", ["CS", "Y", "T"], mask=has_input[:, None, None])
+        self._new_var("Pout", ["CS", "Y", "T"])
+        self._new_var("Eouttot", ["CS", "Y"])
+        self._new_var("Eintot", ["CS", "Y"], mask=has_input[:, None])
+        self._new_var("Eouttime", ["CS", "Y", "T"])
+        self._new_var("Eintime", ["CS", "Y", "T"], mask=has_input[:, None, None])
+        self._new_var("Enetgen", ["CO", "Y", "T"], mask=has_net[:, None, None])
+        self._new_var("Enetcons", ["CO", "Y", "T"], mask=has_net[:, None, None])
+        self._new_var("E_storage_level", ["CS", "Y", "T"], mask=storage[:, None, None])
+        self._new_var("E_storage_level_max", ["CS", "Y"], mask=storage[:, None])
+
+    def _member(self, index: str, set_name: str) -> np.ndarray:
+        """Mask of the elements of the model set index that belong to the set set_name"""
+        members = set(self.dao.get_set(set_name))
+        return np.array([x in members for x in self.sets[index]], dtype=bool)
+
+    def _new_var(self, key: str, indexes: list, name: str = None, mask: np.ndarray = None) -> None:
+        """
+        Adds a variable family shaped like its index sets. With a mask only the
+        True entries get a column, the others have the column -1.
+        """
+        shape = tuple(len(self.sets[index]) for index in indexes)
+        mask = np.ones(shape, dtype=bool) if mask is None else np.broadcast_to(mask, shape)
+        size = int(mask.sum())
+        cols = np.full(shape, -1, dtype=np.int64)
+        if self.compact and key in _Substituted:
+            cols[mask] = _Virtual_Offset + np.arange(self._n_virtual, self._n_virtual + size)
+            self._cols[key] = cols
+            self._n_virtual += size
+            return
+        self.vars[key] = self.backend.add_vars(name or key, shape if mask.all() else (size,))
+        if self._build_log is not None:
+            self._build_log.append(("vars", key, name or key, shape if mask.all() else (size,)))
+        cols[mask] = np.arange(self._n_cols, self._n_cols + size)
+        self._cols[key] = cols
+        self._n_cols += size
+        record_family("variables", key, size)
+
+    def _get_values(self, name: str) -> np.ndarray:
+        """Solution values of a variable family, zero where it has no column"""
+        cols = self._cols[name]
+        exists = cols >= 0
+        values = np.zeros(cols.shape)
+        if self.compact and name in _Substituted:
+            values[exists] = self._substitution[cols[exists] - _Virtual_Offset] @ self.backend.get_values()
+        else:
+            values[exists] = self.backend.get_values()[cols[exists]]
+        return values
+
+    def _set_start(self, name: str, values: np.ndarray) -> int:
+        if self.compact and name in _Substituted:
+            return 0
+        seeded = ~np.isnan(values) & (self._cols[name] >= 0)
+        self.backend.set_start(self._cols[name][seeded], values[seeded])
+        return int(seeded.sum())
+
+    def _get_array(self, name: str) -> np.ndarray:
+        """Parameter array restricted to the model years"""
+        return self._in_window(name, self.dao.get_array(name))
+
+    def _get_mask(self, name: str) -> np.ndarray:
+        return self._in_window(name, self.dao.params.get_mask(name))
+
+    def _in_window(self, name: str, values: np.ndarray) -> np.ndarray:
+        if self._year_pos is None or "Y" not in Param_Index_Dict[name]:
+            return values
+        return np.take(values, self._year_pos, axis=Param_Index_Dict[name].index("Y"))
+
+    def _drop_redundant(self, name: str, mask: np.ndarray, redundant: np.ndarray) -> np.ndarray:
+        """Row mask of a family without the redundant rows if the model is reduced"""
+        if not self.reduce:
+            return mask
+        redundant = mask & redundant
+        if self._collect is None:
+            self.removed_rows[name] = int(redundant.sum())
+        return mask & ~redundant
+
+    @staticmethod
+    def _enumerate(mask: np.ndarray) -> tuple:
+        """Row number for every True entry of mask (-1 elsewhere) and the number of rows"""
+        rows = np.full(mask.shape, -1)
+        n = int(mask.sum())
+        rows[mask] = np.arange(n)
+        return rows, n
+
+    def _add_family(self, name: str, n_rows: int, terms: list, sense: str, rhs=0.0):
+        """
+        Adds a constraint family as one sparse matrix.
+        Each term is a (rows, cols, coefs) triple of arrays that are broadcast
+        against each other; entries with a negative row or column (a variable
+        that is not created) are skipped.
+        While families are collected for update_param, only the matrices of the
+        collected families are built and nothing is added to the solver.
+        In the compact formulation, columns of substituted variables are
+        replaced by their expressions.
+        """
+        if self.compact and name in _Defining_Families:
+            return None
+        if self._collect is not None and name not in self._collect:
+            return self.constrs[name]
+        all_rows, all_cols, all_vals = [], [], []
+        for term in terms:
+            rows, cols, vals = np.broadcast_arrays(*term)
+            keep = (rows >= 0) & (cols >= 0) & (vals != 0)
+            all_rows.append(rows[keep])
+            all_cols.append(cols[keep])
+            all_vals.append(vals[keep].astype(float))
+        rows, cols, vals = np.concatenate(all_rows), np.concatenate(all_cols), np.concatenate(all_vals)
+        real = cols < _Virtual_Offset
+        A = sp.csr_matrix((vals[real], (rows[real], cols[real])), shape=(n_rows, self._n_cols))
+        if not real.all():
+            virtual = sp.csr_matrix((vals[~real], (rows[~real], cols[~real] - _Virtual_Offset)), shape=(n_rows, self._n_virtual))
+            A = A + virtual @ self._substitution
+        rhs = np.broadcast_to(np.asarray(rhs, dtype=float), (n_rows,))
+        if self._collect is not None:
+            self._collect[name] = (A, rhs, sense)
+            return self.constrs[name]
+        self.constrs[name] = self.backend.add_constrs(name, A, sense, rhs)
+        if self._build_log is not None:
+            self._build_log.append(("constrs", name, A, sense, rhs))
+        record_family("constraints", name, n_rows, A.nnz)
+        return self.constrs[name]
+
+    def _build_families(self, names: list) -> dict:
+        """Matrices, right-hand sides and senses of the given families with the current parameters"""
+        self._collect = dict.fromkeys(names)
+        try:
+            self._add_constr()
+            return self._collect
+        finally:
+            self._collect = None
+
+    def update_param(self, name: str, index, value) -> None:
+        """
+        Changes one entry of a parameter and patches the coefficients and
+        right-hand sides of the built model, so that it can be solved again
+        without parsing and building. index is the set element (a CS, year or
+        time step), a tuple of them for parameters with several indexes, or
+        None for global parameters. Updates that add or remove constraints,
+        e.g. setting a CO2 limit for a year without one or a fraction limit
+        below one where the reduced model left it out, need a rebuild.
+        """
+        if name not in _Param_Families:
+            raise ValueError(f"{name} can not be updated in place, rebuild the model instead")
+        n_indexes = len(Param_Index_Dict[name])
+        indices = () if n_indexes == 0 else (index,) if n_indexes == 1 else tuple(index)
+        params = self.dao.params
+        old_value = params.iter_row(name)[0] if n_indexes == 0 else next(
+            (row[-1] for row in params.iter_row(name) if tuple(row[:-1]) == indices), None
+        )
+
+        families = _Param_Families[name]
+        if self.compact:
+            families = _Compact_Param_Families.get(name, families)
+        if self.reduce:
+            families = _Reduced_Param_Families.get(name, families)
+        old = self._build_families(families)
+        params.set_value(name, value, *indices)
+        new = self._build_families(families)
+        for family in families:
+            if new[family][0].shape != old[family][0].shape:
+                params.set_value(name, old_value, *indices)
+                raise ValueError(f"Changing {name} adds or removes rows of {family}, rebuild the model instead")
+
+        for family in families:
+            (old_A, old_rhs, sense), (new_A, new_rhs, _) = old[family], new[family]
+            diff = (new_A - old_A).tocoo()
+            changed = diff.data != 0
+            rows, cols = diff.row[changed], diff.col[changed]
+            if len(rows):
+                self.backend.chg_coeffs(self.constrs[family], rows, cols, np.asarray(new_A[rows, cols]).ravel())
+            rows = np.nonzero(new_rhs != old_rhs)[0]
+            if len(rows):
+                self.backend.set_rhs(self.constrs[family], rows, sense, new_rhs[rows])
+
+    def save_build(self, path: Path) -> None:
+        """
+        Writes the built model to path (.npz): the variable blocks, constraint
+        matrices and objective passed to the solver backend, and the columns of
+        every variable family. Needs a model built with keep_build, the kept
+        calls are released afterwards.
+        """
+        if self._build_log is None:
+            raise ValueError("The model was built without keep_build, it can not be saved")
+        if self.window is not None:
+            raise ValueError("Only models of all years can be saved")
+        arrays, calls = {}, []
+        for i, (kind, *args) in enumerate(self._build_log):
+            if kind == "vars":
+                calls.append([kind, args[0], args[1], list(args[2])])
+            elif kind == "constrs":
+                name, A, sense, rhs = args
+                arrays.update({f"A{i}_data": A.data, f"A{i}_indices": A.indices, f"A{i}_indptr": A.indptr, f"A{i}_shape": np.array(A.shape), f"rhs{i}": rhs})
+                calls.append([kind, name, sense, i])
+            else:
+                arrays.update({f"obj{i}_cols": args[0], f"obj{i}_coefs": args[1]})
+                calls.append([kind, i])
+        arrays.update({f"cols_{key}": cols for key, cols in self._cols.items()})
+        if self._substitution is not None:
+            substitution = self._substitution.tocsr()
+            arrays.update(sub_data=substitution.data, sub_indices=substitution.indices, sub_indptr=substitution.indptr, sub_shape=np.array(substitution.shape))
+        meta = {
+            "calls": calls, "compact": self.compact, "reduce": self.reduce, "removed_rows": self.removed_rows,
+            "n_cols": self._n_cols, "n_virtual": self._n_virtual,
+        }
+        with open(path, "wb") as file:
+            np.savez(file, meta=np.array(json.dumps(meta)), **arrays)
+        self._build_log = None
+
+    @classmethod
+    def load(cls, conn, path: Path, solver: str = "gurobi", threads: int = None) -> "MatrixModel":
+        """
+        Model written by save_build, passed to the solver without building it
+        again. The database must hold the parameters the model was built from.
+        """
+        self = cls.__new__(cls)
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            self.window, self.cap_new_before = None, {}
+            self.compact, self.reduce, self.removed_rows = meta["compact"], meta["reduce"], meta["removed_rows"]
+            self._build_log = None
+            self._connect(conn, solver, threads)
+            self._init_sets()
+            self.vars, self.constrs = {}, {}
+            for kind, *args in meta["calls"]:
+                if kind == "vars":
+                    key, name, shape = args
+                    self.vars[key] = self.backend.add_vars(name, tuple(shape))
+                elif kind == "constrs":
+                    name, sense, i = args
+                    A = sp.csr_matrix((data[f"A{i}_data"], data[f"A{i}_indices"], data[f"A{i}_indptr"]), shape=tuple(data[f"A{i}_shape"]))
+                    self.constrs[name] = self.backend.add_constrs(name, A, sense, data[f"rhs{i}"])
+                else:
+                    self.backend.set_objective(data[f"obj{args[0]}_cols"], data[f"obj{args[0]}_coefs"])
+            self._cols = {name[len("cols_"):]: data[name] for name in data.files if name.startswith("cols_")}
+            self._n_cols, self._n_virtual = meta["n_cols"], meta["n_virtual"]
+            self._substitution = None
+            if "sub_data" in data.files:
+                self._substitution = sp.csr_matrix((data["sub_data"], data["sub_indices"], data["sub_indptr"]), shape=tuple(data["sub_shape"]))
+        self._collect = None
+        return self
+
+    def _add_constr(self) -> None:
+        cols = self._cols # alias for readability
+        get_array = self._get_array
+        get_mask = self._get_mask
+        sets = self.sets
+
+        n_cs, n_y, n_t = len(sets["CS"]), len(sets["Y"]), len(sets["T"])
+        years = np.array(sets["Y"])
+        last_year = years[-1]
+        discount = np.array([self.dao.get_discount_factor(y) for y in sets["Y"]])
+        all_years = np.array(self.dao.get_set("year"))
+        year_gap = np.append(np.diff(all_years), 1)[self._year_pos if self._year_pos is not None else slice(None)]
+        # every subprocess has exactly one input and one output commodity
+        cin = self.dao.get_incidence_matrix("in").indices
+        cout = self.dao.get_incidence_matrix("out").indices
+        storage = self._member("CS", "storage_cs")
+        has_input = self._member("CS", "input_cs")
+        nondummy = self._member("CO", "nondummy_commodity")
+        has_net = self._member("CO", "net_commodity")
+        lifetime = get_array("technical_lifetime")
+        dt, w = get_array("dt")[None, None, :], get_array("w")[None, None, :]
+
+        all_cs_y_t = np.ones((n_cs, n_y, n_t), dtype=bool)
+        all_cs_y = np.ones((n_cs, n_y), dtype=bool)
+        y_ax = np.arange(n_y)[None, :, None]
+        t_ax = np.arange(n_t)[None, None, :]
+        if self.compact:
+            self._substitution = self._build_substitution(dt * w, cin, cout)
+
+        # Costs
+        self._add_family("totex", 1, [
+            (0, cols["TOTEX"], 1), (0, cols["CAPEX"], -1), (0, cols["OPEX"], -1)
+        ], "=")
+        self._add_family("capex", 1, [
+            (0, cols["CAPEX"], 1),
+            (0, cols["Cap_new"], -discount * get_array("capex_cost_power")),
+            (0, cols["TotalSalvageValue"], 1),
+        ], "=")
+        self._add_family("opex", 1, [
+            (0, cols["OPEX"], 1),
+            (0, cols["Cap_active"], -get_array("opex_cost_power") * year_gap * discount),
+            (0, cols["Eouttot"], -get_array("opex_cost_energy") * year_gap * discount),
+            (0, cols["Total_annual_co2_emission"], -get_array("co2_price") * year_gap * discount),
+        ], "=")
+
+        # Salvage Value
+        salvage = self.dao.get_salvage_mask(sets["Y"])
+        rows, n = self._enumerate(salvage)
+        salvage_factor = get_array("capex_cost_power") * (1 - (last_year - years + 1)[None, :] / lifetime[:, None]) * self.dao.get_discount_factor(last_year)
+        self._add_family("salvage_value", n, [
+            (rows, cols["DiscountedSalvageValue"], 1),
+            (rows, cols["Cap_new"], -salvage_factor),
+        ], "=")
+        self._add_family("total_salvage_value", 1, [
+            (0, cols["TotalSalvageValue"], 1),
+            (np.where(salvage, 0, -1), cols["DiscountedSalvageValue"], -1),
+        ], "=")
+
+        # Power Balance
+        rows, n = self._enumerate(np.broadcast_to(nondummy[:, None, None], (len(sets["CO"]), n_y, n_t)))
+        self._add_family("power_balance", n, [
+            (rows[cin[:, None, None], y_ax, t_ax], cols["Pin"], 1),
+            (rows[cout[:, None, None], y_ax, t_ax], cols["Pout"], -1),
+        ], "=")
+
+        # CO2
+        self._add_family("co2_emission_eq", n_y, [
+            (np.arange(n_y), cols["Total_annual_co2_emission"], 1),
+            (np.arange(n_y)[None, :], cols["Eouttot"], -get_array("spec_co2")[:, None]),
+        ], "=")
+        limit = get_mask("annual_co2_limit")
+        rows, n = self._enumerate(limit)
+        self._add_family("co2_emission_limit", n, [
+            (rows, cols["Total_annual_co2_emission"], 1),
+        ], "<", get_array("annual_co2_limit")[limit])
+
+        # Power Output Constraints, subprocesses without Pin (Dummy input, see input_cs) only
+        # need the row for an efficiency of zero, which forces Pout to zero
+        efficiency_rows = ~storage & (has_input | (get_array("efficiency") == 0))
+        rows, n = self._enumerate(np.broadcast_to(efficiency_rows[:, None, None], (n_cs, n_y, n_t)))
+        self._add_family("efficiency_eq", n, [
+            (rows, cols["Pout"], 1),
+            (rows, cols["Pin"], -get_array("efficiency")[:, None, None]),
+        ], "=")
+        rows, n = self._enumerate(all_cs_y_t)
+        if self.reduce:
+            # the three bounds only differ in the factor of Cap_active, the smallest one is binding
+            factor = np.minimum(1, np.minimum(get_array("availability_profile")[:, None, :], get_array("technical_availability")[:, None, None]))
+            self._add_family("max_power_out", n, [
+                (rows, cols["Pout"], 1),
+                (rows, cols["Cap_active"][:, :, None], -factor),
+            ], "<")
+            if self._collect is None:
+                self.removed_rows.update(re_availability=n, technical_availability=n)
+        else:
+            self._add_family("max_power_out", n, [
+                (rows, cols["Pout"], 1),
+                (rows, cols["Cap_active"][:, :, None], -1),
+            ], "<")
+            self._add_family("re_availability", n, [
+                (rows, cols["Pout"], 1),
+                (rows, cols["Cap_active"][:, :, None], -get_array("availability_profile")[:, None, :]),
+            ], "<")
+            self._add_family("technical_availability", n, [
+                (rows, cols["Pout"], 1),
+                (rows, cols["Cap_active"][:, :, None], -get_array("technical_availability")[:, None, None]),
+            ], "<")
+
+        # Power Energy Constraints
+        self._add_family("eouttime", n, [
+            (rows, cols["Eouttime"], 1),
+            (rows, cols["Pout"], -dt * w),
+        ], "=")
+        rows, n = self._enumerate(np.broadcast_to(has_input[:, None, None], (n_cs, n_y, n_t)))
+        self._add_family("eintime", n, [
+            (rows, cols["Eintime"], 1),
+            (rows, cols["Pin"], -dt * w),
+        ], "=")
+
+        # Fraction Equations, E <= f Enet can not be binding for f >= 1 and E >= f Enet not for f <= 0
+        def fraction_rows(name, param, energy, net, commodity, sense, skip_zero=False):
+            mask = get_mask(param)
+            if skip_zero:
+                mask = mask & (get_array(param) != 0)
+            mask = self._drop_redundant(name, mask, get_array(param) >= 1 if sense == "<" else get_array(param) <= 0)
+            rows, n = self._enumerate(np.broadcast_to(mask[:, :, None], (n_cs, n_y, n_t)))
+            self._add_family(name, n, [
+                (rows, cols[energy], 1),
+                (rows, cols[net][commodity[:, None, None], y_ax, t_ax], -get_array(param)[:, :, None]),
+            ], sense)
+        fraction_rows("min_cosupply", "out_frac_min", "Eouttime", "Enetgen", cout, ">", skip_zero=True)
+        fraction_rows("max_cosupply", "out_frac_max", "Eouttime", "Enetgen", cout, "<")
+        fraction_rows("min_couse", "in_frac_min", "Eintime", "Enetcons", cin, ">")
+        fraction_rows("max_couse", "in_frac_max", "Eintime", "Enetcons", cin, "<")
+
+        self._add_capacity_constr()
+
+        # Energy
+        rows, n = self._enumerate(all_cs_y)
+        self._add_family("energy_power_out", n, [
+            (rows, cols["Eouttot"], 1),
+            (rows[:, :, None], cols["Eouttime"], -1),
+        ], "=")
+        rows, n = self._enumerate(np.broadcast_to(has_input[:, None], (n_cs, n_y)))
+        self._add_family("energy_power_in", n, [
+            (rows, cols["Eintot"], 1),
+            (rows[:, :, None], cols["Eintime"], -1),
+        ], "=")
+        for name, param, sense in (("max_energy_out", "max_eout", "<"), ("min_energy_out", "min_eout", ">")):
+            mask = get_mask(param)
+            if sense == ">":
+                mask = self._drop_redundant(name, mask, get_array(param) <= 0)
+            rows, n = self._enumerate(mask)
+            self._add_family(name, n, [(rows, cols["Eouttot"], 1)], sense, get_array(param)[mask])
+        profile = get_mask("output_profile")
+        rows, n = self._enumerate(np.broadcast_to(profile[:, None, :], (n_cs, n_y, n_t)))
+        self._add_family("load_shape", n, [
+            (rows, cols["Eouttime"], 1),
+            (rows, cols["Eouttot"][:, :, None], -get_array("output_profile")[:, None, :]),
+        ], "=")
+        rows, n = self._enumerate(np.broadcast_to(has_net[:, None, None], (len(sets["CO"]), n_y, n_t)))
+        self._add_family("net_to_gen", n, [
+            (rows, cols["Enetgen"], 1),
+            (rows[cout[:, None, None], y_ax, t_ax], cols["Eouttime"], -1),
+        ], "=")
+        self._add_family("net_to_con", n, [
+            (rows, cols["Enetcons"], 1),
+            (rows[cin[:, None, None], y_ax, t_ax], cols["Eintime"], -1),
+        ], "=")
+
+        # Storage
+        rows, n = self._enumerate(np.broadcast_to(storage[:, None, None], (n_cs, n_y, n_t)))
+        self._add_family("storage_energy_limit", n, [
+            (rows, cols["E_storage_level"], 1),
+            (rows, cols["E_storage_level_max"][:, :, None], -1),
+        ], "<")
+        self._add_family("storage_charge_power_limit", n, [
+            (rows, cols["Pin"], 1),
+            (rows, cols["Cap_active"][:, :, None], -1),
+        ], "<")
+        self._add_family("storage_energy_balance", n, [
+            (rows, cols["E_storage_level"], 1),
+            (rows, np.roll(cols["E_storage_level"], 1, axis=2), -1),
+            (rows, cols["Pin"], -dt * get_array("efficiency_charge")[:, None, None]),
+            (rows, cols["Pout"], dt / get_array("efficiency")[:, None, None]),
+        ], "=")
+        rows, n = self._enumerate(np.broadcast_to(storage[:, None], (n_cs, n_y)))
+        self._add_family("c_rate_relation", n, [
+            (rows, cols["E_storage_level_max"], 1),
+            (rows, cols["Cap_active"], -1 / get_array("c_rate")[:, None]),
+        ], "=")
+
+        if self._collect is None:
+            self.backend.set_objective(cols["TOTEX"].ravel(), 1.0)
+            if self._build_log is not None:
+                self._build_log.append(("objective", cols["TOTEX"].ravel(), np.ones(cols["TOTEX"].size)))
+
+    def _build_substitution(self, dtw: np.ndarray, cin: np.ndarray, cout: np.ndarray) -> sp.csr_matrix:
+        """Expressions of the substituted variables in Pin and Pout, one row per (virtual) column"""
+        cols = self._cols # alias for readability
+        rows, exprs, coefs = [], [], []
+        for energy, power, commodity, net in (
+            ("Eouttime", "Pout", cout, "Enetgen"),
+            ("Eintime", "Pin", cin, "Enetcons"),
+        ):
+            factor = np.broadcast_to(dtw, cols[power].shape)
+            # E(cs,y,t) = dt(t) w(t) P(cs,y,t)
+            rows.append(cols[energy].ravel())
+            # Enet(co,y,t) = sum of E(cs,y,t) over the subprocesses with commodity co
+            rows.append(cols[net][commodity].ravel())
+            exprs += [cols[power].ravel()] * 2
+            coefs += [factor.ravel()] * 2
+        rows, exprs, coefs = np.concatenate(rows), np.concatenate(exprs), np.concatenate(coefs)
+        keep = (rows >= 0) & (exprs >= 0)
+        return sp.csr_matrix(
+            (coefs[keep], (rows[keep] - _Virtual_Offset, exprs[keep])),
+            shape=(self._n_virtual, self._n_cols)
+        )
+
+    def _add_capacity_constr(self) -> None:
+        """Bounds of Cap_res and Cap_active and the build-up of Cap_active from Cap_new"""
+        cols = self._cols # alias for readability
+        get_array = self._get_array
+        get_mask = self._get_mask
+        n_cs, n_y = len(self.sets["CS"]), len(self.sets["Y"])
+        years = np.array(self.sets["Y"])
+        lifetime = get_array("technical_lifetime")
+
+        rows, n = self._enumerate(np.ones((n_cs, n_y), dtype=bool))
+        self._add_family("max_cap_res", n, [(rows, cols["Cap_res"], 1)], "<", get_array("cap_res_max").ravel())
+        # lower bounds of zero are implied by the nonnegative variables
+        cap_res_min = get_array("cap_res_min")
+        mask = self._drop_redundant("min_cap_res", np.ones((n_cs, n_y), dtype=bool), cap_res_min <= 0)
+        min_rows, n_min = self._enumerate(mask)
+        self._add_family("min_cap_res", n_min, [(min_rows, cols["Cap_res"], 1)], ">", cap_res_min[mask])
+        # Cap_new of year yy is active in year y if y-lifetime < yy <= y
+        active = (years[None, None, :] <= years[None, :, None]) & (years[None, None, :] > years[None, :, None] - lifetime[:, None, None])
+        # capacity built before the window that is still active
+        cap_before = np.zeros((n_cs, n_y))
+        for yy, cap_new in self.cap_new_before.items():
+            cap_before += np.asarray(cap_new)[:, None] * ((yy <= years)[None, :] & (yy > years[None, :] - lifetime[:, None]))
+        self._add_family("cap_active", n, [
+            (rows, cols["Cap_active"], 1),
+            (rows, cols["Cap_res"], -1),
+            (rows[:, :, None], cols["Cap_new"][:, None, :], -active.astype(float)),
+        ], "=", cap_before.ravel())
+        for name, param, sense in (("max_cap_active", "cap_max", "<"), ("min_cap_active", "cap_min", ">")):
+            mask = get_mask(param)
+            if sense == ">":
+                mask = self._drop_redundant(name, mask, get_array(param) <= 0)
+            rows, n = self._enumerate(mask)
+            self._add_family(name, n, [(rows, cols["Cap_active"], 1)], sense, get_array(param)[mask])
@@ -6,33 +6,58 @@ Date: 10.10.2023
 """
 
 import gurobipy as gp
+import numpy as np
 from gurobipy import GRB
 from core.data_access import DAO
+from core.profiler import track_families
+from core.params import Output_Index_Dict, Set_Names
+from core.solver import get_backend
+from core.warm_start import read_start_values
 from sqlite3 import Connection
 
+# set names of the variable indexes, including the variables that are not saved by name
+_Var_Sets = {
+    name: [Set_Names[index] for index in indexes]
+    for name, indexes in {**Output_Index_Dict, "DiscountedSalvageValue": ["CS", "Y"]}.items()
+}
+
 
 class Model():
-    def __init__(self, conn: Connection) -> None:
-        self.model = gp.Model("DEModel")
-        self.conn = conn
-        self.cursor = self.conn.cursor()
-        self.dao = DAO(self.conn)
+    # the expression based builder uses the gurobipy modelling objects directly
+    solvers = ("gurobi",)
 
+    def __init__(self, conn: Connection, solver: str = "gurobi", threads: int = None) -> None:
+        self._connect(conn, solver, threads)
         self._add_var()
         self._add_constr()
+
+    def _connect(self, conn: Connection, solver: str, threads: int) -> None:
+        """Creates the solver backend and the data access of the model"""
+        if solver not in self.solvers:
+            raise ValueError(f"{type(self).__name__} does not support the solver {solver}, supported solvers: {list(self.solvers)}")
+        self.backend = get_backend(solver, "DEModel", threads=threads)
+        self.model = self.backend.model
+        self.conn = conn
+        self.cursor = self.conn.cursor()
+        self.dao = DAO(self.conn)
     
     def _add_var(self) -> None:
-        model = self.model # alias for readability
+        model = track_families(self.model) # alias for readability, records the families while profiling
         self.vars = {}
         vars = self.vars # alias for readability
         get_set = self.dao.get_set
+        # variables that can only be nonzero for some of their indexes are created for those only
+        salvage = self.dao.get_salvage_mask(get_set("year"))
+        salvage_cs_y = [
+            (cs, y) for i, cs in enumerate(get_set("conversion_subprocess")) for j, y in enumerate(get_set("year")) if salvage[i, j]
+        ]
 
         # Costs
         vars["TOTEX"] = model.addVar(name="TOTEX")
         vars["CAPEX"] = model.addVar(name="CAPEX")
         vars["OPEX"] = model.addVar(name="OPEX")
         vars["TotalSalvageValue"] = model.addVar(name="SalvageValue")
-        vars["DiscountedSalvageValue"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), name="DiscountedSalvageValue")
+        vars["DiscountedSalvageValue"] = model.addVars(salvage_cs_y, name="DiscountedSalvageValue")
 
         # CO2
         vars["Total_annual_co2_emission"] = model.addVars(get_set("year"), name="Total_annual_co2_emission")
@@ -41,23 +66,23 @@ class Model():
         vars["Cap_new"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), name="Cap_new")
         vars["Cap_active"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), name="Cap_active")
         vars["Cap_res"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), name="Cap_res")
-        vars["Pin"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), get_set("time"), name="Pin")
+        vars["Pin"] = model.addVars(get_set("input_cs"), get_set("year"), get_set("time"), name="Pin")
         vars["Pout"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), get_set("time"), name="Pout")
 
         # Energy
         vars["Eouttot"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), name="Eouttot")
-        vars["Eintot"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), name="Eintot")
+        vars["Eintot"] = model.addVars(get_set("input_cs"), get_set("year"), name="Eintot")
         vars["Eouttime"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), get_set("time"), name="Eouttime")
-        vars["Eintime"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), get_set("time"), name="Eintime")
-        vars["Enetgen"] = model.addVars(get_set("commodity"), get_set("year"), get_set("time"), name="Enetgen")
-        vars["Enetcons"] = model.addVars(get_set("commodity"), get_set("year"), get_set("time"), name="Enetcons")
+        vars["Eintime"] = model.addVars(get_set("input_cs"), get_set("year"), get_set("time"), name="Eintime")
+        vars["Enetgen"] = model.addVars(get_set("net_commodity"), get_set("year"), get_set("time"), name="Enetgen")
+        vars["Enetcons"] = model.addVars(get_set("net_commodity"), get_set("year"), get_set("time"), name="Enetcons")
 
         # Storage
-        vars["E_storage_level"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), get_set("time"), name="E_storage_level")
-        vars["E_storage_level_max"] = model.addVars(get_set("conversion_subprocess"), get_set("year"), name="E_storage_level_max")
+        vars["E_storage_level"] = model.addVars(get_set("storage_cs"), get_set("year"), get_set("time"), name="E_storage_level")
+        vars["E_storage_level_max"] = model.addVars(get_set("storage_cs"), get_set("year"), name="E_storage_level_max")
 
     def _add_constr(self) -> None:
-        model = self.model
+        model = track_families(self.model)
         self.constrs = {}
         constrs = self.constrs # alias for readability
         vars = self.vars # alias for readability
@@ -111,27 +136,25 @@ class Model():
         model.addConstrs(
             (
                 vars["DiscountedSalvageValue"][cs,y] == salvage_value_rule(cs,y)
-                for cs in get_set("conversion_subprocess")
-                for y in get_set("year")
-                if (get_set("year")[-1] - y) < get_row("technical_lifetime",cs)
+                for (cs,y) in vars["DiscountedSalvageValue"]
             ),
             name = "salvage_value"
         )
 
 
         model.addConstr(
-            vars["TotalSalvageValue"] == sum(vars["DiscountedSalvageValue"][cs,y] 
-                                             for cs in get_set("conversion_subprocess") for y in get_set("year") 
-                                            if (get_set("year")[-1] - y) < get_row("technical_lifetime",cs)),
+            vars["TotalSalvageValue"] == vars["DiscountedSalvageValue"].sum(),
             name = "total_salvage_value"
         )
 
         # Power Balance
-        nondummy_commodities = {co for co in get_set("commodity") if co != "Dummy"}
+        nondummy_commodities = get_set("nondummy_commodity")
+        cs_in = self.dao.get_commodity_cs("in")
+        cs_out = self.dao.get_commodity_cs("out")
         constrs["power_balance"] = model.addConstrs(
             (
-                sum(vars["Pin"][cs,y,t] for cs in get_set("conversion_subprocess") if cs.cin == co) == 
-                sum(vars["Pout"][cs,y,t] for cs in get_set("conversion_subprocess") if cs.cout == co)
+                gp.quicksum(vars["Pin"][cs,y,t] for cs in cs_in[co]) == 
+                gp.quicksum(vars["Pout"][cs,y,t] for cs in cs_out[co])
                 for t in get_set("time")
                 for y in get_set("year")
                 for co in nondummy_commodities
@@ -155,14 +178,17 @@ class Model():
             name = "co2_emission_limit"
         )
         
-        # Power Output Constraints
+        # Power Output Constraints, subprocesses without Pin (Dummy input, see input_cs) only
+        # need the row for an efficiency of zero, which forces Pout to zero
+        input_cs = set(get_set("input_cs"))
         constrs["efficiency"] = model.addConstrs(
             (
-                vars["Pout"][cs,y,t] == vars["Pin"][cs,y,t] * get_row("efficiency",cs)
+                vars["Pout"][cs,y,t] == (vars["Pin"][cs,y,t] * get_row("efficiency",cs) if cs in input_cs else 0)
                 for y in get_set("year")
                 for t in get_set("time")
                 for cs in get_set("conversion_subprocess")
                 if cs not in get_set("storage_cs")
+                and (cs in input_cs or get_row("efficiency",cs) == 0)
             ),
             name = "efficiency_eq"
         )
@@ -196,7 +222,7 @@ class Model():
         # Power Energy Constraints
         constrs["eouttime"] = model.addConstrs(
             (
-                vars["Eouttime"][cs,y,t] == vars["Pout"][cs,y,t] * get_row("dt") * get_row("w") 
+                vars["Eouttime"][cs,y,t] == vars["Pout"][cs,y,t] * get_row("dt",t) * get_row("w",t) 
                 for y in get_set("year")
                 for t in get_set("time")
                 for cs in get_set("conversion_subprocess")
@@ -206,10 +232,10 @@ class Model():
         
         constrs["eintime"] = model.addConstrs(
             (
-                vars["Eintime"][cs,y,t] == vars["Pin"][cs,y,t] * get_row("dt") * get_row("w")
+                vars["Eintime"][cs,y,t] == vars["Pin"][cs,y,t] * get_row("dt",t) * get_row("w",t)
                 for y in get_set("year")
                 for t in get_set("time")
-                for cs in get_set("conversion_subprocess")
+                for cs in get_set("input_cs")
             ),
             name = "eintime"
         )
@@ -303,7 +329,7 @@ class Model():
             (
                 vars["Eintot"][cs,y] == sum(vars["Eintime"][cs,y,t] for t in get_set("time"))
                 for y in get_set("year")
-                for cs in get_set("conversion_subprocess")
+                for cs in get_set("input_cs")
             ),
             name = "energy_power_in"
         )
@@ -331,19 +357,19 @@ class Model():
         )
         constrs["net_to_gen"] = model.addConstrs(
             (
-                vars["Enetgen"][co,y,t] == sum(vars["Eouttime"][cs,y,t] for cs in get_set("conversion_subprocess") if cs.cout == co)
+                vars["Enetgen"][co,y,t] == gp.quicksum(vars["Eouttime"][cs,y,t] for cs in cs_out[co])
                 for y in get_set("year")
                 for t in get_set("time")
-                for co in get_set("commodity")
+                for co in get_set("net_commodity")
             ),
             name = "net_to_gen"
         )
         constrs["net_to_con"] = model.addConstrs(
             (
-                vars["Enetcons"][co,y,t] == sum(vars["Eintime"][cs,y,t] for cs in get_set("conversion_subprocess") if cs.cin == co)
+                vars["Enetcons"][co,y,t] == gp.quicksum(vars["Eintime"].get((cs,y,t), 0) for cs in cs_in[co])
                 for y in get_set("year")
                 for t in get_set("time")
-                for co in get_set("commodity")
+                for co in get_set("net_commodity")
             ),
             name = "net_to_con"
         )
@@ -371,8 +397,8 @@ class Model():
         constrs["energy_balance"] = model.addConstrs(
             (
                 vars["E_storage_level"][cs,y,t] == vars["E_storage_level"][cs,y,get_set("time")[get_set("time").index(t)-1]]  
-                + vars["Pin"][cs,y,t] * get_row("dt") * get_row("efficiency_charge",cs) 
-                - vars["Pout"][cs,y,t] * get_row("dt") / get_row("efficiency",cs) 
+                + vars["Pin"][cs,y,t] * get_row("dt",t) * get_row("efficiency_charge",cs) 
+                - vars["Pout"][cs,y,t] * get_row("dt",t) / get_row("efficiency",cs) 
                 for y in get_set("year")
                 for t in get_set("time")
                 for cs in get_set("storage_cs")
@@ -392,88 +418,149 @@ class Model():
         model.setObjective(vars["TOTEX"]+ 0, GRB.MINIMIZE)
 
     def solve(self) -> None:
-        self.model.Params.Crossover = 0
-        self.model.Params.Method = 2 # Barrier https://www.gurobi.com/documentation/current/refman/method.html 
-        self.model.Params.BarConvTol = 1e-6
-        #self.model.setParam(GRB.Param.BarConvTol, 1e-7)
-        return self.model.optimize()
+        return self.backend.solve()
     
-    def save_output(self) -> None:
-        vars = self.vars # alias for readability
+    def warm_start(self, db_path) -> int:
+        """
+        Uses the solution saved in the run database db_path as start values.
+        Returns the number of seeded variables, variables of subprocesses,
+        commodities, years or time steps unknown to the previous run are not seeded.
+        """
+        sets = {index: self.dao.get_set(set_name) for index, set_name in Set_Names.items()}
+        sets["Y"] = self._years()
+        starts = read_start_values(db_path, sets)
+        return sum(self._set_start(name, values) for name, values in starts.items())
+
+    def _positions(self, name: str) -> tuple:
+        """Positions of the created variables of a family in the array shaped like its index sets"""
+        sets = [self.dao.get_set(s) for s in _Var_Sets[name]]
+        keys = list(self.vars[name].keys())
+        if len(sets) == 1:
+            keys = [(key,) for key in keys]
+        positions = tuple(
+            np.array([index[key[axis]] for key in keys], dtype=int)
+            for axis, index in enumerate({x: i for i, x in enumerate(s)} for s in sets)
+        )
+        return positions, [len(s) for s in sets]
+
+    def _set_start(self, name: str, values: np.ndarray) -> int:
+        var = self.vars[name]
+        if isinstance(var, gp.Var):
+            vars_list, values = [var], values.ravel()
+        else:
+            vars_list, values = list(var.values()), values[self._positions(name)[0]]
+        seeded = ~np.isnan(values)
+        self.model.setAttr("PStart", [v for v, s in zip(vars_list, seeded) if s], values[seeded].tolist())
+        self.backend.warm_start = True
+        return int(seeded.sum())
+
+    def _get_values(self, name: str) -> np.ndarray:
+        """Solution values of a variable family as an array shaped like its index sets, zero where no variable is created"""
+        var = self.vars[name]
+        if isinstance(var, gp.Var):
+            return np.array(var.X)
+        positions, shape = self._positions(name)
+        values = np.zeros(shape)
+        values[positions] = self.model.getAttr("X", list(var.values()))
+        return values
+
+    def _insert_nonzero(self, table: str, id_columns: list, ids: list, columns: list, values: list) -> None:
+        """
+        Bulk inserts one row per index combination where any of the values is nonzero.
+        ids holds the database ids along each axis of the value arrays.
+        """
+        values = np.stack(values, axis=-1)
+        nonzero = (values != 0).any(axis=-1)
+        positions = np.nonzero(nonzero)
+        rows = zip(
+            *(np.asarray(axis_ids)[pos].tolist() for axis_ids, pos in zip(ids, positions)),
+            *values[nonzero].T.tolist()
+        )
+        all_columns = id_columns + columns
+        query = f"INSERT INTO {table} ({', '.join(all_columns)}) VALUES ({', '.join('?' * len(all_columns))});"
+        self.cursor.executemany(query, rows)
+
+    def _years(self) -> list:
+        """Years of the model"""
+        return self.dao.get_set("year")
+
+    def _fill_not_created(self, get_values) -> None:
+        """
+        Sets the saved values of the variables that are not created to the ones
+        they have in the full formulation: Pin = Pout/efficiency and Eintime,
+        Eintot of the subprocesses with the Dummy input, Enetgen and Enetcons of
+        Dummy as the sums over its subprocesses. get_values returns the arrays
+        of the solution that save_output writes, they are changed in place.
+        """
         get_set = self.dao.get_set # alias for readability
+        css, cos = get_set("conversion_subprocess"), get_set("commodity")
+        input_cs, net_commodity = set(get_set("input_cs")), set(get_set("net_commodity"))
+        no_pin = np.array([cs not in input_cs for cs in css], dtype=bool)
+        if no_pin.any():
+            efficiency = self.dao.get_array("efficiency")[no_pin]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                pin = np.where(efficiency[:, None, None] > 0, get_values("Pout")[no_pin] / efficiency[:, None, None], 0)
+            get_values("Pin")[no_pin] = pin
+            get_values("Eintime")[no_pin] = pin * (self.dao.get_array("dt") * self.dao.get_array("w"))[None, None, :]
+            get_values("Eintot")[no_pin] = get_values("Eintime")[no_pin].sum(axis=2)
+        for i, co in enumerate(cos):
+            if co not in net_commodity:
+                get_values("Enetgen")[i] = get_values("Eouttime")[[cs.cout == co for cs in css]].sum(axis=0)
+                get_values("Enetcons")[i] = get_values("Eintime")[[cs.cin == co for cs in css]].sum(axis=0)
+
+    def save_output(self, years: list = None) -> None:
+        """
+        Writes the solution to the output tables. years restricts the saved years
+        to a subset of the model years, the costs of output_global are then not
+        saved (see core.myopic).
+        """
+        get_set_ids = self.dao.get_set_ids # alias for readability
         cursor = self.cursor # alias for readability
+        cs_ids, co_ids = get_set_ids("conversion_subprocess"), get_set_ids("commodity")
+        t_ids = get_set_ids("time")
+        year_ids = dict(zip(self.dao.get_set("year"), get_set_ids("year")))
+        model_years = self._years()
+        y_ids = [year_ids[y] for y in (model_years if years is None else years)]
+        keep = None if years is None else [model_years.index(y) for y in years]
+
+        values = {}
+        def get_values(name):
+            if name not in values:
+                values[name] = self._get_values(name)
+                if keep is not None:
+                    values[name] = np.take(values[name], keep, axis=_Var_Sets[name].index("year"))
+            return values[name]
+
+        self._fill_not_created(get_values)
         # Y
-        for y in get_set("year"):
-            query = f"""
-            INSERT INTO output_y (y_id, total_annual_co2_emission)
-            SELECT y.id, {vars['Total_annual_co2_emission'][y].X}
-            FROM year AS y 
-            WHERE y.value = {y};
-            """
-            cursor.execute(query)
+        cursor.executemany(
+            "INSERT INTO output_y (y_id, total_annual_co2_emission) VALUES (?, ?);",
+            zip(y_ids, get_values("Total_annual_co2_emission").tolist())
+        )
         # CS,Y
-        for cs in get_set("conversion_subprocess"):
-            for y in get_set("year"):
-                cap_new = vars['Cap_new'][cs,y].X
-                cap_active = vars['Cap_active'][cs,y].X
-                cap_res = vars['Cap_res'][cs,y].X
-                eouttot = vars['Eouttot'][cs,y].X
-                eintot = vars['Eintot'][cs,y].X
-                e_storage_level_max =  vars['E_storage_level_max'][cs,y].X
-                dis_salvage_value = vars['DiscountedSalvageValue'][cs,y].X
-                if any(item != 0 for item in (cap_new, cap_active, cap_res, eouttot, eintot, e_storage_level_max, dis_salvage_value)):
-                    query = f"""
-                    INSERT INTO output_cs_y (cs_id, y_id, cap_new, cap_active, cap_res, eouttot, eintot, e_storage_level_max, dis_salvage_value)  
-                    SELECT cs.id, y.id, {cap_new}, {cap_active}, {cap_res}, {eouttot}, {eintot}, {e_storage_level_max}, {dis_salvage_value}
-                    FROM conversion_subprocess AS cs
-                    JOIN conversion_process AS cp ON cs.cp_id = cp.id
-                    JOIN commodity AS cin ON cs.cin_id = cin.id
-                    JOIN commodity AS cout ON cs.cout_id = cout.id
-                    CROSS JOIN year AS y
-                    WHERE cp.name = '{cs.cp}' AND cin.name = '{cs.cin}' AND cout.name = '{cs.cout}' AND y.value = {y};
-                    """
-                    cursor.execute(query)
+        self._insert_nonzero(
+            "output_cs_y", ["cs_id", "y_id"], [cs_ids, y_ids],
+            ["cap_new", "cap_active", "cap_res", "eouttot", "eintot", "e_storage_level_max", "dis_salvage_value"],
+            [get_values(name) for name in ("Cap_new", "Cap_active", "Cap_res", "Eouttot", "Eintot", "E_storage_level_max", "DiscountedSalvageValue")]
+        )
         # CS,Y,T
-        for cs in get_set("conversion_subprocess"):
-            for y in get_set("year"):
-                for t in get_set("time"):
-                    eouttime = vars["Eouttime"][cs,y,t].X
-                    eintime = vars["Eintime"][cs,y,t].X
-                    pin = vars["Pin"][cs,y,t].X
-                    pout = vars["Pout"][cs,y,t].X
-                    e_storage_level = vars["E_storage_level"][cs,y,t].X
-                    if any(item != 0 for item in (eouttime, eintime, pin, pout, e_storage_level)):
-                        query = f"""
-                        INSERT INTO output_cs_y_t (cs_id, y_id, t_id, eouttime, eintime, pin, pout, e_storage_level)
-                        SELECT cs.id, y.id, t.id, {vars['Eouttime'][cs,y,t].X}, {vars['Eintime'][cs,y,t].X}, {vars['Pin'][cs,y,t].X}, {vars['Pout'][cs,y,t].X}, {vars['E_storage_level'][cs,y,t].X}
-                        FROM conversion_subprocess AS cs
-                        JOIN conversion_process AS cp ON cs.cp_id = cp.id
-                        JOIN commodity AS cin ON cs.cin_id = cin.id
-                        JOIN commodity AS cout ON cs.cout_id = cout.id
-                        CROSS JOIN year AS y
-                        CROSS JOIN time_step AS t
-                        WHERE cp.name = '{cs.cp}' AND cin.name = '{cs.cin}' AND cout.name = '{cs.cout}' AND y.value = {y} AND t.value = {t};
-                        """
-                        cursor.execute(query)
+        self._insert_nonzero(
+            "output_cs_y_t", ["cs_id", "y_id", "t_id"], [cs_ids, y_ids, t_ids],
+            ["eouttime", "eintime", "pin", "pout", "e_storage_level"],
+            [get_values(name) for name in ("Eouttime", "Eintime", "Pin", "Pout", "E_storage_level")]
+        )
         # CO,Y,T
-        for co in get_set("commodity"):
-            for y in get_set("year"):
-                for t in get_set("time"):
-                    enetgen = vars["Enetgen"][co,y,t].X
-                    enetcons = vars["Enetcons"][co,y,t].X
-                    if any(item != 0 for item in (enetgen, enetcons)):
-                        query = f"""
-                        INSERT INTO output_co_y_t (co_id, y_id, t_id, enetgen, enetcons)
-                        SELECT co.id, y.id, t.id, {enetgen}, {enetcons}
-                        FROM commodity AS co
-                        CROSS JOIN year AS y
-                        CROSS JOIN time_step AS t
-                        WHERE co.name = '{co}' AND y.value = {y} AND t.value = {t};
-                        """
-                        cursor.execute(query)
+        self._insert_nonzero(
+            "output_co_y_t", ["co_id", "y_id", "t_id"], [co_ids, y_ids, t_ids],
+            ["enetgen", "enetcons"],
+            [get_values(name) for name in ("Enetgen", "Enetcons")]
+        )
         # without index
-        query = f"""INSERT INTO output_global (OPEX, CAPEX, TOTEX) VALUES ({vars['OPEX'].X}, {vars['CAPEX'].X}, {vars['TOTEX'].X})"""
-        cursor.execute(query)
+        if years is None:
+            cursor.execute(
+                "INSERT INTO output_global (OPEX, CAPEX, TOTEX) VALUES (?, ?, ?);",
+                (get_values("OPEX").item(), get_values("CAPEX").item(), get_values("TOTEX").item())
+            )
         self.conn.commit()
 
 
@@ -0,0 +1,100 @@
+"""
+Myopic (rolling horizon) Investment Mode
+
+Instead of one LP over all years of the scenario, the years are solved one
+window at a time. A window holds the current year and the following
+foresight - 1 years; only the results of its first year are kept. Cap_new of
+the kept years is fixed and carried into the later windows, where it counts
+towards Cap_active within its technical lifetime. Only the current window is
+held in memory, so the peak memory depends on the window size rather than on
+the number of years.
+
+The costs saved in output_global are evaluated over all years with the same
+formulas as the perfect foresight model.
+"""
+
+import time
+import numpy as np
+from sqlite3 import Connection
+from core.data_access import DAO
+from core.matrix_model import MatrixModel
+
+
+class MyopicModel():
+    def __init__(self, conn: Connection, solver: str = "gurobi", threads: int = None, foresight: int = 1, compact: bool = False) -> None:
+        if foresight < 1:
+            raise ValueError("The foresight of the myopic mode must be at least one year")
+        self.conn = conn
+        self.dao = DAO(conn)
+        self.solver = solver
+        self.threads = threads
+        self.foresight = foresight
+        self.compact = compact
+        self.years = self.dao.get_set("year")
+        self.stats = {"windows": [], "status": None, "iterations": 0, "build_time": 0, "solve_time": 0}
+        # results of the kept years: year -> values per subprocess
+        self.cap_new = {}
+        self._kept = {}
+
+    def windows(self) -> list:
+        return [self.years[i:i + self.foresight] for i in range(len(self.years))]
+
+    def solve_and_save(self, callback=None) -> None:
+        """Solves the windows in order and saves the first year of each into the output tables"""
+        for window in self.windows():
+            st = time.time()
+            model = MatrixModel(self.conn, solver=self.solver, threads=self.threads, years=window, cap_new_before=self.cap_new, compact=self.compact)
+            build_time = time.time() - st
+            model.solve()
+            stats = model.backend.stats
+            self.stats["windows"].append({"years": window, "build_time": build_time, **stats})
+            self.stats["build_time"] += build_time
+            self.stats["solve_time"] += stats["solve_time"]
+            self.stats["iterations"] += stats["iterations"]
+            self.stats["status"] = stats["status"]
+
+            year = window[0]
+            model.save_output(years=[year])
+            self.cap_new[year] = model._get_values("Cap_new")[:, 0].copy()
+            self._kept[year] = {
+                name: model._get_values(name)[..., 0].copy()
+                for name in ("Cap_active", "Eouttot", "Total_annual_co2_emission")
+            }
+            if callback is not None:
+                callback(window, stats)
+            del model
+        self._save_costs()
+
+    def _save_costs(self) -> None:
+        """CAPEX, OPEX and salvage values of the kept decisions over all years"""
+        get_array = self.dao.get_array
+        years = np.array(self.years)
+        last_year = years[-1]
+        discount = np.array([self.dao.get_discount_factor(y) for y in self.years])
+        year_gap = np.append(np.diff(years), 1)
+        lifetime = get_array("technical_lifetime")
+        stack = lambda name: np.stack([self._kept[y][name] for y in self.years], axis=-1)
+        cap_new = np.stack([self.cap_new[y] for y in self.years], axis=1)
+
+        salvage = self.dao.get_salvage_mask(self.years)
+        salvage_factor = get_array("capex_cost_power") * (1 - (last_year - years + 1)[None, :] / lifetime[:, None]) * self.dao.get_discount_factor(last_year)
+        dis_salvage_value = np.where(salvage, salvage_factor * cap_new, 0)
+        capex = (discount * get_array("capex_cost_power") * cap_new).sum() - dis_salvage_value.sum()
+        opex = (
+            (get_array("opex_cost_power") * year_gap * discount * stack("Cap_active")).sum()
+            + (get_array("opex_cost_energy") * year_gap * discount * stack("Eouttot")).sum()
+            + (get_array("co2_price") * year_gap * discount * stack("Total_annual_co2_emission")).sum()
+        )
+
+        cs_ids, y_ids = self.dao.get_set_ids("conversion_subprocess"), self.dao.get_set_ids("year")
+        rows = np.nonzero(dis_salvage_value)
+        self.conn.execute("UPDATE output_cs_y SET dis_salvage_value = 0;") # the windows saved their own salvage values
+        self.conn.executemany(
+            "UPDATE output_cs_y SET dis_salvage_value = ? WHERE cs_id = ? AND y_id = ?;",
+            zip(dis_salvage_value[rows].tolist(), np.asarray(cs_ids)[rows[0]].tolist(), np.asarray(y_ids)[rows[1]].tolist())
+        )
+        self.conn.execute(
+            "INSERT INTO output_global (OPEX, CAPEX, TOTEX) VALUES (?, ?, ?);",
+            (float(opex), float(capex), float(opex + capex))
+        )
+        self.conn.commit()
@@ -0,0 +1,99 @@
+"""
+Array Layout of the Time Series Outputs
+
+Stores output_cs_y_t and output_co_y_t with one row per (cs, y) or (co, y)
+that holds, per variable, a BLOB with the values of all time steps (float64 or
+float32, in the order of the time set). Time steps without a row in the long
+layout are NaN. The long tables are replaced by views of the same name, which
+decode the BLOBs with the SQL function array_value. The DAO registers it on its
+connection; other SQLite clients have to define it to read the views.
+"""
+
+import sqlite3
+import struct
+import numpy as np
+
+# long table -> array table, id column of its first index
+Array_Tables = {
+    "output_cs_y_t": ("output_cs_y_t_array", "cs_id"),
+    "output_co_y_t": ("output_co_y_t_array", "co_id"),
+}
+Dtypes = {"float64": "<f8", "float32": "<f4"}
+
+
+def array_value(blob: bytes, k: int, n: int) -> float:
+    """Value at position k of a BLOB of n time steps, None for NaN"""
+    if blob is None:
+        return None
+    itemsize = len(blob) // n
+    value = struct.unpack_from("<d" if itemsize == 8 else "<f", blob, k * itemsize)[0]
+    return None if value != value else value
+
+
+def register_functions(conn: sqlite3.Connection) -> None:
+    conn.create_function("array_value", 3, array_value, deterministic=True)
+
+
+def decode(blobs: list, n: int) -> np.ndarray:
+    """BLOBs of n time steps as an array of shape (len(blobs), n)"""
+    if not blobs:
+        return np.empty((0, n))
+    dtype = "<f8" if len(blobs[0]) == 8 * n else "<f4"
+    return np.frombuffer(b"".join(blobs), dtype=dtype).reshape(len(blobs), n)
+
+
+def is_array_layout(conn: sqlite3.Connection, table: str) -> bool:
+    """Whether the long table is a view of its array table"""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?;", (table,)).fetchone()
+    return row is not None and row[0] == "view"
+
+
+def to_array_layout(conn: sqlite3.Connection, dtype: str = "float64") -> None:
+    """
+    Moves the rows of the long time series output tables into their array
+    tables and replaces them by views. Tables already in the array layout are
+    skipped. The database is vacuumed, so that a backup of it is compact.
+    """
+    time_ids = [i for (i,) in conn.execute("SELECT id FROM time_step ORDER BY value;")]
+    n = len(time_ids)
+    position = np.zeros(max(time_ids, default=0) + 1, dtype=np.int64)
+    position[time_ids] = np.arange(n)
+
+    for table, (array_table, id_column) in Array_Tables.items():
+        if is_array_layout(conn, table):
+            continue
+        columns = [c[1] for c in conn.execute(f"PRAGMA table_info({table});") if c[1] not in ("id", id_column, "y_id", "t_id")]
+        rows = np.array(
+            conn.execute(f"SELECT {id_column}, y_id, t_id, {', '.join(columns)} FROM {table};").fetchall(), dtype=float
+        ).reshape(-1, 3 + len(columns))
+        pairs, inverse = np.unique(rows[:, :2].astype(np.int64), axis=0, return_inverse=True)
+        values = np.full((len(columns), len(pairs), n), np.nan, dtype=Dtypes[dtype])
+        values[:, inverse.ravel(), position[rows[:, 2].astype(np.int64)]] = rows[:, 3:].T
+
+        conn.execute(f"DROP TABLE {table};")
+        conn.execute(f"""
+            CREATE TABLE {array_table} (
+                id INTEGER PRIMARY KEY,
+                {id_column} INTEGER,
+                y_id INTEGER,
+                {', '.join(f'{column} BLOB' for column in columns)},
+                CONSTRAINT {array_table}_unique UNIQUE ({id_column}, y_id)
+            );
+        """)
+        conn.executemany(
+            f"INSERT INTO {array_table} ({id_column}, y_id, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 2))});",
+            ((*pair, *(values[c, i].tobytes() for c in range(len(columns)))) for i, pair in enumerate(pairs.tolist()))
+        )
+        # the long rows: every time step of an array row where any of the variables has a value
+        conn.execute(f"""
+            CREATE VIEW {table} AS
+            SELECT * FROM (
+                SELECT (a.id - 1) * {n} + t.k + 1 AS id, a.{id_column}, a.y_id, t.id AS t_id,
+                    {', '.join(f'array_value(a.{column}, t.k, {n}) AS {column}' for column in columns)}
+                FROM {array_table} AS a
+                CROSS JOIN (SELECT id, ROW_NUMBER() OVER (ORDER BY value) - 1 AS k FROM time_step) AS t
+            )
+            WHERE {' OR '.join(f'{column} IS NOT NULL' for column in columns)};
+        """)
+    conn.commit()
+    conn.execute("VACUUM;")
@@ -0,0 +1,135 @@
+"""
+Dense in-memory store for the input parameters
+
+Every parameter of Param_Index_Dict is loaded once into a NumPy array whose
+axes follow the index sets (CS, Y, T) in the order of DAO.get_set. Entries that
+are missing in the database are filled with the value of Param_Default_Dict.
+"""
+
+import numpy as np
+from core.params import Param_Index_Dict, Param_Default_Dict, Set_Names
+
+# index letter -> (set name, id column)
+_Index_Sets = {index: (Set_Names[index], f"{index.lower()}_id") for index in ("CS", "Y", "T")}
+
+
+class ParamStore():
+    def __init__(self, dao) -> None:
+        self.dao = dao
+        self._arrays = {}
+        self._masks = {}
+        self._positions = {}
+        self._id_positions = {}
+
+    def position(self, index: str) -> dict:
+        """Mapping from set element (CS, year value or time value) to its position"""
+        if index not in self._positions:
+            set_name = _Index_Sets[index][0]
+            self._positions[index] = {x: i for i, x in enumerate(self.dao.get_set(set_name))}
+        return self._positions[index]
+
+    def _id_position(self, index: str) -> dict:
+        """Mapping from database id to position"""
+        if index not in self._id_positions:
+            set_name = _Index_Sets[index][0]
+            self._id_positions[index] = {x: i for i, x in enumerate(self.dao.get_set_ids(set_name))}
+        return self._id_positions[index]
+
+    def shape(self, name: str) -> tuple:
+        return tuple(len(self.position(index)) for index in Param_Index_Dict[name])
+
+    def _dtype(self, table: str, name: str):
+        default = Param_Default_Dict.get(name)
+        for _, column, decl_type, *_ in self.dao.cursor.execute(f"PRAGMA table_info({table})"):
+            if column == name and "INT" in decl_type.upper() and default is not None:
+                return np.int64
+        return np.float64
+
+    def _load(self, name: str) -> None:
+        indexes = Param_Index_Dict[name]
+        table = "param_" + ("_".join(index.lower() for index in indexes) if indexes else "global")
+        default = Param_Default_Dict.get(name)
+        dtype = self._dtype(table, name)
+        shape = self.shape(name)
+
+        values = np.full(shape, np.nan if default is None else default, dtype=dtype)
+        mask = np.zeros(shape, dtype=bool)
+        id_columns = [_Index_Sets[index][1] for index in indexes]
+        query = f"SELECT {', '.join(id_columns + [name])} FROM {table} WHERE {name} IS NOT NULL;"
+        rows = self.dao.cursor.execute(query).fetchall()
+        if indexes:
+            id_positions = [self._id_position(index) for index in indexes]
+            for row in rows:
+                pos = tuple(id_pos[i] for id_pos, i in zip(id_positions, row[:-1]))
+                values[pos] = row[-1]
+                mask[pos] = True
+        elif rows:
+            values[()] = rows[0][0]
+            mask[()] = True
+        self._arrays[name] = values
+        self._masks[name] = mask
+
+    def get_array(self, name: str) -> np.ndarray:
+        """Dense array of the parameter with defaults filled in"""
+        if name not in self._arrays:
+            self._load(name)
+        return self._arrays[name]
+
+    def get_mask(self, name: str) -> np.ndarray:
+        """Boolean array marking the entries given explicitly in the database"""
+        if name not in self._masks:
+            self._load(name)
+        return self._masks[name]
+
+    def get_value(self, name: str, *indices):
+        pos = tuple(self.position(index)[x] for index, x in zip(Param_Index_Dict[name], indices))
+        if not self.get_mask(name)[pos]:
+            return Param_Default_Dict.get(name)
+        return self.get_array(name)[pos].item()
+
+    def set_value(self, name: str, value, *indices) -> None:
+        """Writes one entry of a parameter to the database, None removes it (the default applies)"""
+        indexes = Param_Index_Dict[name]
+        cursor = self.dao.cursor
+        if not indexes:
+            cursor.execute(f"UPDATE param_global SET {name} = ? WHERE constant_column = 1;", (value,))
+        else:
+            table = "param_" + "_".join(index.lower() for index in indexes)
+            id_columns = [_Index_Sets[index][1] for index in indexes]
+            ids = [
+                self.dao.get_set_ids(_Index_Sets[index][0])[self.position(index)[x]]
+                for index, x in zip(indexes, indices)
+            ]
+            cursor.execute(
+                f"""
+                INSERT INTO {table} ({', '.join(id_columns + [name])}) VALUES ({', '.join('?' * (len(ids) + 1))})
+                ON CONFLICT ({', '.join(id_columns)}) DO UPDATE SET {name} = excluded.{name};
+                """,
+                (*ids, value)
+            )
+        self.dao.conn.commit()
+        self.invalidate(name)
+
+    def iter_row(self, name: str) -> list:
+        indexes = Param_Index_Dict[name]
+        values = self.get_array(name)
+        mask = self.get_mask(name)
+        if not indexes:
+            return [values.item() if mask else None]
+        elements = [list(self.position(index)) for index in indexes]
+        positions = np.nonzero(mask)
+        return [
+            (*(elements[k][i] for k, i in enumerate(pos)), value)
+            for *pos, value in zip(*(p.tolist() for p in positions), values[positions].tolist())
+        ]
+
+    def invalidate(self, name: str = None) -> None:
+        """Drop cached arrays so that they are reloaded from the database"""
+        if name is None:
+            self._arrays.clear()
+            self._masks.clear()
+            self._positions.clear()
+            self._id_positions.clear()
+        else:
+            self._arrays.pop(name, None)
+            self._masks.pop(name, None)
@@ -1,6 +1,6 @@
 Param_Index_Dict = {
-    "dt": [],
-    "w": [],
+    "dt": ["T"],
+    "w": ["T"],
     "discount_rate": [],
     "annual_co2_limit": ["Y"],
     "co2_price": ["Y"],
@@ -55,6 +55,9 @@ Param_Default_Dict = {
     "efficiency_charge": 1
 }
 
+# index letter -> name of its set in DAO.get_set
+Set_Names = {"CS": "conversion_subprocess", "CO": "commodity", "Y": "year", "T": "time"}
+
 Output_Index_Dict = {
     "Total_annual_co2_emission": ["Y"],
     "Cap_new": ["CS", "Y"],
@@ -0,0 +1,230 @@
+"""
+Parse and Build Cache
+
+Keeps the parameter database of parsed scenarios, so that a run of an
+unchanged scenario restores it instead of reading the techmap and the time
+series again. An entry is keyed by a hash of the techmap bytes, the scenario
+name, the aggregation and the parser code. It also records the content hash of
+every time series file read during the parse (and whether a weights file
+exists), which are checked on each hit; any change invalidates the entry.
+
+The built LP of the matrix builder can be cached as well (see
+MatrixModel.save_build). Its key combines the fingerprint of the parsed inputs
+with the build options and the builder code.
+
+Each cache directory is bounded in size, the least recently used entries are
+removed first. The scenario names of each techmap are cached as well.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+from core.input_parser import Parser
+from core.matrix_model import MatrixModel
+
+# code that determines the content of the parsed database and of the built LP
+_Code_Files = ("init_queries.sql", "input_parser.py", "aggregation.py", "clustering.py", "timeseries.py", "params.py")
+_Build_Code_Files = ("model.py", "matrix_model.py", "data_access.py", "param_store.py", "pruning.py")
+Max_Bytes = 2**30
+
+
+def _hash_parts(parts: list) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode() + b"\0")
+    return digest.hexdigest()
+
+
+def _hash_code(names: tuple) -> list:
+    code_dir = Path(__file__).parent
+    return [_hash_file(code_dir.joinpath(name)) for name in names]
+
+
+def _hash_file(path: Path) -> str:
+    """sha256 of the file content, None if it does not exist"""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(2**20), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+class _RecordingLoader():
+    """Time series loader that records the files it reads"""
+
+    def __init__(self, loader) -> None:
+        self._loader = loader
+        self.paths = set()
+
+    def load(self, path: Path):
+        self.paths.add(Path(path).resolve())
+        return self._loader.load(path)
+
+
+class _Cache():
+    """Directory of entries <key>.json (metadata) and <key><suffix> (data), bounded in size"""
+    _suffix = None
+
+    def __init__(self, cache_dir: Path, max_bytes: int = Max_Bytes) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def _paths(self, key: str) -> tuple:
+        return self.cache_dir.joinpath(f"{key}{self._suffix}"), self.cache_dir.joinpath(f"{key}.json")
+
+    def _write_meta(self, meta_path: Path, meta: dict) -> None:
+        tmp_meta_path = meta_path.with_name(f"{meta_path.stem}.{os.getpid()}.tmp")
+        with open(tmp_meta_path, "w") as file:
+            json.dump(meta, file, indent=2)
+        os.replace(tmp_meta_path, meta_path)
+
+    def evict(self) -> int:
+        """Removes the least recently used entries until the cache fits into max_bytes, returns the number removed"""
+        entries = []
+        for meta_path in self.cache_dir.glob("*.json"):
+            data_path = meta_path.with_suffix(self._suffix)
+            if data_path.exists():
+                entries.append((meta_path.stat().st_mtime, meta_path, data_path, data_path.stat().st_size + meta_path.stat().st_size))
+        total = sum(entry[3] for entry in entries)
+        removed = 0
+        for _, meta_path, data_path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            meta_path.unlink(missing_ok=True)
+            data_path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+
+class ParseCache(_Cache):
+    _suffix = ".sqlite"
+
+    def __init__(self, cache_dir: Path, max_bytes: int = Max_Bytes) -> None:
+        super().__init__(cache_dir, max_bytes)
+        # hash of all inputs of the last parse, the key of its built models (see BuildCache)
+        self.fingerprint = None
+
+    def _key(self, parser: Parser) -> str:
+        return _hash_parts([_hash_file(parser.techmap_path), parser.scenario, parser.aggregation] + _hash_code(_Code_Files))
+
+    def parse(self, parser: Parser) -> bool:
+        """
+        Fills the database of the parser, from the cache if there is a valid
+        entry, otherwise by parsing and then storing the result.
+        Returns True on a cache hit.
+        """
+        key = self._key(parser)
+        db_path, meta_path = self._paths(key)
+        files = self._valid_files(db_path, meta_path)
+        if files is not None:
+            self.fingerprint = _hash_parts([key] + sorted(files.items()))
+            cached_conn = sqlite3.connect(db_path)
+            cached_conn.backup(parser.conn)
+            cached_conn.close()
+            os.utime(meta_path) # marks the entry as recently used
+            return True
+
+        loader = parser.ts_loader
+        parser.ts_loader = _RecordingLoader(loader)
+        try:
+            parser.parse()
+        finally:
+            paths, parser.ts_loader = parser.ts_loader.paths, loader
+        tss_name = parser.conn.execute("SELECT tss_name FROM param_global").fetchone()[0]
+        paths.add(parser.ts_dir_path.joinpath(f"{tss_name}_weights.txt").resolve())
+        files = {str(path): _hash_file(path) for path in sorted(paths)}
+        self.fingerprint = _hash_parts([key] + sorted(files.items()))
+        meta = {"techmap": str(parser.techmap_path), "scenario": parser.scenario, "aggregation": parser.aggregation, "files": files}
+        self._store(parser.conn, db_path, meta_path, meta)
+        return False
+
+    @staticmethod
+    def _valid_files(db_path: Path, meta_path: Path) -> dict:
+        """Time series files of a valid entry with their hashes, None if the entry is missing or outdated"""
+        if not (db_path.exists() and meta_path.exists()):
+            return None
+        try:
+            with open(meta_path) as file:
+                files = json.load(file)["files"]
+        except (OSError, ValueError, KeyError):
+            return None
+        return files if all(_hash_file(Path(path)) == digest for path, digest in files.items()) else None
+
+    def _store(self, conn: sqlite3.Connection, db_path: Path, meta_path: Path, meta: dict) -> None:
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # written under temporary names first, so that parallel runs never read a partial entry
+            tmp_db_path = db_path.with_name(f"{db_path.stem}.{os.getpid()}.tmp")
+            tmp_db_path.unlink(missing_ok=True)
+            cached_conn = sqlite3.connect(tmp_db_path)
+            conn.backup(cached_conn)
+            cached_conn.close()
+            os.replace(tmp_db_path, db_path)
+            self._write_meta(meta_path, meta)
+            self.evict()
+        except OSError:
+            pass # the cache is optional, e.g. for read-only data directories
+
+    def scenarios(self, name: str, techmap_dir_path: Path) -> list:
+        """Scenario names of a techmap, as Parser.pre_check_scenarios but cached by the hash of the techmap"""
+        techmap_path = Path(techmap_dir_path).joinpath(f"{name}.xlsx")
+        digest = _hash_file(techmap_path)
+        index_path = self.cache_dir.joinpath("scenarios.index")
+        try:
+            with open(index_path) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            index = {}
+        entry = index.get(str(techmap_path.resolve()))
+        if entry is not None and entry["hash"] == digest:
+            return entry["scenarios"]
+
+        scenarios = Parser.pre_check_scenarios(name, techmap_dir_path)
+        index[str(techmap_path.resolve())] = {"hash": digest, "scenarios": scenarios}
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w") as file:
+                json.dump(index, file, indent=2)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            pass
+        return scenarios
+
+
+class BuildCache(_Cache):
+    """Built models of the matrix builder, see MatrixModel.save_build"""
+    _suffix = ".npz"
+
+    @staticmethod
+    def key(fingerprint: str, **options) -> str:
+        """Key of the model built from the parsed inputs with the given fingerprint and build options, e.g. prune or compact"""
+        return _hash_parts([fingerprint] + sorted(options.items()) + _hash_code(_Build_Code_Files))
+
+    def load(self, key: str, conn: sqlite3.Connection, solver: str = "gurobi", threads: int = None) -> MatrixModel:
+        """The cached model, None if there is no entry"""
+        npz_path, meta_path = self._paths(key)
+        if not (npz_path.exists() and meta_path.exists()):
+            return None
+        model = MatrixModel.load(conn, npz_path, solver=solver, threads=threads)
+        os.utime(meta_path)
+        return model
+
+    def store(self, key: str, model: MatrixModel, **info) -> None:
+        """Writes a model built with keep_build, info is kept in the metadata of the entry"""
+        npz_path, meta_path = self._paths(key)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_npz_path = npz_path.with_name(f"{npz_path.stem}.{os.getpid()}.tmp")
+            model.save_build(tmp_npz_path)
+            os.replace(tmp_npz_path, npz_path)
+            self._write_meta(meta_path, info)
+            self.evict()
+        except OSError:
+            pass
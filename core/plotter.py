@@ -281,7 +281,6 @@ class Plotter:
           stacks (str, optional): Colunm name of group to be used as stacks. If Let None it will have a single stack. Defaults to "cp".
 
       Raises:
-          PlotterExeption: Empty Dataframe
           PlotterExeption: Invalid type for plotting!
 
       Returns:
@@ -290,11 +289,13 @@ class Plotter:
 
       # TODO: Correct Time Series Plotting -> get rid of empty timesteps
 
-      if df.size == 0:
-         raise PlotterExeption("No results to plot!")
-
       traces = []
 
+      # zero results are not saved and some variables are not created at all, e.g. the input power of
+      # subprocesses with the Dummy input, an empty selection is plotted as zero
+      if df.size == 0:
+         return traces
+
       # Sort Stacks
       if stacks is not None:
          df.loc[:, "stacks_sorting"] = df[stacks].apply(lambda x: self._get_order(x))
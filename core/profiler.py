@@ -0,0 +1,252 @@
+"""
+Pipeline Profiler
+
+Collects the details of a run: time, memory and database queries per phase,
+build time, rows and nonzeros per variable and constraint family, and the
+statistics of the solver. The DAO and the model builders call the hooks of
+this module, which do nothing unless a phase of a Profiler is running.
+
+The profile is written as JSON next to the run database and into its table
+run_stats, one row per value, so that runs can be compared with SQL.
+"""
+
+import json
+import re
+import resource
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# profiler of the running phase
+_active = None
+# literals are replaced so that the same query with different values is counted together
+_Literals = re.compile(r"'[^']*'|\b\d+(\.\d+)?\b")
+
+
+def _read_status(field: str) -> float:
+    """Value of a memory field of /proc/self/status in MB, None where it does not exist"""
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> None:
+    """Resets the peak resident set size of the process (Linux), so that it is measured per phase"""
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss() -> float:
+    peak = _read_status("VmHWM")
+    # ru_maxrss is the peak of the whole process in KB
+    return peak if peak is not None else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Profiler():
+    def __init__(self, detailed: bool = True) -> None:
+        # without detail only the time and memory of the phases are recorded, the hooks stay off
+        self.detailed = detailed
+        self.phases = {}
+        self.variables = {}
+        self.constraints = {}
+        self.queries = {"count": 0, "time": 0.0, "statements": {}}
+        self.solver = {}
+        self._mark = None
+        self._pending = []
+
+    @contextmanager
+    def phase(self, name: str):
+        """Profiles the code of the with block as the phase name"""
+        global _active
+        _reset_peak_rss()
+        queries, query_time = self.queries["count"], self.queries["time"]
+        st = time.perf_counter()
+        self._mark = st
+        _active = self if self.detailed else None
+        try:
+            yield self
+        finally:
+            _active = None
+            for model in self._pending:
+                model.count_nonzeros()
+            self._pending.clear()
+            self.phases[name] = {
+                "time": time.perf_counter() - st,
+                "rss_mb": _read_status("VmRSS"),
+                "peak_rss_mb": _peak_rss(),
+                "queries": self.queries["count"] - queries,
+                "query_time": self.queries["time"] - query_time,
+            }
+
+    def family(self, kind: str, name: str, size: int, nonzeros: int = None) -> None:
+        """
+        Records a variable ("variables", size is the number of columns) or
+        constraint family ("constraints", size is the number of rows). Its build
+        time is the time since the previous family.
+        """
+        now = time.perf_counter()
+        if kind == "variables":
+            entry = self.variables.setdefault(name, {"count": 0, "time": 0.0, "columns": 0})
+            entry["columns"] += size
+        else:
+            entry = self.constraints.setdefault(name, {"count": 0, "time": 0.0, "rows": 0, "nonzeros": 0})
+            entry["rows"] += size
+            entry["nonzeros"] = None if nonzeros is None or entry["nonzeros"] is None else entry["nonzeros"] + nonzeros
+        # families that are built several times (e.g. one model per myopic window) are summed up
+        entry["count"] += 1
+        entry["time"] += now - self._mark
+        self._mark = now
+
+    def query(self, statement: str, seconds: float, new: bool = True) -> None:
+        if new:
+            self.queries["count"] += 1
+        self.queries["time"] += seconds
+        entry = self.queries["statements"].setdefault(statement, {"count": 0, "time": 0.0})
+        entry["count"] += new
+        entry["time"] += seconds
+
+    def to_dict(self, top_queries: int = 20) -> dict:
+        statements = sorted(self.queries["statements"].items(), key=lambda item: -item[1]["time"])[:top_queries]
+        return {
+            "phases": self.phases,
+            "variables": self.variables,
+            "constraints": self.constraints,
+            "queries": {"count": self.queries["count"], "time": self.queries["time"], "statements": dict(statements)},
+            "solver": self.solver,
+        }
+
+    def write(self, db_path: Path, info: dict = None) -> Path:
+        """Writes the profile as profile.json next to the run database db_path and into its table run_stats"""
+        profile = {**(info or {}), **self.to_dict()}
+        json_path = Path(db_path).with_name("profile.json")
+        with open(json_path, "w") as file:
+            json.dump(profile, file, indent=2, default=str)
+
+        rows = []
+        for section, entries in profile.items():
+            if not isinstance(entries, dict):
+                rows.append(("run", None, section, entries))
+                continue
+            for name, value in entries.items():
+                if section == "queries" and name == "statements":
+                    rows += [(section, statement, metric, v) for statement, metrics in value.items() for metric, v in metrics.items()]
+                elif isinstance(value, dict):
+                    rows += [(section, name, metric, v) for metric, v in value.items()]
+                elif not isinstance(value, (list, tuple)):
+                    rows.append((section, None, name, value))
+        conn = sqlite3.connect(db_path)
+        conn.execute("DELETE FROM run_stats;")
+        conn.executemany("INSERT INTO run_stats (section, name, metric, value) VALUES (?, ?, ?, ?);", rows)
+        conn.commit()
+        conn.close()
+        return json_path
+
+
+class _TimedCursor():
+    """Cursor that reports its queries and the time to execute and fetch them to the profiler"""
+
+    def __init__(self, cursor: sqlite3.Cursor, profiler: Profiler) -> None:
+        self._cursor = cursor
+        self._profiler = profiler
+        self._statement = None
+
+    def _timed(self, method, statement, *args):
+        st = time.perf_counter()
+        result = method(*args)
+        if _active is self._profiler:
+            new = statement is not None
+            self._statement = statement if new else self._statement
+            self._profiler.query(self._statement, time.perf_counter() - st, new=new)
+        return result
+
+    def execute(self, sql: str, *args):
+        self._timed(self._cursor.execute, " ".join(_Literals.sub("?", sql).split()), sql, *args)
+        return self
+
+    def executemany(self, sql: str, *args):
+        self._timed(self._cursor.executemany, " ".join(_Literals.sub("?", sql).split()), sql, *args)
+        return self
+
+    def fetchall(self) -> list:
+        return self._timed(self._cursor.fetchall, None)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone, None)
+
+    def fetchmany(self, size: int) -> list:
+        return self._timed(self._cursor.fetchmany, None, size)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _FamilyRecorder():
+    """
+    Stands in for a gurobipy model in the expression builder and records every
+    variable and constraint family added through it. The nonzeros are counted
+    at the end of the phase, after the model is updated.
+    """
+
+    def __init__(self, model, profiler: Profiler) -> None:
+        self._model = model
+        self._profiler = profiler
+        self._families = []
+        profiler._pending.append(self)
+
+    def _record(self, constrs, name: str):
+        constrs_list = [constrs] if hasattr(constrs, "index") else list(constrs.values())
+        name = name or f"unnamed_{len(self._families)}"
+        self._profiler.family("constraints", name, len(constrs_list))
+        self._families.append((name, constrs_list))
+        return constrs
+
+    def addVars(self, *indexes, name: str = "", **kwargs):
+        vars = self._model.addVars(*indexes, name=name, **kwargs)
+        self._profiler.family("variables", name, len(vars))
+        return vars
+
+    def addConstrs(self, generator, name: str = ""):
+        return self._record(self._model.addConstrs(generator, name=name), name)
+
+    def addConstr(self, constr, name: str = ""):
+        return self._record(self._model.addConstr(constr, name=name), name)
+
+    def count_nonzeros(self) -> None:
+        if not self._families:
+            return
+        self._model.update()
+        indptr = self._model.getA().tocsr().indptr
+        for name, constrs in self._families:
+            rows = [c.index for c in constrs]
+            entry = self._profiler.constraints[name]
+            entry["nonzeros"] = (entry["nonzeros"] or 0) + int(sum(indptr[i + 1] - indptr[i] for i in rows))
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+def track_cursor(cursor: sqlite3.Cursor):
+    """The cursor, timed if a profiler is running"""
+    return cursor if _active is None else _TimedCursor(cursor, _active)
+
+
+def track_families(model):
+    """The gurobipy model, recording its variable and constraint families if a profiler is running"""
+    return model if _active is None else _FamilyRecorder(model, _active)
+
+
+def record_family(kind: str, name: str, size: int, nonzeros: int = None) -> None:
+    if _active is not None:
+        _active.family(kind, name, size, nonzeros)
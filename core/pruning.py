@@ -0,0 +1,80 @@
+"""
+Pruning of Inactive Subprocesses and Commodities
+
+Runs on the parsed database before the model is built. A conversion
+subprocess is removed if it can never be active in the scenario:
+- its capacity is zero, i.e. cap_max is zero in every year and there is no
+  residual capacity, or
+- it has no flow, because no remaining subprocess produces its input or
+  consumes its output (the power balance then keeps it at zero). Removing
+  one subprocess can cut the flow of others, so this is repeated until
+  nothing changes.
+Subprocesses that are forced to be active (cap_min, cap_res_min, min_eout
+or a fraction minimum above zero) are kept, as are non-storage subprocesses
+with zero efficiency whose input is not bound by their output. The
+optimum of the LP is then the same with and without them. Commodities that no
+remaining subprocess produces or consumes are removed afterwards.
+
+Everything removed is recorded in the table pruned of the run database.
+"""
+
+import numpy as np
+from sqlite3 import Connection
+from core.data_access import DAO
+
+# tables with one row per subprocess and index
+_CS_Tables = ("param_cs", "param_cs_y", "param_cs_t")
+
+
+def prune_inactive(conn: Connection) -> dict:
+    """Removes the inactive subprocesses and unused commodities, returns the number removed of each"""
+    dao = DAO(conn)
+    css = dao.get_set("conversion_subprocess")
+    cs_ids = dao.get_set_ids("conversion_subprocess")
+    get_array = dao.get_array
+    get_mask = dao.params.get_mask
+    given = lambda name: np.where(get_mask(name), get_array(name), 0) # parameters without default count as zero
+
+    storage_cs = set(dao.get_set("storage_cs"))
+    storage = np.array([cs in storage_cs for cs in css], dtype=bool)
+    no_capacity = (get_mask("cap_max") & (get_array("cap_max") <= 0)).all(axis=1) & (given("cap_res_max") <= 0).all(axis=1)
+    forced = (
+        (given("cap_min") > 0) | (given("cap_res_min") > 0) | (given("min_eout") > 0)
+        | (given("out_frac_min") > 0) | (given("in_frac_min") > 0)
+    ).any(axis=1)
+    removable = ~forced & (storage | (get_array("efficiency") != 0))
+
+    cin = np.array([cs.cin for cs in css])
+    cout = np.array([cs.cout for cs in css])
+    reasons = {i: "no capacity" for i in np.nonzero(no_capacity & removable)[0]}
+    changed = True
+    while changed:
+        changed = False
+        active = np.ones(len(css), dtype=bool)
+        active[list(reasons)] = False
+        produced, consumed = set(cout[active]), set(cin[active])
+        for i in np.nonzero(active & removable)[0]:
+            if cin[i] != "Dummy" and cin[i] not in produced:
+                reasons[i] = f"no producer of {cin[i]}"
+            elif cout[i] != "Dummy" and cout[i] not in consumed:
+                reasons[i] = f"no consumer of {cout[i]}"
+            else:
+                continue
+            changed = True
+
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO pruned (set_name, name, cin, cout, reason) VALUES ('conversion_subprocess', ?, ?, ?, ?);",
+        [(css[i].cp, css[i].cin, css[i].cout, reason) for i, reason in sorted(reasons.items())]
+    )
+    removed = [(cs_ids[i],) for i in sorted(reasons)]
+    for table in _CS_Tables:
+        cursor.executemany(f"DELETE FROM {table} WHERE cs_id = ?;", removed)
+    cursor.executemany("DELETE FROM conversion_subprocess WHERE id = ?;", removed)
+
+    unused = "id NOT IN (SELECT cin_id FROM conversion_subprocess UNION SELECT cout_id FROM conversion_subprocess)"
+    cursor.execute(f"INSERT INTO pruned (set_name, name, reason) SELECT 'commodity', name, 'not used' FROM commodity WHERE {unused};")
+    n_commodities = cursor.rowcount
+    cursor.execute(f"DELETE FROM commodity WHERE {unused};")
+    conn.commit()
+    return {"conversion_subprocess": len(removed), "commodity": n_commodities}
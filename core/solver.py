@@ -0,0 +1,314 @@
+"""
+Solver Backends
+
+A backend owns the solver specific model object. It creates variable blocks,
+adds constraint families given as sparse matrices over all columns (in the
+order in which the variable blocks were created), solves the LP and returns
+the solution as one array. The status of a solve is one of the strings of
+Statuses for every solver.
+"""
+
+import time
+from abc import ABC, abstractmethod
+import numpy as np
+import scipy.sparse as sp
+import gurobipy as gp
+from gurobipy import GRB
+
+Statuses = ("optimal", "infeasible", "unbounded", "infeasible or unbounded", "iteration limit", "time limit", "interrupted", "suboptimal", "error")
+
+
+class SolverBackend(ABC):
+    name = None
+
+    def __init__(self, model_name: str = "DEModel", threads: int = None) -> None:
+        self.model_name = model_name
+        self.threads = threads
+        self.n_cols = 0
+        self.stats = {}
+        self.warm_start = False
+        self.simplex = False # dual simplex instead of the barrier, e.g. for LPs that are solved again after adding rows
+        self._values = None
+
+    @abstractmethod
+    def add_vars(self, name: str, shape: tuple):
+        """Adds a block of nonnegative continuous variables and returns its handle"""
+
+    @abstractmethod
+    def add_constrs(self, name: str, A: sp.csr_matrix, sense: str, rhs: np.ndarray):
+        """Adds the rows A x (sense) rhs, sense is one of '<', '>' or '='"""
+
+    @abstractmethod
+    def set_objective(self, cols: np.ndarray, coefs: np.ndarray) -> None:
+        """Sets the (minimized) objective coefficients of the given columns"""
+
+    @abstractmethod
+    def chg_coeffs(self, constrs, rows: np.ndarray, cols: np.ndarray, values: np.ndarray) -> None:
+        """Changes the coefficients (rows[i], cols[i]) of a constraint family, rows count within the family"""
+
+    @abstractmethod
+    def set_rhs(self, constrs, rows: np.ndarray, sense: str, rhs: np.ndarray) -> None:
+        """Changes the right-hand sides of the given rows of a constraint family"""
+
+    @abstractmethod
+    def set_start(self, cols: np.ndarray, values: np.ndarray) -> None:
+        """Sets primal start values of the given columns for the next solve"""
+
+    @abstractmethod
+    def _optimize(self) -> None:
+        """Runs the solver and sets stats["iterations"]"""
+
+    @abstractmethod
+    def _get_values(self) -> np.ndarray:
+        """Primal values of all columns from the solver"""
+
+    def solve(self) -> None:
+        self._values = None
+        st = time.time()
+        self._optimize()
+        self.stats["solve_time"] = time.time() - st
+        self.stats["status"] = self._status()
+
+    def get_values(self) -> np.ndarray:
+        """Primal values of all columns after solve"""
+        if self._values is None:
+            self._values = self._get_values()
+        return self._values
+
+    @abstractmethod
+    def _status(self) -> str:
+        """Status of the last solve, one of Statuses"""
+
+    def is_optimal(self) -> bool:
+        return self._status() == "optimal"
+
+    @abstractmethod
+    def get_duals(self, constrs) -> np.ndarray:
+        """Dual values (objective change per unit of right-hand side) of a constraint family after solve"""
+
+    @abstractmethod
+    def write(self, path) -> None:
+        """Writes the LP, the format is given by the file extension"""
+
+    @abstractmethod
+    def lp_size(self) -> dict:
+        """Number of rows, columns and nonzeros of the LP"""
+
+    @abstractmethod
+    def solver_stats(self) -> dict:
+        """Size of the LP and details of the last solve, e.g. for the profiler"""
+
+
+class GurobiBackend(SolverBackend):
+    name = "gurobi"
+    _Statuses = {
+        GRB.OPTIMAL: "optimal",
+        GRB.INFEASIBLE: "infeasible",
+        GRB.UNBOUNDED: "unbounded",
+        GRB.INF_OR_UNBD: "infeasible or unbounded",
+        GRB.ITERATION_LIMIT: "iteration limit",
+        GRB.TIME_LIMIT: "time limit",
+        GRB.INTERRUPTED: "interrupted",
+        GRB.SUBOPTIMAL: "suboptimal",
+    }
+
+    def __init__(self, model_name: str = "DEModel", threads: int = None) -> None:
+        super().__init__(model_name, threads)
+        self.model = gp.Model(model_name)
+        self._blocks = []
+        self._x = None
+
+    def add_vars(self, name: str, shape: tuple):
+        mvar = self.model.addMVar(shape, name=name)
+        self._blocks.append(mvar.reshape(-1))
+        self._x = None
+        self.n_cols += mvar.size
+        return mvar
+
+    def _all_vars(self):
+        if self._x is None:
+            self._x = gp.concatenate(self._blocks)
+        return self._x
+
+    def add_constrs(self, name: str, A: sp.csr_matrix, sense: str, rhs: np.ndarray):
+        return self.model.addMConstr(A, self._all_vars(), sense, rhs, name=name)
+
+    def set_objective(self, cols: np.ndarray, coefs: np.ndarray) -> None:
+        self._all_vars()[cols].Obj = coefs
+        self.model.ModelSense = GRB.MINIMIZE
+
+    def chg_coeffs(self, constrs, rows: np.ndarray, cols: np.ndarray, values: np.ndarray) -> None:
+        x = self._all_vars()
+        for constr, var, value in zip(constrs[rows].tolist(), x[cols].tolist(), np.asarray(values).tolist()):
+            self.model.chgCoeff(constr, var, value)
+
+    def set_rhs(self, constrs, rows: np.ndarray, sense: str, rhs: np.ndarray) -> None:
+        constrs[rows].RHS = rhs
+
+    def set_start(self, cols: np.ndarray, values: np.ndarray) -> None:
+        self._all_vars()[cols].PStart = values
+        self.warm_start = True
+
+    def _optimize(self) -> None:
+        if self.warm_start:
+            # barrier ignores start vectors, primal simplex starts from a basis crossed over from PStart
+            self.model.Params.Method = 0
+            self.model.Params.LPWarmStart = 2
+        elif self.simplex:
+            self.model.Params.Method = 1
+        else:
+            self.model.Params.Crossover = 0
+            self.model.Params.Method = 2 # Barrier https://www.gurobi.com/documentation/current/refman/method.html
+            self.model.Params.BarConvTol = 1e-6
+        if self.threads is not None:
+            self.model.Params.Threads = self.threads
+        self.model.optimize()
+        self.stats["iterations"] = int(self.model.IterCount) if self.warm_start or self.simplex else self.model.BarIterCount
+
+    def _get_values(self) -> np.ndarray:
+        return np.array(self.model.getAttr("X", self.model.getVars()), dtype=float)
+
+    def _status(self) -> str:
+        return self._Statuses.get(self.model.Status, "error")
+
+    def get_duals(self, constrs) -> np.ndarray:
+        return np.asarray(constrs.Pi, dtype=float)
+
+    def write(self, path) -> None:
+        self.model.write(str(path))
+
+    def lp_size(self) -> dict:
+        self.model.update()
+        return {"rows": self.model.NumConstrs, "columns": self.model.NumVars, "nonzeros": self.model.NumNZs}
+
+    def solver_stats(self) -> dict:
+        model = self.model
+        return {
+            "solver": self.name,
+            **self.lp_size(),
+            "status": self._status(),
+            "runtime": model.Runtime,
+            "barrier_iterations": model.BarIterCount,
+            "simplex_iterations": int(model.IterCount),
+            "objective": model.ObjVal if model.SolCount > 0 else None,
+        }
+
+
+class HighsBackend(SolverBackend):
+    name = "highs"
+    _Bounds = {
+        "<": lambda rhs: (np.full_like(rhs, -np.inf), rhs),
+        ">": lambda rhs: (rhs, np.full_like(rhs, np.inf)),
+        "=": lambda rhs: (rhs, rhs),
+    }
+
+    def __init__(self, model_name: str = "DEModel", threads: int = None) -> None:
+        super().__init__(model_name, threads)
+        try:
+            import highspy
+        except ImportError:
+            raise ImportError("The HiGHS backend requires highspy, install it with 'pip install highspy'")
+        self.model = highspy.Highs()
+        self.model.setOptionValue("output_flag", False)
+
+    def add_vars(self, name: str, shape: tuple):
+        size = int(np.prod(shape))
+        self.model.addVars(size, np.zeros(size), np.full(size, np.inf))
+        cols = np.arange(self.n_cols, self.n_cols + size).reshape(shape)
+        self.n_cols += size
+        return cols
+
+    def add_constrs(self, name: str, A: sp.csr_matrix, sense: str, rhs: np.ndarray):
+        A = sp.csr_matrix(A)
+        first_row = self.model.getNumRow()
+        lower, upper = self._Bounds[sense](np.asarray(rhs, dtype=float))
+        self.model.addRows(
+            A.shape[0], lower, upper, A.nnz,
+            A.indptr[:-1].astype(np.int32), A.indices.astype(np.int32), A.data.astype(float)
+        )
+        return np.arange(first_row, first_row + A.shape[0])
+
+    def set_objective(self, cols: np.ndarray, coefs: np.ndarray) -> None:
+        cols = np.asarray(cols, dtype=np.int32).ravel()
+        coefs = np.broadcast_to(np.asarray(coefs, dtype=float), cols.shape)
+        self.model.changeColsCost(len(cols), cols, np.ascontiguousarray(coefs))
+
+    def chg_coeffs(self, constrs, rows: np.ndarray, cols: np.ndarray, values: np.ndarray) -> None:
+        for row, col, value in zip(constrs[rows].tolist(), np.asarray(cols).tolist(), np.asarray(values).tolist()):
+            self.model.changeCoeff(row, col, value)
+
+    def set_rhs(self, constrs, rows: np.ndarray, sense: str, rhs: np.ndarray) -> None:
+        lower, upper = self._Bounds[sense](np.asarray(rhs, dtype=float))
+        rows = np.asarray(constrs[rows], dtype=np.int32)
+        self.model.changeRowsBounds(len(rows), rows, lower, upper)
+
+    def set_start(self, cols: np.ndarray, values: np.ndarray) -> None:
+        # neither the interior point solver nor the simplex of HiGHS starts from a primal point of an LP,
+        # a crossover from it needs the duals as well
+        raise NotImplementedError("HiGHS does not use start values for an LP, warm start with Gurobi instead")
+
+    def _optimize(self) -> None:
+        if self.simplex:
+            self.model.setOptionValue("solver", "simplex")
+            self.model.setOptionValue("simplex_strategy", 1) # dual
+        else:
+            # mirrors the Gurobi settings: interior point without crossover
+            self.model.setOptionValue("solver", "ipm")
+            self.model.setOptionValue("run_crossover", "off")
+            self.model.setOptionValue("ipm_optimality_tolerance", 1e-6)
+        if self.threads is not None:
+            self.model.setOptionValue("threads", self.threads)
+        self.model.run()
+        info = self.model.getInfo()
+        self.stats["iterations"] = info.simplex_iteration_count if self.simplex else info.ipm_iteration_count
+
+    def _get_values(self) -> np.ndarray:
+        return np.array(self.model.getSolution().col_value, dtype=float)
+
+    def _status(self) -> str:
+        import highspy
+        statuses = {
+            highspy.HighsModelStatus.kOptimal: "optimal",
+            highspy.HighsModelStatus.kInfeasible: "infeasible",
+            highspy.HighsModelStatus.kUnbounded: "unbounded",
+            highspy.HighsModelStatus.kUnboundedOrInfeasible: "infeasible or unbounded",
+            highspy.HighsModelStatus.kIterationLimit: "iteration limit",
+            highspy.HighsModelStatus.kTimeLimit: "time limit",
+            highspy.HighsModelStatus.kInterrupt: "interrupted",
+        }
+        return statuses.get(self.model.getModelStatus(), "error")
+
+    def get_duals(self, constrs) -> np.ndarray:
+        return np.array(self.model.getSolution().row_dual, dtype=float)[constrs]
+
+    def write(self, path) -> None:
+        self.model.writeModel(str(path))
+
+    def lp_size(self) -> dict:
+        return {"rows": self.model.getNumRow(), "columns": self.model.getNumCol(), "nonzeros": self.model.getNumNz()}
+
+    def solver_stats(self) -> dict:
+        model = self.model
+        info = model.getInfo()
+        return {
+            "solver": self.name,
+            **self.lp_size(),
+            "status": self._status(),
+            "runtime": model.getRunTime(),
+            "barrier_iterations": info.ipm_iteration_count,
+            "simplex_iterations": info.simplex_iteration_count,
+            "crossover_iterations": info.crossover_iteration_count,
+            "objective": info.objective_function_value,
+        }
+
+
+Solvers = {
+    "gurobi": GurobiBackend,
+    "highs": HighsBackend,
+}
+
+
+def get_backend(solver: str, model_name: str = "DEModel", threads: int = None) -> SolverBackend:
+    if solver not in Solvers:
+        raise ValueError(f"Unknown solver {solver}, available solvers: {list(Solvers)}")
+    return Solvers[solver](model_name, threads)
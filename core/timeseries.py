@@ -0,0 +1,66 @@
+"""
+Time Series Loader
+
+Reads the whitespace separated text files of Data/TimeSeries and keeps a
+binary copy (.npy) of every parsed file in a cache directory. The cache entry
+is keyed by the resolved path, modification time and size of the text file,
+so editing a file invalidates its entry; the outdated entries of a file are
+removed when its new one is written. Cached arrays are memory-mapped, and
+each file is parsed at most once per process.
+"""
+
+import os
+import glob
+import hashlib
+import numpy as np
+from pathlib import Path
+
+
+class TimeSeriesLoader():
+    # arrays loaded in this process, shared by all loaders
+    _loaded = {}
+
+    def __init__(self, cache_dir: Path = None) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+
+    @staticmethod
+    def _key(path: Path) -> str:
+        stat = path.stat()
+        fingerprint = f"{path.resolve()}|{stat.st_mtime_ns}|{stat.st_size}"
+        return hashlib.sha1(fingerprint.encode()).hexdigest()
+
+    def load(self, path: Path) -> np.ndarray:
+        """Values of a time series file as a read-only float array"""
+        path = Path(path)
+        key = self._key(path)
+        if key in self._loaded:
+            return self._loaded[key]
+
+        cache_path = self.cache_dir.joinpath(f"{path.stem}-{key[:16]}.npy") if self.cache_dir else None
+        if cache_path is not None and cache_path.exists():
+            values = np.load(cache_path, mmap_mode="r")
+        else:
+            with open(path) as file:
+                values = np.array(file.read().split(), dtype=float)
+            values.setflags(write=False)
+            if cache_path is not None:
+                self._write_cache(cache_path, values)
+        self._loaded[key] = values
+        return values
+
+    def _write_cache(self, cache_path: Path, values: np.ndarray) -> None:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(f"{cache_path.stem}.{os.getpid()}.tmp.npy")
+            np.save(tmp_path, values)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            return # the cache is optional, e.g. for read-only data directories
+        # entries of earlier versions of the file, <stem>-<16 hex digits>.npy
+        stem = cache_path.stem.rsplit("-", 1)[0]
+        for old_path in cache_path.parent.glob(f"{glob.escape(stem)}-{'[0-9a-f]' * 16}.npy"):
+            if old_path != cache_path:
+                try:
+                    old_path.unlink(missing_ok=True)
+                except OSError:
+                    pass # e.g. still memory-mapped on Windows
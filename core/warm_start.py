@@ -0,0 +1,47 @@
+"""
+Warm Start from previous runs
+
+Reads the primal values saved in the output tables of a run database and maps
+them by name (subprocess, commodity, year and time step) onto the index sets
+of a new model. Entries of the previous run that do not exist in the new
+model are ignored.
+"""
+
+import sqlite3
+import numpy as np
+from pathlib import Path
+from core.data_access import DAO
+from core.params import Output_Index_Dict, Set_Names
+
+
+def read_start_values(db_path: Path, sets: dict) -> dict:
+    """
+    Start values of every output variable as arrays shaped like the index sets
+    of the new model (sets maps "CS", "CO", "Y" and "T" to its set elements).
+    Entries whose indices do not all exist in the previous run are NaN, matched
+    entries without a saved row were zero in the previous run.
+    """
+    db_path = Path(db_path)
+    if not db_path.exists():
+        raise FileNotFoundError(f"Run database {db_path} does not exist")
+    conn = sqlite3.connect(db_path)
+    old_dao = DAO(conn)
+    old_sets = {index: set(old_dao.get_set(set_name)) for index, set_name in Set_Names.items()}
+
+    starts = {}
+    for name, indexes in Output_Index_Dict.items():
+        if not indexes:
+            starts[name] = np.array(old_dao.iter_row(name)[0], dtype=float)
+            continue
+        new_sets = [sets[index] for index in indexes]
+        positions = [{x: i for i, x in enumerate(s)} for s in new_sets]
+        values = np.full([len(s) for s in new_sets], np.nan)
+        matched = [np.array([x in old_sets[index] for x in s], dtype=bool) for index, s in zip(indexes, new_sets)]
+        values[np.ix_(*matched)] = 0
+        for *index, value in old_dao.iter_row(name):
+            pos = tuple(p.get(x) for p, x in zip(positions, index))
+            if None not in pos:
+                values[pos] = value
+        starts[name] = values
+    conn.close()
+    return starts
@@ -35,6 +35,9 @@ An example of the German energy system is also provided. The results of the mode
         "InquirerPy",
         "pyarrow"
     ],
+    extras_require={
+        "highs": ["highspy"],
+    },
     # Metadata
     author=['Sina Hajikazemi','Julia Barbosa'],
     author_email='sina.hkazemi@email.com',